@@ -0,0 +1,46 @@
+"""image_generation_jobs
+
+Revision ID: 1d6a9e4c3b27
+Revises: e5b2f8a17c34
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1d6a9e4c3b27'
+down_revision: Union[str, None] = 'e5b2f8a17c34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS image_generation_jobs (
+            id VARCHAR(32) PRIMARY KEY,
+            post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+            organization_id INTEGER NOT NULL,
+            kind VARCHAR(20) NOT NULL,
+            status VARCHAR(20) DEFAULT 'queued',
+            visual_suggestion TEXT,
+            image_format VARCHAR(20) DEFAULT '1080x1080',
+            is_carousel BOOLEAN DEFAULT false,
+            num_slides INTEGER DEFAULT 1,
+            completed_slides INTEGER DEFAULT 0,
+            prompts JSON,
+            images JSON,
+            errors JSON,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            started_at TIMESTAMP WITH TIME ZONE,
+            finished_at TIMESTAMP WITH TIME ZONE
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_image_generation_jobs_post_id ON image_generation_jobs (post_id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS image_generation_jobs")
@@ -0,0 +1,36 @@
+"""document_chunks full-text search column and indexes
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9d7b10'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        ALTER TABLE document_chunks
+        ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('italian', content)) STORED
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_document_chunks_content_tsv ON document_chunks USING gin (content_tsv)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_document_chunks_brand_id ON document_chunks (brand_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id ON document_chunks (document_id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_document_chunks_document_id")
+    op.execute("DROP INDEX IF EXISTS ix_document_chunks_brand_id")
+    op.execute("DROP INDEX IF EXISTS ix_document_chunks_content_tsv")
+    op.execute("ALTER TABLE document_chunks DROP COLUMN IF EXISTS content_tsv")
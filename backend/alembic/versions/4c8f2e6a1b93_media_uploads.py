@@ -0,0 +1,46 @@
+"""resumable chunked uploads: media_uploads
+
+Revision ID: 4c8f2e6a1b93
+Revises: 9b3e5d1a7f42
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8f2e6a1b93'
+down_revision: Union[str, None] = '9b3e5d1a7f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS media_uploads (
+            id VARCHAR(32) PRIMARY KEY,
+            post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+            organization_id INTEGER NOT NULL,
+            filename VARCHAR(255),
+            content_type VARCHAR(100) NOT NULL,
+            ext VARCHAR(10) NOT NULL,
+            size BIGINT NOT NULL,
+            "offset" BIGINT NOT NULL DEFAULT 0,
+            sha256 VARCHAR(64),
+            status VARCHAR(20) DEFAULT 'uploading',
+            media_url VARCHAR(500),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            completed_at TIMESTAMP WITH TIME ZONE
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_media_uploads_post_id ON media_uploads (post_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_media_uploads_status_expires ON media_uploads (status, expires_at)")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS media_uploads")
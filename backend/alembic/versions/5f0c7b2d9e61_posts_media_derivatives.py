@@ -0,0 +1,26 @@
+"""posts media_derivatives
+
+Revision ID: 5f0c7b2d9e61
+Revises: 1d6a9e4c3b27
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f0c7b2d9e61'
+down_revision: Union[str, None] = '1d6a9e4c3b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE posts ADD COLUMN IF NOT EXISTS media_derivatives JSON")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS media_derivatives")
@@ -0,0 +1,56 @@
+"""posts/post_tombstones version_xid for the delta sync horizon
+
+Revision ID: 6d2b8f4e1a93
+Revises: a2c6e9f1b4d7
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d2b8f4e1a93'
+down_revision: Union[str, None] = 'a2c6e9f1b4d7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Senza DEFAULT in ADD COLUMN: le righe esistenti restano NULL (già consegnate dalla sync completa)
+    for table in ("posts", "post_tombstones"):
+        op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS version_xid xid8")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN version_xid SET DEFAULT pg_current_xact_id()")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_project_version_xid ON posts (project_id, version_xid)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_post_tombstones_project_version_xid "
+        "ON post_tombstones (project_id, version_xid)"
+    )
+    op.execute("""
+        CREATE OR REPLACE FUNCTION posts_bump_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := nextval('post_version_seq');
+            NEW.version_xid := pg_current_xact_id();
+            NEW.updated_at := now();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION posts_bump_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := nextval('post_version_seq');
+            NEW.updated_at := now();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("DROP INDEX IF EXISTS ix_post_tombstones_project_version_xid")
+    op.execute("DROP INDEX IF EXISTS ix_posts_project_version_xid")
+    for table in ("posts", "post_tombstones"):
+        op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS version_xid")
@@ -0,0 +1,68 @@
+"""posts scheduled_at (timezone-aware) with trigger and due-queue index
+
+Revision ID: 7e2a9c4f5d18
+Revises: 4c8f2e6a1b93
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e2a9c4f5d18'
+down_revision: Union[str, None] = '4c8f2e6a1b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Copia fissa di POST_SCHEDULED_AT_SQL (app.models.post) con il fuso di default di
+# SCHEDULER_TIMEZONE: la migrazione non deve cambiare con la configurazione di chi la esegue
+SCHEDULED_AT_SQL = """
+CREATE OR REPLACE FUNCTION posts_scheduled_at(d date, t text) RETURNS timestamptz AS $$
+DECLARE
+    hhmm text;
+BEGIN
+    hhmm := substring(t from '^\\s*(\\d{1,2}[:.]\\d{2})');
+    IF d IS NULL OR hhmm IS NULL THEN
+        RETURN NULL;
+    END IF;
+    RETURN (d + replace(hhmm, '.', ':')::time) AT TIME ZONE 'Europe/Rome';
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION posts_set_scheduled_at() RETURNS trigger AS $$
+BEGIN
+    NEW.scheduled_at := posts_scheduled_at(NEW.scheduled_date, NEW.scheduled_time);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_set_scheduled_at ON posts;
+CREATE TRIGGER posts_set_scheduled_at
+    BEFORE INSERT OR UPDATE OF scheduled_date, scheduled_time ON posts
+    FOR EACH ROW EXECUTE FUNCTION posts_set_scheduled_at();
+"""
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE posts ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMP WITH TIME ZONE")
+    op.execute(SCHEDULED_AT_SQL)
+    # Backfill passando dal trigger: scheduled_date non cambia, quindi posts_bump_version
+    # (valutato prima, in ordine alfabetico) non assegna nuove versioni a tutti i post
+    op.execute("UPDATE posts SET scheduled_date = scheduled_date")
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_posts_due ON posts (scheduled_at)
+        WHERE publication_status IN ('scheduled', 'pending', 'draft', 'publishing')
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_posts_due")
+    op.execute("DROP TRIGGER IF EXISTS posts_set_scheduled_at ON posts")
+    op.execute("DROP FUNCTION IF EXISTS posts_set_scheduled_at()")
+    op.execute("DROP FUNCTION IF EXISTS posts_scheduled_at(date, text)")
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS scheduled_at")
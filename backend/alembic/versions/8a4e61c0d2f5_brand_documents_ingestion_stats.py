@@ -0,0 +1,50 @@
+"""brand_documents denormalized ingestion stats
+
+Revision ID: 8a4e61c0d2f5
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4e61c0d2f5'
+down_revision: Union[str, None] = '3f1c2a9d7b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE brand_documents ADD COLUMN IF NOT EXISTS chunks_count INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE brand_documents ADD COLUMN IF NOT EXISTS total_tokens INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE brand_documents ADD COLUMN IF NOT EXISTS embedding_bytes BIGINT NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE brand_documents ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMP WITH TIME ZONE")
+    op.execute("""
+        UPDATE brand_documents bd
+        SET chunks_count = s.chunks_count,
+            total_tokens = s.total_tokens,
+            embedding_bytes = s.chunks_count::bigint * 1536 * 4,
+            ingested_at = s.ingested_at
+        FROM (
+            SELECT document_id,
+                   COUNT(*) AS chunks_count,
+                   COALESCE(SUM(token_count), 0) AS total_tokens,
+                   MAX(created_at) AS ingested_at
+            FROM document_chunks
+            GROUP BY document_id
+        ) s
+        WHERE s.document_id = bd.id
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_brand_documents_brand_uploaded ON brand_documents (brand_id, uploaded_at, id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_brand_documents_brand_uploaded")
+    op.execute("ALTER TABLE brand_documents DROP COLUMN IF EXISTS ingested_at")
+    op.execute("ALTER TABLE brand_documents DROP COLUMN IF EXISTS embedding_bytes")
+    op.execute("ALTER TABLE brand_documents DROP COLUMN IF EXISTS total_tokens")
+    op.execute("ALTER TABLE brand_documents DROP COLUMN IF EXISTS chunks_count")
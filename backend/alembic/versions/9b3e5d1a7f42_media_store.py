@@ -0,0 +1,48 @@
+"""content-addressed media store: media_blobs, media_references
+
+Revision ID: 9b3e5d1a7f42
+Revises: 5f0c7b2d9e61
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e5d1a7f42'
+down_revision: Union[str, None] = '5f0c7b2d9e61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS media_blobs (
+            sha256 VARCHAR(64) PRIMARY KEY,
+            ext VARCHAR(10) NOT NULL,
+            content_type VARCHAR(100),
+            size BIGINT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            last_written_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS media_references (
+            id SERIAL PRIMARY KEY,
+            sha256 VARCHAR(64) NOT NULL REFERENCES media_blobs(sha256) ON DELETE CASCADE,
+            post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+            role VARCHAR(20) NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            CONSTRAINT uq_media_references_blob_post_role UNIQUE (sha256, post_id, role)
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_media_references_sha256 ON media_references (sha256)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_media_references_post_id ON media_references (post_id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS media_references")
+    op.execute("DROP TABLE IF EXISTS media_blobs")
@@ -0,0 +1,54 @@
+"""social_connections token refresh: refresh state, expiry index, encrypted tokens
+
+Revision ID: a2c6e9f1b4d7
+Revises: f4a8c2d6e913
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.crypto import ENCRYPTED_PREFIX, encrypt_secret, get_cipher
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2c6e9f1b4d7'
+down_revision: Union[str, None] = 'f4a8c2d6e913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE social_connections ADD COLUMN IF NOT EXISTS refresh_token_expires_at TIMESTAMP WITH TIME ZONE")
+    op.execute("ALTER TABLE social_connections ADD COLUMN IF NOT EXISTS token_refreshed_at TIMESTAMP WITH TIME ZONE")
+    op.execute("ALTER TABLE social_connections ADD COLUMN IF NOT EXISTS refresh_attempted_at TIMESTAMP WITH TIME ZONE")
+    op.execute("ALTER TABLE social_connections ADD COLUMN IF NOT EXISTS refresh_error TEXT")
+    op.execute("ALTER TABLE social_connections ADD COLUMN IF NOT EXISTS needs_reauth BOOLEAN NOT NULL DEFAULT false")
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_social_connections_token_expires_at
+        ON social_connections (token_expires_at) WHERE is_active
+    """)
+
+    # Cifra i token salvati in chiaro (se ENCRYPTION_KEY è configurata)
+    if get_cipher() is None:
+        return
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT id, access_token, refresh_token FROM social_connections "
+        "WHERE access_token NOT LIKE :prefix OR refresh_token NOT LIKE :prefix"
+    ), {"prefix": f"{ENCRYPTED_PREFIX}%"}).all()
+    for connection_id, access_token, refresh_token in rows:
+        bind.execute(sa.text(
+            "UPDATE social_connections SET access_token = :access_token, refresh_token = :refresh_token WHERE id = :id"
+        ), {"id": connection_id, "access_token": encrypt_secret(access_token), "refresh_token": encrypt_secret(refresh_token)})
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_social_connections_token_expires_at")
+    op.execute("ALTER TABLE social_connections DROP COLUMN IF EXISTS needs_reauth")
+    op.execute("ALTER TABLE social_connections DROP COLUMN IF EXISTS refresh_error")
+    op.execute("ALTER TABLE social_connections DROP COLUMN IF EXISTS refresh_attempted_at")
+    op.execute("ALTER TABLE social_connections DROP COLUMN IF EXISTS token_refreshed_at")
+    op.execute("ALTER TABLE social_connections DROP COLUMN IF EXISTS refresh_token_expires_at")
@@ -0,0 +1,33 @@
+"""post_publications as scheduler unit of work: (status, scheduled_for) index and leases
+
+Revision ID: b3d7f1e8c265
+Revises: 7e2a9c4f5d18
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3d7f1e8c265'
+down_revision: Union[str, None] = '7e2a9c4f5d18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE post_publications ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(100)")
+    op.execute("ALTER TABLE post_publications ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP WITH TIME ZONE")
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_post_publications_status_scheduled_for
+        ON post_publications (status, scheduled_for)
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_post_publications_status_scheduled_for")
+    op.execute("ALTER TABLE post_publications DROP COLUMN IF EXISTS lease_until")
+    op.execute("ALTER TABLE post_publications DROP COLUMN IF EXISTS lease_owner")
@@ -0,0 +1,29 @@
+"""posts keyset index on (project_id, scheduled_date, scheduled_time, id)
+
+Revision ID: c7d93b2e4a18
+Revises: 8a4e61c0d2f5
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d93b2e4a18'
+down_revision: Union[str, None] = '8a4e61c0d2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_posts_project_schedule "
+        "ON posts (project_id, COALESCE(scheduled_date, '9999-12-31'::date), COALESCE(scheduled_time, ''), id)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_posts_project_schedule")
@@ -0,0 +1,31 @@
+"""post_publications retry queue: next_retry_at and partial index
+
+Revision ID: d91c4a7e2f56
+Revises: b3d7f1e8c265
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd91c4a7e2f56'
+down_revision: Union[str, None] = 'b3d7f1e8c265'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE post_publications ADD COLUMN IF NOT EXISTS next_retry_at TIMESTAMP WITH TIME ZONE")
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_post_publications_retry
+        ON post_publications (next_retry_at) WHERE status = 'retrying'
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_post_publications_retry")
+    op.execute("ALTER TABLE post_publications DROP COLUMN IF EXISTS next_retry_at")
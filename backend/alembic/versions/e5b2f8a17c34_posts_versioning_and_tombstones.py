@@ -0,0 +1,83 @@
+"""posts updated_at/version, post_tombstones and version triggers
+
+Revision ID: e5b2f8a17c34
+Revises: c7d93b2e4a18
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b2f8a17c34'
+down_revision: Union[str, None] = 'c7d93b2e4a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE SEQUENCE IF NOT EXISTS post_version_seq")
+    op.execute("ALTER TABLE posts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()")
+    op.execute("UPDATE posts SET updated_at = COALESCE(created_at, now())")
+    # DEFAULT volatile: ogni riga esistente riceve una versione distinta
+    op.execute("ALTER TABLE posts ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('post_version_seq')")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_posts_project_version ON posts (project_id, version)")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS post_tombstones (
+            id SERIAL PRIMARY KEY,
+            post_id INTEGER NOT NULL,
+            project_id INTEGER NOT NULL,
+            version BIGINT NOT NULL,
+            deleted_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_post_tombstones_project_version ON post_tombstones (project_id, version)")
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION posts_bump_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := nextval('post_version_seq');
+            NEW.updated_at := now();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION posts_record_tombstone() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO post_tombstones (post_id, project_id, version, deleted_at)
+            VALUES (OLD.id, OLD.project_id, nextval('post_version_seq'), now());
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    # Confronto via jsonb: le colonne json non hanno operatore di uguaglianza
+    op.execute("DROP TRIGGER IF EXISTS posts_bump_version ON posts")
+    op.execute("""
+        CREATE TRIGGER posts_bump_version
+            BEFORE UPDATE ON posts
+            FOR EACH ROW WHEN (to_jsonb(OLD) IS DISTINCT FROM to_jsonb(NEW))
+            EXECUTE FUNCTION posts_bump_version()
+    """)
+    op.execute("DROP TRIGGER IF EXISTS posts_record_tombstone ON posts")
+    op.execute("""
+        CREATE TRIGGER posts_record_tombstone
+            AFTER DELETE ON posts
+            FOR EACH ROW EXECUTE FUNCTION posts_record_tombstone()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS posts_record_tombstone ON posts")
+    op.execute("DROP TRIGGER IF EXISTS posts_bump_version ON posts")
+    op.execute("DROP FUNCTION IF EXISTS posts_record_tombstone()")
+    op.execute("DROP FUNCTION IF EXISTS posts_bump_version()")
+    op.execute("DROP TABLE IF EXISTS post_tombstones")
+    op.execute("DROP INDEX IF EXISTS ix_posts_project_version")
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS version")
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS updated_at")
+    op.execute("DROP SEQUENCE IF EXISTS post_version_seq")
@@ -0,0 +1,32 @@
+"""post_publications staging: staged_media, staged_at, staging_error, from_calendar
+
+Revision ID: f4a8c2d6e913
+Revises: d91c4a7e2f56
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4a8c2d6e913'
+down_revision: Union[str, None] = 'd91c4a7e2f56'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE post_publications ADD COLUMN IF NOT EXISTS from_calendar BOOLEAN NOT NULL DEFAULT false")
+    op.execute("ALTER TABLE post_publications ADD COLUMN IF NOT EXISTS staged_media JSON")
+    op.execute("ALTER TABLE post_publications ADD COLUMN IF NOT EXISTS staged_at TIMESTAMP WITH TIME ZONE")
+    op.execute("ALTER TABLE post_publications ADD COLUMN IF NOT EXISTS staging_error TEXT")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE post_publications DROP COLUMN IF EXISTS staging_error")
+    op.execute("ALTER TABLE post_publications DROP COLUMN IF EXISTS staged_at")
+    op.execute("ALTER TABLE post_publications DROP COLUMN IF EXISTS staged_media")
+    op.execute("ALTER TABLE post_publications DROP COLUMN IF EXISTS from_calendar")
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Query, Response
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
@@ -7,12 +8,13 @@ import os
 import uuid
 from pathlib import Path
 
-from app.core.database import get_db
+from app.core.database import get_async_db, run_with_session
 from app.core.config import settings
+from app.core.pagination import encode_cursor, decode_cursor
 from app.models.user import User
 from app.models.brand import Brand
 from app.models.brand_document import BrandDocument, DocumentChunk
-from app.api.routes.auth import get_current_user
+from app.core.security import get_current_user_async
 from app.services.rag_service import rag_service, UPLOAD_DIR
 
 router = APIRouter()
@@ -32,13 +34,26 @@ class DocumentOut(BaseModel):
     summary: Optional[str]
     key_topics: Optional[dict]
     chunks_count: Optional[int] = 0
+    total_tokens: Optional[int] = 0
+    embedding_bytes: Optional[int] = 0
+    ingested_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
+class KnowledgeBaseSummary(BaseModel):
+    brand_id: int
+    documents: int
+    documents_failed: int
+    chunks: int
+    tokens: int
+    embedding_bytes: int
+    last_ingested_at: Optional[datetime]
+
 class SearchQuery(BaseModel):
     query: str
     limit: int = 5
+    mode: str = "auto"  # auto, lexical, vector, hybrid
 
 class SearchResult(BaseModel):
     content: str
@@ -53,16 +68,16 @@ async def upload_document(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     description: str = Form(None),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Carica un documento per un brand"""
     
     # Verifica brand
-    brand = db.query(Brand).filter(
+    brand = await db.scalar(select(Brand).where(
         Brand.id == brand_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not brand:
         raise HTTPException(status_code=404, detail="Brand non trovato")
@@ -99,8 +114,8 @@ async def upload_document(
         uploaded_by_user_id=current_user.id
     )
     db.add(document)
-    db.commit()
-    db.refresh(document)
+    await db.commit()
+    await db.refresh(document)
     
     # Processa in background
     background_tasks.add_task(process_document_task, document.id)
@@ -129,70 +144,104 @@ async def process_document_task(document_id: int):
 @router.get("/list/{brand_id}", response_model=List[DocumentOut])
 async def list_documents(
     brand_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    file_type: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
-    """Lista documenti di un brand"""
+    """
+    Lista documenti di un brand (più recenti prima).
+    Con limit: paginazione keyset, il cursore della pagina successiva è nell'header X-Next-Cursor
+    (senza limit la lista è completa).
+    """
     
     # Verifica brand
-    brand = db.query(Brand).filter(
+    brand = await db.scalar(select(Brand).where(
+        Brand.id == brand_id,
+        Brand.organization_id == current_user.organization_id
+    ))
+    
+    if not brand:
+        raise HTTPException(status_code=404, detail="Brand non trovato")
+    
+    query = select(BrandDocument).where(BrandDocument.brand_id == brand_id)
+    if status:
+        query = query.where(BrandDocument.extraction_status == status)
+    if file_type:
+        query = query.where(BrandDocument.file_type == file_type.lower())
+    if cursor:
+        cursor_uploaded_at, cursor_id = decode_cursor(cursor, (datetime, int))
+        query = query.where(
+            tuple_(BrandDocument.uploaded_at, BrandDocument.id) < tuple_(cursor_uploaded_at, cursor_id)
+        )
+    
+    query = query.order_by(BrandDocument.uploaded_at.desc(), BrandDocument.id.desc())
+    if limit:
+        query = query.limit(limit + 1)
+    documents = (await db.scalars(query)).all()
+    
+    if limit and len(documents) > limit:
+        documents = documents[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor([documents[-1].uploaded_at, documents[-1].id])
+    
+    return documents
+
+
+@router.get("/summary/{brand_id}", response_model=KnowledgeBaseSummary)
+async def knowledge_base_summary(
+    brand_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Statistiche aggregate della knowledge base del brand"""
+    
+    brand = await db.scalar(select(Brand).where(
         Brand.id == brand_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not brand:
         raise HTTPException(status_code=404, detail="Brand non trovato")
     
-    documents = db.query(BrandDocument).filter(
-        BrandDocument.brand_id == brand_id
-    ).order_by(BrandDocument.uploaded_at.desc()).all()
-    
-    # Aggiungi count chunks
-    result = []
-    for doc in documents:
-        chunks_count = db.query(DocumentChunk).filter(
-            DocumentChunk.document_id == doc.id
-        ).count()
-        
-        doc_dict = {
-            "id": doc.id,
-            "filename": doc.filename,
-            "original_filename": doc.original_filename,
-            "file_type": doc.file_type,
-            "file_size": doc.file_size,
-            "extraction_status": doc.extraction_status,
-            "analysis_status": doc.analysis_status,
-            "uploaded_at": doc.uploaded_at,
-            "description": doc.description,
-            "summary": doc.summary,
-            "key_topics": doc.key_topics,
-            "chunks_count": chunks_count
-        }
-        result.append(doc_dict)
-    
-    return result
+    row = (await db.execute(select(
+        func.count(BrandDocument.id),
+        func.count(BrandDocument.id).filter(BrandDocument.extraction_status == "failed"),
+        func.coalesce(func.sum(BrandDocument.chunks_count), 0),
+        func.coalesce(func.sum(BrandDocument.total_tokens), 0),
+        func.coalesce(func.sum(BrandDocument.embedding_bytes), 0),
+        func.max(BrandDocument.ingested_at)
+    ).where(BrandDocument.brand_id == brand_id))).one()
+    
+    return {
+        "brand_id": brand_id,
+        "documents": row[0],
+        "documents_failed": row[1],
+        "chunks": row[2],
+        "tokens": row[3],
+        "embedding_bytes": row[4],
+        "last_ingested_at": row[5]
+    }
 
 
 @router.get("/{document_id}")
 async def get_document(
     document_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Dettaglio documento"""
     
-    document = db.query(BrandDocument).join(Brand).filter(
+    document = await db.scalar(select(BrandDocument).join(Brand).where(
         BrandDocument.id == document_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not document:
         raise HTTPException(status_code=404, detail="Documento non trovato")
     
-    chunks_count = db.query(DocumentChunk).filter(
-        DocumentChunk.document_id == document_id
-    ).count()
-    
     return {
         "id": document.id,
         "original_filename": document.original_filename,
@@ -204,22 +253,25 @@ async def get_document(
         "description": document.description,
         "summary": document.summary,
         "key_topics": document.key_topics,
-        "chunks_count": chunks_count
+        "chunks_count": document.chunks_count,
+        "total_tokens": document.total_tokens,
+        "embedding_bytes": document.embedding_bytes,
+        "ingested_at": document.ingested_at
     }
 
 
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Elimina documento"""
     
-    document = db.query(BrandDocument).join(Brand).filter(
+    document = await db.scalar(select(BrandDocument).join(Brand).where(
         BrandDocument.id == document_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not document:
         raise HTTPException(status_code=404, detail="Documento non trovato")
@@ -231,8 +283,8 @@ async def delete_document(
         pass
     
     # Elimina da DB (cascade elimina anche chunks)
-    db.delete(document)
-    db.commit()
+    await db.delete(document)
+    await db.commit()
     
     return {"message": "Documento eliminato"}
 
@@ -241,25 +293,31 @@ async def delete_document(
 async def search_documents(
     brand_id: int,
     query: SearchQuery,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
-    """Cerca nei documenti del brand (semantic search)"""
+    """Cerca nei documenti del brand (full-text, semantica o ibrida)"""
     
     # Verifica brand
-    brand = db.query(Brand).filter(
+    brand = await db.scalar(select(Brand).where(
         Brand.id == brand_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not brand:
         raise HTTPException(status_code=404, detail="Brand non trovato")
     
-    # Cerca
-    results = rag_service.search_similar(db, brand_id, query.query, query.limit)
+    if query.mode not in ("auto", "lexical", "vector", "hybrid"):
+        raise HTTPException(status_code=400, detail="Modalità di ricerca non valida")
+    
+    # Cerca (servizio sincrono con embedding OpenAI: in un thread con sessione propria)
+    results = await run_with_session(
+        rag_service.search, brand_id, query.query, query.limit, query.mode
+    )
     
     return {
         "query": query.query,
+        "mode": query.mode,
         "results": results
     }
 
@@ -268,15 +326,15 @@ async def search_documents(
 async def reprocess_document(
     document_id: int,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Riprocessa un documento"""
     
-    document = db.query(BrandDocument).join(Brand).filter(
+    document = await db.scalar(select(BrandDocument).join(Brand).where(
         BrandDocument.id == document_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not document:
         raise HTTPException(status_code=404, detail="Documento non trovato")
@@ -284,10 +342,13 @@ async def reprocess_document(
     # Reset status
     document.extraction_status = "pending"
     document.analysis_status = "pending"
+    document.chunks_count = 0
+    document.total_tokens = 0
+    document.embedding_bytes = 0
     
     # Elimina vecchi chunks
-    db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
-    db.commit()
+    await db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+    await db.commit()
     
     # Riprocessa
     background_tasks.add_task(process_document_task, document_id)
@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from io import BytesIO
 from datetime import datetime
 
-from app.core.database import get_db
-from app.core.security import get_current_user
+from app.core.database import get_async_db
+from app.core.security import get_current_user_async
 from app.models.user import User
 from app.models.project import Project
 from app.models.post import Post
@@ -18,22 +19,24 @@ router = APIRouter()
 @router.get("/excel/{project_id}")
 async def export_project_excel(
     project_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Esporta il calendario in Excel"""
     
     # Verifica accesso
-    project = db.query(Project).join(Brand).filter(
+    project = await db.scalar(select(Project).join(Brand).where(
         Project.id == project_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not project:
         raise HTTPException(status_code=404, detail="Progetto non trovato")
     
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
-    posts = db.query(Post).filter(Post.project_id == project_id).order_by(Post.scheduled_date, Post.scheduled_time).all()
+    brand = await db.get(Brand, project.brand_id)
+    posts = (await db.scalars(
+        select(Post).where(Post.project_id == project_id).order_by(Post.scheduled_date, Post.scheduled_time)
+    )).all()
     
     # Crea workbook
     wb = Workbook()
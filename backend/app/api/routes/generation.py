@@ -1,6 +1,7 @@
 from datetime import date
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import Optional
 import threading
@@ -11,7 +12,7 @@ logger = logging.getLogger(__name__)
 
 import asyncio
 
-from app.core.database import get_db, SessionLocal
+from app.core.database import get_db, get_async_db, SessionLocal
 from app.models.project import Project, ProjectStatus
 from app.models.post import Post
 from app.models.brand import Brand
@@ -21,6 +22,7 @@ from app.services.generation_tracker import update_generation_status, get_genera
 from app.services.persona_analyzer import analyze_buyer_personas, get_default_personas
 from app.services.url_analyzer import get_brand_context_from_urls
 from app.api.routes.auth import get_current_user
+from app.core.security import get_current_user_async
 
 router = APIRouter()
 
@@ -44,21 +46,24 @@ class ConfirmPersonasRequest(BaseModel):
 @router.post("/personas/{project_id}")
 async def generate_personas(
     project_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """
     Genera buyer personas per il progetto.
     L'utente dovrà confermarle prima di generare il calendario.
     """
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
+    brand = await db.get(Brand, project.brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail="Brand not found")
     
+    # Nessuna scrittura finora: rilascia la connessione durante la chiamata al modello
+    await db.commit()
+    
     logger.info(f"[PERSONAS] Generating for project {project_id} - Brand: {brand.name}")
     
     # Analizza URL di riferimento
@@ -100,7 +105,7 @@ async def generate_personas(
         # Filtra solo le piattaforme selezionate
         recommended = personas_data["recommended_posts_per_week"]
         project.posts_per_week = {p: recommended.get(p, 3) for p in (project.platforms or [])}
-    db.commit()
+    await db.commit()
     
     logger.info(f"[PERSONAS] Generated {len(personas_data.get('personas', []))} personas")
     
@@ -115,20 +120,23 @@ async def generate_personas(
 async def regenerate_personas(
     project_id: int,
     request: RegeneratePersonasRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """
     Rigenera buyer personas con feedback dell'utente.
     """
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
+    brand = await db.get(Brand, project.brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail="Brand not found")
     
+    # Nessuna scrittura finora: rilascia la connessione durante la chiamata al modello
+    await db.commit()
+    
     logger.info(f"[PERSONAS] Regenerating with feedback: {request.feedback[:100]}...")
     
     # Analizza URL
@@ -170,7 +178,7 @@ async def regenerate_personas(
         # Filtra solo le piattaforme selezionate
         recommended = personas_data["recommended_posts_per_week"]
         project.posts_per_week = {p: recommended.get(p, 3) for p in (project.platforms or [])}
-    db.commit()
+    await db.commit()
     
     return {
         "status": "regenerated",
@@ -183,13 +191,13 @@ async def regenerate_personas(
 async def confirm_personas(
     project_id: int,
     request: Optional[ConfirmPersonasRequest] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """
     Conferma le buyer personas (eventualmente modificate manualmente).
     """
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -202,7 +210,7 @@ async def confirm_personas(
         project.buyer_personas["confirmed"] = True
         project.buyer_personas["confirmed_at"] = __import__('datetime').datetime.now().isoformat()
     
-    db.commit()
+    await db.commit()
     
     return {
         "status": "confirmed",
@@ -213,11 +221,11 @@ async def confirm_personas(
 @router.get("/personas/{project_id}")
 async def get_personas(
     project_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Recupera le buyer personas del progetto"""
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -293,7 +301,8 @@ def run_generation(project_id: int):
             "brief": project.brief,
             "target_audience": project.target_audience,
             "custom_prompt": project.custom_prompt,
-            "objectives": project.objectives or []
+            "objectives": project.objectives or [],
+            "special_dates": project.special_dates or []
         }
         
         themes = project.content_pillars or project.themes or []
@@ -538,18 +547,21 @@ class SinglePersonaRequest(BaseModel):
 async def add_persona(
     project_id: int,
     request: SinglePersonaRequest = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Aggiunge una nuova buyer persona al progetto"""
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
+    brand = await db.get(Brand, project.brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail="Brand not found")
     
+    # Nessuna scrittura finora: rilascia la connessione durante la chiamata al modello
+    await db.commit()
+    
     # Genera una nuova persona
     from app.services.persona_analyzer import analyze_buyer_personas
     
@@ -580,7 +592,7 @@ async def add_persona(
         
         from sqlalchemy.orm.attributes import flag_modified
         flag_modified(project, "buyer_personas")
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -595,11 +607,11 @@ async def add_persona(
 async def delete_persona(
     project_id: int,
     persona_index: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Elimina una singola buyer persona dal progetto"""
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -615,7 +627,7 @@ async def delete_persona(
     
     from sqlalchemy.orm.attributes import flag_modified
     flag_modified(project, "buyer_personas")
-    db.commit()
+    await db.commit()
     
     return {
         "success": True,
@@ -629,18 +641,21 @@ async def regenerate_single_persona(
     project_id: int,
     persona_index: int,
     request: SinglePersonaRequest = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Rigenera una singola buyer persona"""
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
+    brand = await db.get(Brand, project.brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail="Brand not found")
     
+    # Nessuna scrittura finora: rilascia la connessione durante la chiamata al modello
+    await db.commit()
+    
     if not project.buyer_personas or "personas" not in project.buyer_personas:
         raise HTTPException(status_code=404, detail="Nessuna persona trovata")
     
@@ -677,7 +692,7 @@ Crea UNA SOLA persona completamente nuova e diversa dalla precedente.
         
         from sqlalchemy.orm.attributes import flag_modified
         flag_modified(project, "buyer_personas")
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -0,0 +1,79 @@
+import mimetypes
+import os
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from app.services.media_store import media_store, BLOB_NAME_RE, CHUNK_SIZE
+
+router = APIRouter()
+
+# I blob sono content-addressed: lo stesso URL non cambia mai contenuto
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Singolo range "bytes=start-end" / "bytes=start-" / "bytes=-suffix"; None se non gestibile"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if not start_s:
+            length = int(end_s)
+            if length <= 0:
+                raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = min(int(end_s), size - 1) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def iter_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+def get_media(filename: str, request: Request):
+    """Serve un blob media con supporto Range (video) e cache di lunga durata"""
+    match = BLOB_NAME_RE.match(filename)
+    if not match:
+        raise HTTPException(status_code=404, detail="File non trovato")
+    
+    path = str(media_store.blob_path(match.group(1), match.group(2)))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="File non trovato")
+    
+    etag = f'"{match.group(1)}"'
+    headers = {"Cache-Control": CACHE_CONTROL, "ETag": etag, "Accept-Ranges": "bytes"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    size = os.path.getsize(path)
+    range_header = request.headers.get("range")
+    byte_range = parse_range(range_header, size) if range_header else None
+    if not byte_range:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    
+    start, end = byte_range
+    headers.update({
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1)
+    })
+    if request.method == "HEAD":
+        return Response(status_code=206, headers=headers, media_type=media_type)
+    return StreamingResponse(iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
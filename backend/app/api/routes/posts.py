@@ -1,23 +1,37 @@
-from fastapi import APIRouter, Request, Depends, HTTPException
+from fastapi import APIRouter, Request, Depends, HTTPException, Query, Response, Header, BackgroundTasks
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Integer, func, tuple_, literal_column, delete, any_, bindparam, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import OperationalError
 from typing import List, Optional
-from pydantic import BaseModel
-from datetime import date, datetime
+from pydantic import BaseModel, Field
+from datetime import date, datetime, timedelta, time, timezone
+from zoneinfo import ZoneInfo
 
-from app.core.database import get_db
-from app.core.security import get_current_user
+from app.core.config import settings
+from app.core.database import get_db, get_async_db
+from app.core.security import get_current_user, get_current_user_async
+from app.core.pagination import encode_cursor, decode_cursor
 from app.models.user import User
 from app.models.brand import Brand
 from app.models.project import Project
-from app.models.post import Post
+from app.models.post import Post, PostTombstone
+from app.models.image_job import ImageGenerationJob
+from app.models.media import MediaUpload
 from app.schemas.post import PostCreate, PostUpdate, PostResponse
-from app.services.claude_service import regenerate_single_post, generate_image_prompt, generate_editorial_plan
+from app.services.claude_service import regenerate_single_post, generate_editorial_plan
 
 class ImageGenerateRequest(BaseModel):
     visual_suggestion: Optional[str] = None
 from app.services.url_analyzer import get_brand_context_from_urls
 import asyncio
-from app.services.openai_service import OpenAIService
+from app.services.image_generation_service import image_generation_service
+from app.services.media_derivatives import media_derivative_service
+from app.services.media_store import media_store
+from app.services.chunked_upload import chunked_upload_service, parse_checksum_header, UploadError, IMAGE_TYPES, VIDEO_TYPES
 
 router = APIRouter()
 
@@ -29,6 +43,24 @@ class RegenerateRequest(BaseModel):
 class ImageResponse(BaseModel):
     image_url: str
 
+class ImageJobResponse(BaseModel):
+    id: str
+    post_id: int
+    kind: str
+    status: str  # queued, running, completed, partial, failed
+    image_format: Optional[str] = None
+    is_carousel: Optional[bool] = False
+    num_slides: int = 1
+    completed_slides: int = 0
+    prompts: Optional[List[str]] = None
+    images: Optional[List[str]] = None
+    errors: Optional[list] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
 class ManualPostCreate(BaseModel):
     project_id: int
     platform: str
@@ -57,25 +89,273 @@ class BatchReplaceRequest(BaseModel):
     post_ids: List[int]
     brief: str  # Es: "Il partner X non c'è più, parla del nuovo partner Y"
 
+class BatchPostChange(BaseModel):
+    id: int
+    scheduled_date: Optional[date] = None
+    shift_days: Optional[int] = None  # alternativo a scheduled_date: sposta di N giorni
+    scheduled_time: Optional[time] = None
+    status: Optional[str] = Field(None, max_length=20)
+    version: Optional[int] = None  # concorrenza ottimistica, come in PUT /{post_id}
+
+class BatchUpdateRequest(BaseModel):
+    changes: List[BatchPostChange] = Field(..., min_length=1, max_length=2000)
+
 # === ENDPOINTS ESISTENTI ===
 
+# Campi selezionabili con ?fields= (id è sempre incluso)
+POST_FIELDS = set(PostResponse.model_fields.keys())
+# Chiave di ordinamento keyset (coincide con l'indice ix_posts_project_schedule; post senza data in fondo)
+POST_SORT_KEY = (
+    func.coalesce(Post.scheduled_date, literal_column("'9999-12-31'::date")),
+    func.coalesce(Post.scheduled_time, literal_column("''")),
+    Post.id
+)
+
+
+def parse_post_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in POST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campi non validi: {', '.join(unknown)}")
+    return ["id"] + [f for f in requested if f != "id"]
+
+
+def month_window(month: str):
+    try:
+        start = datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato mese non valido (YYYY-MM)")
+    next_month = date(start.year + (start.month // 12), start.month % 12 + 1, 1)
+    return start, next_month - timedelta(days=1)
+
+
+def org_post_ids_filter(post_ids: List[int], organization_id: int):
+    """Condizioni per "id = ANY(:ids)" limitato ai post dell'organizzazione (join progetto → brand)"""
+    return (
+        Post.id == any_(bindparam("post_ids", list(post_ids), type_=ARRAY(Integer))),
+        Post.project_id == Project.id,
+        Project.brand_id == Brand.id,
+        Brand.organization_id == organization_id
+    )
+
+
 @router.get("/project/{project_id}", response_model=List[PostResponse])
 def get_posts_by_project(
     project_id: int,
+    response: Response,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    month: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Post di un progetto ordinati per data/ora.
+    - start_date/end_date o month=YYYY-MM: solo i post nella finestra
+    - fields=id,scheduled_date,scheduled_time,platform,status,title: solo i campi richiesti
+      (il dettaglio completo si carica con GET /api/posts/{id})
+    - limit/cursor: paginazione keyset, cursore successivo nell'header X-Next-Cursor
+    """
     project = db.query(Project).join(Brand).filter(
         Project.id == project_id,
         Brand.organization_id == current_user.organization_id
     ).first()
     if not project:
         raise HTTPException(status_code=404, detail="Progetto non trovato")
-    return db.query(Post).filter(Post.project_id == project_id).order_by(Post.scheduled_date, Post.scheduled_time).all()
+    
+    if month:
+        start_date, end_date = month_window(month)
+    selected = parse_post_fields(fields)
+    
+    columns = [getattr(Post, f) for f in selected] if selected else [Post]
+    query = db.query(*columns, *POST_SORT_KEY).filter(Post.project_id == project_id)
+    if start_date:
+        query = query.filter(Post.scheduled_date >= start_date)
+    if end_date:
+        query = query.filter(Post.scheduled_date <= end_date)
+    if cursor:
+        cursor_date, cursor_time, cursor_id = decode_cursor(cursor, (date, str, int))
+        query = query.filter(tuple_(*POST_SORT_KEY) > tuple_(cursor_date, cursor_time, cursor_id))
+    
+    query = query.order_by(*POST_SORT_KEY)
+    rows = query.limit(limit + 1).all() if limit else query.all()
+    
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(list(rows[-1][-3:]))
+    
+    if selected:
+        # Proiezione: solo i campi richiesti, fuori dallo schema completo di response_model
+        return JSONResponse(
+            jsonable_encoder([dict(zip(selected, row[:len(selected)])) for row in rows]),
+            headers={"X-Next-Cursor": response.headers["X-Next-Cursor"]} if "X-Next-Cursor" in response.headers else None
+        )
+    return [row[0] for row in rows]
+
+@router.get("/project/{project_id}/changes")
+def get_post_changes(
+    project_id: int,
+    since: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=2000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Sincronizzazione incrementale del calendario.
+    Restituisce i post creati/modificati e gli id eliminati dopo il token since, più il token
+    da passare come since alla chiamata successiva. Senza since (o since=0) restituisce tutti i
+    post (sincronizzazione iniziale). Se has_more è true richiamare subito con il token restituito.
+
+    Le versioni si prendono durante la transazione, non al commit: una scrittura con versione
+    più bassa può diventare visibile dopo una con versione più alta. Il token quindi non è una
+    versione ma l'orizzonte delle transazioni (pg_snapshot_xmin) della lettura precedente: ogni
+    scrittura di una transazione ancora aperta allora ha version_xid >= orizzonte e arriva al
+    giro successivo. Un post può essere riconsegnato: il client applica le modifiche per id.
+    """
+    project = db.query(Project).join(Brand).filter(
+        Project.id == project_id,
+        Brand.organization_id == current_user.organization_id
+    ).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Progetto non trovato")
+    
+    # Token: [orizzonte del giro, ultima versione della pagina, orizzonte del giro successivo]
+    if since in (None, "", "0"):
+        horizon, after, next_horizon = 0, 0, 0
+    else:
+        horizon, after, next_horizon = decode_cursor(since, (int, int, int))
+    if not next_horizon:
+        # Prima pagina del giro: le transazioni con xid >= xmin potrebbero non essere ancora visibili
+        next_horizon = int(db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")).scalar())
+    
+    selected = parse_post_fields(fields)
+    if selected and "version" not in selected:
+        selected.append("version")
+    
+    columns = [getattr(Post, f) for f in selected] if selected else [Post]
+    query = db.query(*columns, Post.version).filter(Post.project_id == project_id, Post.version > after)
+    if horizon:
+        query = query.filter(Post.version_xid >= horizon)
+    rows = query.order_by(Post.version).limit(limit + 1).all()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    # Con più pagine le eliminazioni si fermano alla versione dell'ultimo post restituito
+    tombstones = db.query(PostTombstone.post_id, PostTombstone.version).filter(
+        PostTombstone.project_id == project_id,
+        PostTombstone.version > after
+    )
+    if horizon:
+        tombstones = tombstones.filter(PostTombstone.version_xid >= horizon)
+    if has_more:
+        tombstones = tombstones.filter(PostTombstone.version <= rows[-1][-1])
+    tombstones = tombstones.order_by(PostTombstone.version).all()
+    
+    if has_more:
+        token = encode_cursor([horizon, rows[-1][-1], next_horizon])
+    else:
+        token = encode_cursor([next_horizon, 0, 0])
+    
+    if selected:
+        posts = [dict(zip(selected, row[:len(selected)])) for row in rows]
+    else:
+        posts = [PostResponse.model_validate(row[0]) for row in rows]
+    
+    return {
+        "since": token,
+        "posts": posts,
+        "deleted": [t.post_id for t in tombstones],
+        "has_more": has_more
+    }
+
+@router.patch("/batch-update")
+def batch_update_posts(
+    request: BatchUpdateRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Sposta, cambia orario o stato di più post in un'unica transazione (drag & drop multiplo).
+    Tutto o niente: se un post non esiste o la sua versione non coincide non viene applicato nulla.
+    Restituisce solo i campi modificati e la nuova versione per /changes.
+    """
+    changes = {c.id: c for c in request.changes}
+    ids = list(changes)
+    params = {
+        "ids": ids,
+        "dates": [changes[i].scheduled_date for i in ids],
+        "shifts": [changes[i].shift_days for i in ids],
+        "times": [changes[i].scheduled_time.strftime("%H:%M") if changes[i].scheduled_time else None for i in ids],
+        "statuses": [changes[i].status for i in ids],
+        "versions": [changes[i].version for i in ids],
+        "org_id": current_user.organization_id
+    }
+    
+    # Lock in ordine di id: due batch sovrapposti non vanno in deadlock
+    db.execute(text("""
+        SELECT p.id FROM posts p
+        JOIN projects pr ON pr.id = p.project_id
+        JOIN brands b ON b.id = pr.brand_id
+        WHERE p.id = ANY(CAST(:ids AS integer[])) AND b.organization_id = :org_id
+        ORDER BY p.id
+        FOR UPDATE OF p
+    """), {"ids": ids, "org_id": current_user.organization_id})
+    
+    rows = db.execute(text("""
+        UPDATE posts p SET
+            scheduled_date = COALESCE(c.scheduled_date, p.scheduled_date + c.shift_days, p.scheduled_date),
+            scheduled_time = COALESCE(c.scheduled_time, p.scheduled_time),
+            status = COALESCE(c.status, p.status)
+        FROM unnest(
+            CAST(:ids AS integer[]),
+            CAST(:dates AS date[]),
+            CAST(:shifts AS integer[]),
+            CAST(:times AS varchar[]),
+            CAST(:statuses AS varchar[]),
+            CAST(:versions AS bigint[])
+        ) AS c(id, scheduled_date, shift_days, scheduled_time, status, version),
+        projects pr, brands b
+        WHERE p.id = c.id
+          AND pr.id = p.project_id
+          AND b.id = pr.brand_id
+          AND b.organization_id = :org_id
+          AND (c.version IS NULL OR c.version = p.version)
+        RETURNING p.id, p.scheduled_date, p.scheduled_time, p.status, p.version
+    """), params).mappings().all()
+    
+    missing = set(ids) - {row["id"] for row in rows}
+    if missing:
+        current = db.query(Post.id, Post.version).filter(
+            *org_post_ids_filter(missing, current_user.organization_id)
+        ).all()
+        db.rollback()
+        if current:
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "message": "Alcuni post sono stati modificati da un altro utente",
+                    "conflicts": [{"id": c.id, "version": c.version} for c in current]
+                }
+            )
+        raise HTTPException(status_code=404, detail=f"Post non trovati: {sorted(missing)}")
+    
+    db.commit()
+    return {
+        "updated": [dict(row) for row in rows],
+        "version": max(row["version"] for row in rows)
+    }
 
 @router.get("/{post_id}", response_model=PostResponse)
 def get_post(
     post_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -85,35 +365,71 @@ def get_post(
     ).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post non trovato")
+    response.headers["ETag"] = f'"{post.version}"'
     return post
 
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    if not if_match or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Header If-Match non valido")
+
+
 @router.put("/{post_id}", response_model=PostResponse)
 def update_post(
     post_id: int,
     post_data: PostUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Aggiorna un post. Concorrenza ottimistica: se il client invia la versione letta
+    (campo version o header If-Match) e nel frattempo il post è cambiato, risponde 409
+    con la versione corrente invece di sovrascrivere.
+    """
+    # Lock di riga: il confronto di versione e l'update avvengono senza interleaving
     post = db.query(Post).join(Project).join(Brand).filter(
         Post.id == post_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ).with_for_update(of=Post).populate_existing().first()
     if not post:
         raise HTTPException(status_code=404, detail="Post non trovato")
-    for key, value in post_data.model_dump(exclude_unset=True).items():
+    
+    updates = post_data.model_dump(exclude_unset=True)
+    expected_version = updates.pop("version", None) or parse_if_match(if_match)
+    if expected_version is not None and expected_version != post.version:
+        current = jsonable_encoder(PostResponse.model_validate(post))
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Il post è stato modificato da un altro utente",
+                "current": current
+            }
+        )
+    
+    for key, value in updates.items():
         setattr(post, key, value)
     db.commit()
     db.refresh(post)
+    response.headers["ETag"] = f'"{post.version}"'
     return post
 
 @router.patch("/{post_id}", response_model=PostResponse)
 def patch_post(
     post_id: int,
     post_data: PostUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    return update_post(post_id, post_data, db, current_user)
+    return update_post(post_id, post_data, response, if_match, db, current_user)
 
 @router.delete("/{post_id}")
 def delete_post(
@@ -168,18 +484,20 @@ def create_manual_post(
 @router.post("/generate-ai", response_model=List[PostResponse])
 async def generate_ai_posts(
     request: AIPostGenerateRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Genera post con AI per un periodo/campagna specifica"""
-    project = db.query(Project).join(Brand).filter(
+    project = await db.scalar(select(Project).join(Brand).where(
         Project.id == request.project_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     if not project:
         raise HTTPException(status_code=404, detail="Progetto non trovato")
     
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
+    brand = await db.get(Brand, project.brand_id)
+    # Nessuna scrittura finora: rilascia la connessione durante le chiamate ai modelli
+    await db.commit()
     
     # === ANALISI URL DI RIFERIMENTO ===
     brand_context_from_urls = ""
@@ -212,7 +530,9 @@ async def generate_ai_posts(
         enriched_brief += f"\n\nCOMPETITOR DA CONSIDERARE: {', '.join(project.competitors)}"
     
     try:
-        posts_data = generate_editorial_plan(
+        # Client sincrono: in un thread per non bloccare l'event loop
+        posts_data = await asyncio.to_thread(
+            generate_editorial_plan,
             brand_name=brand.name if brand else "",
             brand_sector=brand.sector or "",
             tone_of_voice=brand.tone_of_voice or "",
@@ -233,10 +553,14 @@ async def generate_ai_posts(
         
         created_posts = []
         for post_data in posts_data:
+            scheduled_date = post_data.get("scheduled_date")
+            if isinstance(scheduled_date, str):
+                # asyncpg non converte le stringhe: il piano restituisce le date come "YYYY-MM-DD"
+                scheduled_date = date.fromisoformat(scheduled_date)
             post = Post(
                 project_id=request.project_id,
                 platform=post_data.get("platform", request.platform),
-                scheduled_date=post_data.get("scheduled_date"),
+                scheduled_date=scheduled_date,
                 scheduled_time=post_data.get("scheduled_time", "09:00"),
                 content=post_data.get("content", ""),
                 hashtags=post_data.get("hashtags", []),
@@ -247,12 +571,10 @@ async def generate_ai_posts(
                 status="draft"
             )
             db.add(post)
-            db.flush()
             created_posts.append(post)
         
-        db.commit()
-        for p in created_posts:
-            db.refresh(p)
+        # eager_defaults: id, version e timestamp tornano con l'INSERT ... RETURNING
+        await db.commit()
         
         return created_posts
         
@@ -266,17 +588,18 @@ def batch_delete_posts(
     current_user: User = Depends(get_current_user)
 ):
     """Elimina più post contemporaneamente"""
-    deleted_count = 0
-    for post_id in request.post_ids:
-        post = db.query(Post).join(Project).join(Brand).filter(
-            Post.id == post_id,
-            Brand.organization_id == current_user.organization_id
-        ).first()
-        if post:
-            db.delete(post)
-            deleted_count += 1
+    if not request.post_ids:
+        return {"message": "Eliminati 0 post", "deleted_count": 0, "deleted_ids": []}
+    
+    # Un solo DELETE ... USING projects, brands (le pubblicazioni vanno via con ON DELETE CASCADE)
+    deleted_ids = db.execute(
+        delete(Post)
+        .where(*org_post_ids_filter(request.post_ids, current_user.organization_id))
+        .returning(Post.id)
+    ).scalars().all()
     db.commit()
-    return {"message": f"Eliminati {deleted_count} post", "deleted_count": deleted_count}
+    deleted_count = len(deleted_ids)
+    return {"message": f"Eliminati {deleted_count} post", "deleted_count": deleted_count, "deleted_ids": deleted_ids}
 
 @router.post("/batch-replace", response_model=List[PostResponse])
 def batch_replace_posts(
@@ -285,15 +608,12 @@ def batch_replace_posts(
     current_user: User = Depends(get_current_user)
 ):
     """Sostituisce più post con nuovi generati da AI"""
-    # Carica i post da sostituire
-    posts_to_replace = []
-    for post_id in request.post_ids:
-        post = db.query(Post).join(Project).join(Brand).filter(
-            Post.id == post_id,
-            Brand.organization_id == current_user.organization_id
-        ).first()
-        if post:
-            posts_to_replace.append(post)
+    # Carica i post da sostituire (una query, nell'ordine della richiesta)
+    order = {post_id: i for i, post_id in enumerate(request.post_ids)}
+    posts_to_replace = sorted(
+        db.query(Post).filter(*org_post_ids_filter(request.post_ids, current_user.organization_id)).all(),
+        key=lambda p: order[p.id]
+    ) if request.post_ids else []
     
     if not posts_to_replace:
         raise HTTPException(status_code=404, detail="Nessun post trovato")
@@ -329,8 +649,11 @@ def batch_replace_posts(
         posts_data = posts_data[:len(posts_to_replace)]
         
         # Elimina vecchi post
-        for post in posts_to_replace:
-            db.delete(post)
+        db.execute(
+            delete(Post)
+            .where(Post.id == any_(bindparam("post_ids", [p.id for p in posts_to_replace], type_=ARRAY(Integer))))
+            .execution_options(synchronize_session=False)
+        )
         
         # Crea nuovi post
         new_posts = []
@@ -412,14 +735,15 @@ def regenerate_post(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore rigenerazione: {str(e)}")
 
-@router.post("/{post_id}/generate-image", response_model=ImageResponse)
-async def generate_post_image(
+@router.post("/{post_id}/generate-image", response_model=ImageJobResponse, status_code=202)
+def generate_post_image(
     post_id: int,
+    background_tasks: BackgroundTasks,
     request: ImageGenerateRequest = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Genera immagine con DALL-E per un post"""
+    """Avvia in background la generazione dell'immagine di un post (stato su /image-jobs/{job_id})"""
     post = db.query(Post).join(Project).join(Brand).filter(
         Post.id == post_id,
         Brand.organization_id == current_user.organization_id
@@ -437,69 +761,32 @@ async def generate_post_image(
     if request and request.visual_suggestion:
         post.visual_suggestion = request.visual_suggestion
     
-    project = post.project
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
-    
-    try:
-        detailed_prompt = generate_image_prompt(
-            post_content=post.content or "",
-            platform=post.platform,
-            pillar=post.pillar or "",
-            brand_name=brand.name if brand else "",
-            brand_sector=brand.sector if brand else "",
-            brand_colors=brand.colors if brand else "",
-            visual_suggestion=post.visual_suggestion or ""
-        )
-        
-        post.image_prompt = detailed_prompt
-        
-        # Dimensioni ottimali per piattaforma
-        platform_sizes = {
-            "instagram": "1024x1024",      # Feed quadrato
-            "instagram_story": "1024x1024", # Stories/Reels verticale
-            "linkedin": "1024x1024",        # Landscape professionale
-            "facebook": "1024x1024",        # Landscape engagement
-            "google_business": "1024x1024", # Quadrato per local
-            "twitter": "1024x1024",         # Landscape
-            "blog": "1024x1024"             # Header landscape
-        }
-        size = platform_sizes.get(post.platform, "1024x1024")
-        openai_service = OpenAIService()
-        dalle_result = await openai_service.generate_image(prompt=detailed_prompt, size=size)
-        
-        # Salva l'immagine localmente
-        import httpx
-        import uuid
-        import base64
-        
-        filename = f"{post.id}_{uuid.uuid4().hex[:8]}.png"
-        filepath = f"/var/www/noscite-calendar/backend/uploads/posts/{filename}"
-        
-        if dalle_result.startswith("data:image"):
-            # Base64 da gpt-image-1
-            base64_data = dalle_result.split(",")[1]
-            with open(filepath, "wb") as f:
-                f.write(base64.b64decode(base64_data))
-            image_url = f"/uploads/posts/{filename}"
-        else:
-            # URL da DALL-E 3
-            async with httpx.AsyncClient() as client:
-                img_response = await client.get(dalle_result)
-                if img_response.status_code == 200:
-                    with open(filepath, "wb") as f:
-                        f.write(img_response.content)
-                    image_url = f"/uploads/posts/{filename}"
-                else:
-                    image_url = dalle_result
-        
-        post.image_url = image_url
-        db.commit()
-        db.refresh(post)
-        
-        return {"image_url": image_url}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Errore generazione immagine: {str(e)}")
+    job = image_generation_service.create_job(
+        db,
+        post,
+        organization_id=current_user.organization_id,
+        kind="single",
+        visual_suggestion=visual_prompt
+    )
+    background_tasks.add_task(image_generation_service.run_job, job.id)
+    return job
+
+@router.get("/{post_id}/image-jobs/{job_id}", response_model=ImageJobResponse)
+def get_image_job(
+    post_id: int,
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Stato di un job di generazione immagini"""
+    job = db.query(ImageGenerationJob).filter(
+        ImageGenerationJob.id == job_id,
+        ImageGenerationJob.post_id == post_id,
+        ImageGenerationJob.organization_id == current_user.organization_id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
 
 
 # === SCHEDULING ENDPOINTS ===
@@ -518,8 +805,8 @@ class ScheduleResponse(BaseModel):
 async def schedule_post(
     post_id: int,
     request: ScheduleRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Schedula un post per la pubblicazione automatica"""
     import logging
@@ -528,26 +815,31 @@ async def schedule_post(
     from app.models.social_connection import SocialConnection, PostPublication
     
     # Verifica post
-    post = db.query(Post).join(Project).join(Brand).filter(
+    post = await db.scalar(select(Post).join(Project).join(Brand).where(
         Post.id == post_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not post:
         raise HTTPException(status_code=404, detail="Post non trovato")
     
-    project = post.project
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
+    project = await db.get(Project, post.project_id)
+    brand = await db.get(Brand, project.brand_id)
+    
+    # Orario senza fuso (dal calendario): ora locale dello scheduler
+    scheduled_for = request.scheduled_for
+    if scheduled_for.tzinfo is None:
+        scheduled_for = scheduled_for.replace(tzinfo=ZoneInfo(settings.SCHEDULER_TIMEZONE))
     
     scheduled_platforms = []
     
     for platform in request.platforms:
         # Verifica connessione attiva per la piattaforma
-        connection = db.query(SocialConnection).filter(
+        connection = await db.scalar(select(SocialConnection).where(
             SocialConnection.brand_id == brand.id,
             SocialConnection.platform == platform,
             SocialConnection.is_active == True
-        ).first()
+        ))
         
         if not connection:
             raise HTTPException(
@@ -556,24 +848,35 @@ async def schedule_post(
             )
         
         # Verifica se esiste già una pubblicazione per questo post/connessione
-        existing = db.query(PostPublication).filter(
+        existing = await db.scalar(select(PostPublication).where(
             PostPublication.post_id == post_id,
             PostPublication.social_connection_id == connection.id
-        ).first()
+        ))
+        
+        if existing and existing.status == "publishing":
+            raise HTTPException(status_code=409, detail=f"Pubblicazione su {platform} già in corso")
         
         if existing:
             # Aggiorna schedulazione esistente
-            existing.scheduled_for = request.scheduled_for
+            existing.scheduled_for = scheduled_for
             existing.status = "scheduled"
             existing.error_message = None
             existing.retry_count = 0
+            existing.next_retry_at = None
+            existing.lease_owner = None
+            existing.lease_until = None
+            # Orario esplicito: non segue più la data del post; lo staging si rifà
+            existing.from_calendar = False
+            existing.staged_media = None
+            existing.staged_at = None
+            existing.staging_error = None
         else:
             # Crea nuova pubblicazione
             publication = PostPublication(
                 post_id=post_id,
                 social_connection_id=connection.id,
                 status="scheduled",
-                scheduled_for=request.scheduled_for
+                scheduled_for=scheduled_for
             )
             db.add(publication)
         
@@ -581,76 +884,78 @@ async def schedule_post(
     
     # Aggiorna stato post
     post.publication_status = "scheduled"
-    db.commit()
+    await db.commit()
     
     return {
         "message": "Post pianificato con successo",
-        "scheduled_for": request.scheduled_for,
+        "scheduled_for": scheduled_for,
         "platforms": scheduled_platforms
     }
 
 @router.delete("/{post_id}/schedule")
 async def cancel_schedule(
     post_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Annulla la schedulazione di un post"""
     from app.models.social_connection import PostPublication
     
-    post = db.query(Post).join(Project).join(Brand).filter(
+    post = await db.scalar(select(Post).join(Project).join(Brand).where(
         Post.id == post_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not post:
         raise HTTPException(status_code=404, detail="Post non trovato")
     
-    # Rimuovi tutte le pubblicazioni schedulate
-    db.query(PostPublication).filter(
+    # Rimuovi tutte le pubblicazioni ancora in attesa, compresi i retry in backoff
+    await db.execute(delete(PostPublication).where(
         PostPublication.post_id == post_id,
-        PostPublication.status == "scheduled"
-    ).delete()
+        PostPublication.status.in_(("scheduled", "pending", "retrying"))
+    ))
     
     post.publication_status = "draft"
-    db.commit()
+    await db.commit()
     
     return {"message": "Schedulazione annullata"}
 
 @router.get("/{post_id}/schedule-status")
 async def get_schedule_status(
     post_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Ottieni stato schedulazione di un post"""
     from app.models.social_connection import SocialConnection, PostPublication
     
-    post = db.query(Post).join(Project).join(Brand).filter(
+    post = await db.scalar(select(Post).join(Project).join(Brand).where(
         Post.id == post_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not post:
         raise HTTPException(status_code=404, detail="Post non trovato")
     
-    publications = db.query(PostPublication).filter(
-        PostPublication.post_id == post_id
-    ).all()
+    rows = (await db.execute(
+        select(PostPublication, SocialConnection.platform)
+        .outerjoin(SocialConnection, SocialConnection.id == PostPublication.social_connection_id)
+        .where(PostPublication.post_id == post_id)
+    )).all()
     
     result = []
-    for pub in publications:
-        connection = db.query(SocialConnection).filter(
-            SocialConnection.id == pub.social_connection_id
-        ).first()
-        
+    for pub, platform in rows:
         result.append({
-            "platform": connection.platform if connection else "unknown",
+            "platform": platform or "unknown",
             "status": pub.status,
             "scheduled_for": pub.scheduled_for,
             "published_at": pub.published_at,
             "external_post_url": pub.external_post_url,
-            "error_message": pub.error_message
+            "error_message": pub.error_message,
+            "retry_count": pub.retry_count,
+            "next_retry_at": pub.next_retry_at,
+            "staged": pub.staged_media is not None,
+            "staging_error": pub.staging_error
         })
     
     return {
@@ -660,20 +965,62 @@ async def get_schedule_status(
     }
 
 
+@router.post("/{post_id}/publications/{publication_id}/retry")
+async def retry_publication(
+    post_id: int,
+    publication_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Rimette in coda subito una pubblicazione fallita, finita in dead letter o mancata"""
+    from app.models.social_connection import PostPublication
+    from app.services.scheduler_service import refresh_post_status
+    
+    post = await db.scalar(select(Post).join(Project).join(Brand).where(
+        Post.id == post_id,
+        Brand.organization_id == current_user.organization_id
+    ))
+    
+    if not post:
+        raise HTTPException(status_code=404, detail="Post non trovato")
+    
+    publication = await db.scalar(select(PostPublication).where(
+        PostPublication.id == publication_id,
+        PostPublication.post_id == post_id
+    ).with_for_update())
+    
+    if not publication:
+        raise HTTPException(status_code=404, detail="Pubblicazione non trovata")
+    if publication.status not in ("failed", "dead_letter", "missed"):
+        raise HTTPException(status_code=409, detail=f"La pubblicazione è in stato {publication.status}")
+    
+    publication.status = "scheduled"
+    publication.scheduled_for = datetime.now(timezone.utc)
+    # Orario esplicito: il riallineamento al calendario lo riporterebbe alla data mancata
+    publication.from_calendar = False
+    publication.retry_count = 0
+    publication.next_retry_at = None
+    publication.error_message = None
+    publication.staged_media = None
+    publication.staged_at = None
+    publication.staging_error = None
+    await db.flush()
+    await db.run_sync(refresh_post_status, post_id)
+    await db.commit()
+    
+    return {"message": "Pubblicazione rimessa in coda", "publication_id": publication_id}
+
 # === IMAGE UPLOAD ===
 from fastapi import UploadFile, File
-import os
-import uuid
-
-UPLOAD_DIR = "/var/www/noscite-calendar/backend/uploads/posts"
 
 class MediaResponse(BaseModel):
     media_url: str
     media_type: str
 
 @router.post("/{post_id}/upload-media", response_model=MediaResponse)
-async def upload_post_media(
+def upload_post_media(
     post_id: int,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -700,32 +1047,30 @@ async def upload_post_media(
     # Determina se è immagine o video
     media_type = "video" if file.content_type in video_types else "image"
     
-    # Genera nome univoco
     ext = file.filename.split(".")[-1] if "." in file.filename else ("mp4" if media_type == "video" else "jpg")
-    filename = f"{post_id}_{uuid.uuid4().hex[:8]}.{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
     
-    # Salva file
+    # Salva file nel media store (a blocchi, deduplicato per contenuto)
     try:
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        with open(filepath, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        media_url = media_store.put_upload(db, file, ext, file.content_type)
         
         # Aggiorna post con URL media
-        media_url = f"/uploads/posts/{filename}"
         post.image_url = media_url
         post.media_type = media_type
+        media_store.sync_post_references(db, post)
         db.commit()
         
+        if media_type == "image":
+            background_tasks.add_task(media_derivative_service.generate_for_post, post_id)
+        
         return {"media_url": media_url, "media_type": media_type}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore upload: {str(e)}")
 
 # Mantieni retrocompatibilità con vecchio endpoint
 @router.post("/{post_id}/upload-image", response_model=ImageResponse)
-async def upload_post_image(
+def upload_post_image(
     post_id: int,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -743,199 +1088,259 @@ async def upload_post_image(
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Tipo file non supportato. Usa JPG, PNG, WEBP o GIF.")
     
-    # Genera nome univoco
     ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    filename = f"{post_id}_{uuid.uuid4().hex[:8]}.{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
     
-    # Salva file
+    # Salva file nel media store (a blocchi, deduplicato per contenuto)
     try:
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        with open(filepath, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        image_url = media_store.put_upload(db, file, ext, file.content_type)
         
         # Aggiorna post con URL immagine
-        image_url = f"/uploads/posts/{filename}"
         post.image_url = image_url
         post.media_type = "image"
+        media_store.sync_post_references(db, post)
         db.commit()
         
+        background_tasks.add_task(media_derivative_service.generate_for_post, post_id)
+        
         return {"image_url": image_url}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore upload: {str(e)}")
 
 
-# === CAROUSEL & MULTI-FORMAT IMAGE GENERATION ===
-
-class CarouselImageRequest(BaseModel):
-    visual_suggestion: str
-    image_format: str = "1080x1080"  # 1080x1080, 1080x1920, 1920x1080
-    is_carousel: bool = False
-    num_slides: int = 1  # 1-5 per carosello
+# === UPLOAD A BLOCCHI (riprendibile) ===
 
-class CarouselImageResponse(BaseModel):
-    images: List[str]
-    prompts: List[str]
-    image_format: str
-    is_carousel: bool
+class UploadCreateRequest(BaseModel):
+    filename: Optional[str] = None
+    content_type: str
+    size: int = Field(..., gt=0)
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-fA-F]{64}$")
 
-@router.post("/{post_id}/generate-carousel", response_model=CarouselImageResponse)
-async def generate_carousel_images(
-    post_id: int,
-    request: CarouselImageRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Genera immagini singole o carosello con formati multipli"""
-    import anthropic
-    import httpx
-    import uuid
-    import base64
-    import os
+class UploadResponse(BaseModel):
+    id: str
+    post_id: int
+    filename: Optional[str] = None
+    content_type: str
+    size: int
+    offset: int
+    status: str  # uploading, completed, expired, failed
+    media_url: Optional[str] = None
+    expires_at: datetime
     
+    class Config:
+        from_attributes = True
+
+
+def upload_headers(upload) -> dict:
+    return {
+        "Upload-Offset": str(upload.offset),
+        "Upload-Length": str(upload.size),
+        "Upload-Expires": upload.expires_at.isoformat(),
+        "Cache-Control": "no-store"
+    }
+
+
+def upload_error(e: UploadError) -> HTTPException:
+    headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+
+def get_org_post(db: Session, post_id: int, current_user: User) -> Post:
     post = db.query(Post).join(Project).join(Brand).filter(
         Post.id == post_id,
         Brand.organization_id == current_user.organization_id
     ).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post non trovato")
+    return post
+
+
+def get_org_upload(db: Session, post_id: int, upload_id: str, current_user: User, lock: bool = False) -> MediaUpload:
+    query = db.query(MediaUpload).filter(
+        MediaUpload.id == upload_id,
+        MediaUpload.post_id == post_id,
+        MediaUpload.organization_id == current_user.organization_id
+    )
+    if lock:
+        # Un solo PATCH/finalize alla volta per upload: il secondo riceve 423 invece di attendere
+        try:
+            upload = query.with_for_update(nowait=True).populate_existing().first()
+        except OperationalError:
+            db.rollback()
+            raise HTTPException(status_code=423, detail="Upload già in corso da un'altra richiesta")
+    else:
+        upload = query.first()
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload non trovato")
+    return upload
+
+
+@router.post("/{post_id}/uploads", response_model=UploadResponse, status_code=201)
+def create_upload(
+    post_id: int,
+    data: UploadCreateRequest,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Crea un upload riprendibile: i byte si inviano poi con PATCH a partire da Upload-Offset"""
+    post = get_org_post(db, post_id, current_user)
     
-    project = post.project
-    brand = db.query(Brand).filter(Brand.id == project.brand_id).first()
-    
-    # Mappa formati a dimensioni DALL-E
-    format_to_dalle = {
-        "1080x1080": "1024x1024",
-        "1080x1920": "1024x1792",  # Verticale (story/reel)
-        "1920x1080": "1792x1024"   # Orizzontale (landscape)
-    }
-    dalle_size = format_to_dalle.get(request.image_format, "1024x1024")
-    
-    num_images = min(max(request.num_slides, 1), 5) if request.is_carousel else 1
-    
-    # Genera prompt per ogni slide con Claude
-    client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    if data.content_type not in IMAGE_TYPES + VIDEO_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="Tipo file non supportato. Usa JPG, PNG, WEBP, GIF per immagini o MP4, MOV, WEBM per video."
+        )
+    if data.size > settings.CHUNKED_UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File troppo grande. Max {settings.CHUNKED_UPLOAD_MAX_BYTES // (1024 * 1024)}MB."
+        )
     
-    if request.is_carousel and num_images > 1:
-        # Chiedi a Claude di generare prompt per ogni slide
-        carousel_prompt = f"""Genera {num_images} prompt DALL-E per un carosello Instagram.
-
-CONTENUTO POST:
-{post.content}
+    upload = chunked_upload_service.create(
+        db, post, current_user.organization_id, data.filename, data.content_type, data.size, data.sha256
+    )
+    response.headers.update(upload_headers(upload))
+    response.headers["Location"] = f"/api/posts/{post_id}/uploads/{upload.id}"
+    return upload
 
-SUGGERIMENTO VISUAL:
-{request.visual_suggestion}
 
-BRAND: {brand.name if brand else 'N/A'}
-SETTORE: {brand.sector if brand else 'N/A'}
-FORMATO: {request.image_format} ({'verticale' if '1920' in request.image_format else 'quadrato' if '1080x1080' in request.image_format else 'orizzontale'})
+@router.api_route("/{post_id}/uploads/{upload_id}", methods=["GET", "HEAD"], response_model=UploadResponse)
+def get_upload(
+    post_id: int,
+    upload_id: str,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Stato dell'upload: il client riprende da Upload-Offset dopo un'interruzione"""
+    upload = get_org_upload(db, post_id, upload_id, current_user)
+    response.headers.update(upload_headers(upload))
+    return upload
 
-ISTRUZIONI:
-1. Ogni slide deve essere collegata ma avere un focus diverso
-2. La prima slide deve catturare l'attenzione (hook visivo)
-3. Le slide centrali sviluppano il concetto
-4. L'ultima slide può avere una CTA visiva
-5. Stile coerente tra tutte le slide
-6. NO TESTO nelle immagini
-7. Prompt in inglese, dettagliati
 
-Rispondi SOLO con un JSON array di {num_images} prompt:
-["prompt slide 1", "prompt slide 2", ...]
-"""
-        
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            messages=[{"role": "user", "content": carousel_prompt}]
-        )
-        
-        import json
-        import re
-        content = response.content[0].text.strip()
-        # Estrai JSON
-        json_match = re.search(r'\[[\s\S]*\]', content)
-        if json_match:
-            prompts = json.loads(json_match.group())
-        else:
-            prompts = [request.visual_suggestion] * num_images
-    else:
-        # Singola immagine
-        single_prompt = f"""Genera un prompt DALL-E dettagliato per questa immagine.
-
-CONTENUTO POST:
-{post.content}
-
-SUGGERIMENTO VISUAL:
-{request.visual_suggestion}
-
-BRAND: {brand.name if brand else 'N/A'}
-SETTORE: {brand.sector if brand else 'N/A'}
-FORMATO: {request.image_format}
-
-ISTRUZIONI:
-- Prompt in inglese, molto dettagliato
-- Specifica stile, colori, composizione
-- NO TESTO nell'immagine
-- Adatto per social media professionale
-
-Rispondi SOLO con il prompt, niente altro.
-"""
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=500,
-            messages=[{"role": "user", "content": single_prompt}]
+@router.patch("/{post_id}/uploads/{upload_id}", status_code=204)
+async def append_upload(
+    post_id: int,
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum"),
+    content_type: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user_async)
+):
+    """Accoda un blocco (corpo application/offset+octet-stream) a partire da Upload-Offset"""
+    if content_type != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type deve essere application/offset+octet-stream")
+    
+    # L'autenticazione ha già chiuso la sua transazione: nessuna connessione occupata durante il corpo
+    try:
+        checksum = parse_checksum_header(upload_checksum)
+        upload = await chunked_upload_service.append(
+            post_id, upload_id, current_user.organization_id, upload_offset, request.stream(), checksum
         )
-        prompts = [response.content[0].text.strip()]
+    except UploadError as e:
+        raise upload_error(e)
     
-    # Genera immagini con DALL-E
-    openai_service = OpenAIService()
-    generated_images = []
+    return Response(status_code=204, headers=upload_headers(upload))
+
+
+@router.post("/{post_id}/uploads/{upload_id}/finalize", response_model=MediaResponse)
+def finalize_upload(
+    post_id: int,
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Verifica il file completo e lo imposta come media del post"""
+    post = get_org_post(db, post_id, current_user)
+    upload = get_org_upload(db, post_id, upload_id, current_user, lock=True)
+    already_completed = upload.status == "completed"
+    try:
+        result = chunked_upload_service.finalize(db, upload, post)
+    except UploadError as e:
+        raise upload_error(e)
     
-    for i, prompt in enumerate(prompts):
-        try:
-            dalle_result = await openai_service.generate_image(prompt=prompt, size=dalle_size)
-            
-            # Salva localmente
-            filename = f"{post.id}_carousel_{i}_{uuid.uuid4().hex[:6]}.png"
-            filepath = f"/var/www/noscite-calendar/backend/uploads/posts/{filename}"
-            
-            if dalle_result.startswith("data:image"):
-                base64_data = dalle_result.split(",")[1]
-                with open(filepath, "wb") as f:
-                    f.write(base64.b64decode(base64_data))
-                image_url = f"/uploads/posts/{filename}"
-            else:
-                async with httpx.AsyncClient() as http_client:
-                    img_response = await http_client.get(dalle_result)
-                    if img_response.status_code == 200:
-                        with open(filepath, "wb") as f:
-                            f.write(img_response.content)
-                        image_url = f"/uploads/posts/{filename}"
-                    else:
-                        image_url = dalle_result
-            
-            generated_images.append(image_url)
-        except Exception as e:
-            print(f"Errore generazione immagine {i}: {e}")
-            continue
-    
-    # Aggiorna post
-    post.image_format = request.image_format
-    post.is_carousel = request.is_carousel
-    if request.is_carousel:
-        post.carousel_images = generated_images
-        post.carousel_prompts = prompts
-        post.image_url = generated_images[0] if generated_images else None
-    else:
-        post.image_url = generated_images[0] if generated_images else None
-        post.image_prompt = prompts[0] if prompts else None
+    if result["media_type"] == "image" and not already_completed:
+        background_tasks.add_task(media_derivative_service.generate_for_post, post_id)
+    return result
+
+
+@router.delete("/{post_id}/uploads/{upload_id}", status_code=204)
+def cancel_upload(
+    post_id: int,
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Annulla un upload in corso ed elimina i byte già ricevuti"""
+    upload = get_org_upload(db, post_id, upload_id, current_user, lock=True)
+    if upload.status == "uploading":
+        chunked_upload_service.discard(upload)
+    db.delete(upload)
+    db.commit()
+    return Response(status_code=204)
+
+
+@router.post("/{post_id}/media-derivatives", status_code=202)
+def regenerate_media_derivatives(
+    post_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Rigenera le derivate (formati piattaforma, thumbnail, responsive) delle immagini del post"""
+    post = db.query(Post).join(Project).join(Brand).filter(
+        Post.id == post_id,
+        Brand.organization_id == current_user.organization_id
+    ).first()
+    if not post:
+        raise HTTPException(status_code=404, detail="Post non trovato")
     
+    post.media_derivatives = {}
+    media_store.sync_post_references(db, post)
     db.commit()
+    background_tasks.add_task(media_derivative_service.generate_for_post, post_id)
+    return {"message": "Generazione derivate avviata"}
+
+
+# === CAROUSEL & MULTI-FORMAT IMAGE GENERATION ===
+
+class CarouselImageRequest(BaseModel):
+    visual_suggestion: str
+    image_format: str = "1080x1080"  # 1080x1080, 1080x1920, 1920x1080
+    is_carousel: bool = False
+    num_slides: int = 1  # 1-5 per carosello
+
+@router.post("/{post_id}/generate-carousel", response_model=ImageJobResponse, status_code=202)
+def generate_carousel_images(
+    post_id: int,
+    request: CarouselImageRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Avvia in background la generazione di immagini singole o carosello con formati multipli.
+    Le slide vengono generate in parallelo; se alcune falliscono il carosello parziale viene
+    comunque salvato (stato "partial").
+    """
+    post = db.query(Post).join(Project).join(Brand).filter(
+        Post.id == post_id,
+        Brand.organization_id == current_user.organization_id
+    ).first()
+    if not post:
+        raise HTTPException(status_code=404, detail="Post non trovato")
     
-    return {
-        "images": generated_images,
-        "prompts": prompts,
-        "image_format": request.image_format,
-        "is_carousel": request.is_carousel
-    }
+    job = image_generation_service.create_job(
+        db,
+        post,
+        organization_id=current_user.organization_id,
+        kind="carousel",
+        visual_suggestion=request.visual_suggestion,
+        image_format=request.image_format,
+        is_carousel=request.is_carousel,
+        num_slides=request.num_slides
+    )
+    background_tasks.add_task(image_generation_service.run_job, job.id)
+    return job
@@ -3,19 +3,22 @@ import logging
 logger = logging.getLogger(__name__)
 from datetime import datetime, timezone, timedelta
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel
 import httpx
 import secrets
 from urllib.parse import urlencode
 
-from app.core.database import get_db
+from app.core.database import get_async_db
 from app.core.config import settings
+from app.core.ttl_store import TTLNamespace, ttl_store
 from app.models.user import User
 from app.models.brand import Brand
 from app.models.social_connection import SocialConnection, PostPublication
-from app.api.routes.auth import get_current_user
+from app.core.security import get_current_user_async
+from app.services.token_refresher import exchange_meta_token
 
 router = APIRouter()
 
@@ -30,6 +33,9 @@ class SocialConnectionOut(BaseModel):
     account_type: Optional[str]
     is_active: bool
     connected_at: datetime
+    token_expires_at: Optional[datetime] = None
+    needs_reauth: bool = False
+    refresh_error: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -41,31 +47,33 @@ class ConnectSocialRequest(BaseModel):
 class DisconnectRequest(BaseModel):
     connection_id: int
 
-# Store temporaneo per OAuth state (in produzione usare Redis)
-oauth_states = {}
+# State OAuth e selezioni in attesa: condivisi tra worker (Redis) e con scadenza
+oauth_states = TTLNamespace(ttl_store, "oauth_state", settings.OAUTH_STATE_TTL_SECONDS)
+pending_facebook_pages = TTLNamespace(ttl_store, "facebook_pages", settings.OAUTH_SELECTION_TTL_SECONDS)
+pending_google_locations = TTLNamespace(ttl_store, "google_locations", settings.OAUTH_SELECTION_TTL_SECONDS)
 
 # === ENDPOINTS ===
 
 @router.get("/connections/{brand_id}", response_model=List[SocialConnectionOut])
 async def get_brand_connections(
     brand_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Lista connessioni social di un brand"""
     # Verifica che il brand appartenga all'organizzazione dell'utente
-    brand = db.query(Brand).filter(
+    brand = await db.scalar(select(Brand).where(
         Brand.id == brand_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not brand:
         raise HTTPException(status_code=404, detail="Brand non trovato")
     
-    connections = db.query(SocialConnection).filter(
+    connections = (await db.scalars(select(SocialConnection).where(
         SocialConnection.brand_id == brand_id,
         SocialConnection.is_active == True
-    ).all()
+    ))).all()
     
     return connections
 
@@ -74,7 +82,7 @@ async def authorize_social(
     platform: str,
     brand_id: int = Query(...),
     token: str = Query(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Inizia il flusso OAuth per una piattaforma"""
     
@@ -85,29 +93,29 @@ async def authorize_social(
         try:
             payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
             user_id = payload.get("sub")
-            current_user = db.query(User).filter(User.email == user_id).first()
+            current_user = await db.scalar(select(User).where(User.email == user_id))
         except:
             raise HTTPException(status_code=401, detail="Token non valido")
     else:
         raise HTTPException(status_code=401, detail="Token richiesto")
 
     # Verifica brand
-    brand = db.query(Brand).filter(
+    brand = await db.scalar(select(Brand).where(
         Brand.id == brand_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not brand:
         raise HTTPException(status_code=404, detail="Brand non trovato")
     
     # Genera state token
     state = secrets.token_urlsafe(32)
-    oauth_states[state] = {
+    await oauth_states.set(state, {
         "brand_id": brand_id,
         "user_id": current_user.id,
         "platform": platform,
         "created_at": datetime.now(timezone.utc)
-    }
+    })
     
     # Costruisci URL di autorizzazione
     if platform == "facebook":
@@ -156,23 +164,18 @@ async def authorize_social(
     
     return RedirectResponse(url=auth_url)
 
-# Storage temporaneo per pagine Facebook (in produzione usare Redis)
-pending_facebook_pages = {}
-# Storage temporaneo per locations Google Business
-pending_google_locations = {}
-
 @router.get("/callback/facebook")
 async def facebook_callback(
     code: str = None,
     state: str = None,
     error: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Callback OAuth Facebook - reindirizza a selezione pagina"""
     if error or not code or not state:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error={error or 'missing_code'}")
     
-    state_data = oauth_states.pop(state, None)
+    state_data = await oauth_states.pop(state)
     if not state_data:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error=invalid_state")
     
@@ -192,7 +195,10 @@ async def facebook_callback(
             if "error" in token_data:
                 return RedirectResponse(f"{settings.FRONTEND_URL}?social_error={token_data['error'].get('message', 'unknown')}")
             
-            access_token = token_data["access_token"]
+            # Token utente long-lived: i token pagina derivati non scadono
+            long_lived = await exchange_meta_token(client, token_data["access_token"])
+            access_token = long_lived.get("access_token", token_data["access_token"])
+            user_expires_in = long_lived.get("expires_in") or token_data.get("expires_in")
             
             # Ottieni pagine gestite
             pages_response = await client.get(
@@ -214,18 +220,19 @@ async def facebook_callback(
                     brand_id=state_data["brand_id"],
                     platform="facebook",
                     access_token=access_token,
+                    token_expires_at=datetime.now(timezone.utc) + timedelta(seconds=user_expires_in) if user_expires_in else None,
                     external_account_id=me_data["id"],
                     external_account_name=me_data["name"],
                     external_account_url=f"https://facebook.com/{me_data['id']}",
                     account_type="profile",
                     connected_by_user_id=state_data["user_id"]
                 )
-                db.query(SocialConnection).filter(
+                await db.execute(delete(SocialConnection).where(
                     SocialConnection.brand_id == state_data["brand_id"],
                     SocialConnection.platform == "facebook"
-                ).delete()
+                ))
                 db.add(connection)
-                db.commit()
+                await db.commit()
                 return RedirectResponse(f"{settings.FRONTEND_URL}/?social_connected=facebook")
             
             if len(pages_data["data"]) == 1:
@@ -241,22 +248,22 @@ async def facebook_callback(
                     account_type="page",
                     connected_by_user_id=state_data["user_id"]
                 )
-                db.query(SocialConnection).filter(
+                await db.execute(delete(SocialConnection).where(
                     SocialConnection.brand_id == state_data["brand_id"],
                     SocialConnection.platform == "facebook"
-                ).delete()
+                ))
                 db.add(connection)
-                db.commit()
+                await db.commit()
                 return RedirectResponse(f"{settings.FRONTEND_URL}/?social_connected=facebook")
             
             # Multiple pagine - salva temporaneamente e reindirizza a selezione
             selection_token = secrets.token_urlsafe(32)
-            pending_facebook_pages[selection_token] = {
+            await pending_facebook_pages.set(selection_token, {
                 "brand_id": state_data["brand_id"],
                 "user_id": state_data["user_id"],
                 "pages": [{"id": p["id"], "name": p["name"], "access_token": p["access_token"]} for p in pages_data["data"]],
                 "created_at": datetime.now(timezone.utc)
-            }
+            })
             
             return RedirectResponse(f"{settings.FRONTEND_URL}/select-facebook-page?token={selection_token}")
         
@@ -267,7 +274,7 @@ async def facebook_callback(
 @router.get("/facebook-pages/{token}")
 async def get_facebook_pages(token: str):
     """Restituisce le pagine Facebook disponibili per la selezione"""
-    data = pending_facebook_pages.get(token)
+    data = await pending_facebook_pages.get(token)
     if not data:
         raise HTTPException(status_code=404, detail="Token non valido o scaduto")
     
@@ -277,10 +284,10 @@ async def get_facebook_pages(token: str):
 async def select_facebook_page(
     token: str,
     page_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Salva la pagina Facebook selezionata"""
-    data = pending_facebook_pages.pop(token, None)
+    data = await pending_facebook_pages.pop(token)
     if not data:
         raise HTTPException(status_code=404, detail="Token non valido o scaduto")
     
@@ -295,10 +302,10 @@ async def select_facebook_page(
         raise HTTPException(status_code=400, detail="Pagina non trovata")
     
     # Rimuovi vecchia connessione
-    db.query(SocialConnection).filter(
+    await db.execute(delete(SocialConnection).where(
         SocialConnection.brand_id == data["brand_id"],
         SocialConnection.platform == "facebook"
-    ).delete()
+    ))
     
     # Salva nuova connessione
     connection = SocialConnection(
@@ -312,7 +319,7 @@ async def select_facebook_page(
         connected_by_user_id=data["user_id"]
     )
     db.add(connection)
-    db.commit()
+    await db.commit()
     
     return {"success": True, "page_name": selected_page["name"]}
 
@@ -321,13 +328,13 @@ async def linkedin_callback(
     code: str = None,
     state: str = None,
     error: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Callback OAuth LinkedIn"""
     if error or not code or not state:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error={error or 'missing_code'}")
     
-    state_data = oauth_states.pop(state, None)
+    state_data = await oauth_states.pop(state)
     if not state_data:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error=invalid_state")
     
@@ -353,6 +360,12 @@ async def linkedin_callback(
             
             access_token = token_data["access_token"]
             expires_in = token_data.get("expires_in", 5184000)  # 60 giorni default
+            # Solo per le app abilitate al refresh programmatico (altrimenti ricollegare a scadenza)
+            refresh_token = token_data.get("refresh_token")
+            refresh_expires_in = token_data.get("refresh_token_expires_in")
+            refresh_token_expires_at = (
+                datetime.now(timezone.utc) + timedelta(seconds=refresh_expires_in) if refresh_expires_in else None
+            )
             
             # Ottieni info profilo
             profile_response = await client.get(
@@ -387,10 +400,10 @@ async def linkedin_callback(
             logger.info(f"LinkedIn found {len(organizations)} organizations")
         
         # Elimina vecchie connessioni LinkedIn per questo brand
-        db.query(SocialConnection).filter(
+        await db.execute(delete(SocialConnection).where(
             SocialConnection.brand_id == state_data["brand_id"],
             SocialConnection.platform == "linkedin"
-        ).delete()
+        ))
         
         # Salva connessione profilo personale
         profile_connection = SocialConnection(
@@ -398,6 +411,8 @@ async def linkedin_callback(
             platform="linkedin",
             access_token=access_token,
             token_expires_at=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=expires_in),
+            refresh_token=refresh_token,
+            refresh_token_expires_at=refresh_token_expires_at,
             external_account_id=profile_data.get("sub", ""),
             external_account_name=f"{profile_data.get('name', '')} (Profilo)",
             external_account_url=f"https://linkedin.com/in/{profile_data.get('sub', '')}",
@@ -413,6 +428,8 @@ async def linkedin_callback(
                 platform="linkedin",
                 access_token=access_token,
                 token_expires_at=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=expires_in),
+                refresh_token=refresh_token,
+                refresh_token_expires_at=refresh_token_expires_at,
                 external_account_id=str(org["id"]),
                 external_account_name=f"{org['name']} (Pagina)",
                 external_account_url=f"https://linkedin.com/company/{org.get('vanity_name', org['id'])}",
@@ -421,7 +438,7 @@ async def linkedin_callback(
             )
             db.add(org_connection)
         
-        db.commit()
+        await db.commit()
         
         logger.info(f"LinkedIn connected: profile + {len(organizations)} organizations for brand {state_data['brand_id']}")
         return RedirectResponse(f"{settings.FRONTEND_URL}/?social_connected=linkedin")
@@ -435,7 +452,7 @@ async def linkedin_callback(
 
         
         db.add(connection)
-        db.commit()
+        await db.commit()
         
         return RedirectResponse(f"{settings.FRONTEND_URL}/brand/{state_data['brand_id']}?social_connected=linkedin")
         
@@ -447,13 +464,13 @@ async def google_callback(
     code: str = None,
     state: str = None,
     error: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Callback OAuth Google Business"""
     if error or not code or not state:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error={error or 'missing_code'}")
     
-    state_data = oauth_states.pop(state, None)
+    state_data = await oauth_states.pop(state)
     if not state_data:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error=invalid_state")
     
@@ -522,19 +539,19 @@ async def google_callback(
                     connected_by_user_id=state_data["user_id"]
                 )
                 
-                db.query(SocialConnection).filter(
+                await db.execute(delete(SocialConnection).where(
                     SocialConnection.brand_id == state_data["brand_id"],
                     SocialConnection.platform == "google_business"
-                ).delete()
+                ))
                 
                 db.add(connection)
-                db.commit()
+                await db.commit()
                 
                 return RedirectResponse(f"{settings.FRONTEND_URL}/brand/{state_data['brand_id']}?social_connected=google_business")
             
             # Multiple locations - salva temporaneamente e reindirizza a selezione
             selection_token = secrets.token_urlsafe(32)
-            pending_google_locations[selection_token] = {
+            await pending_google_locations.set(selection_token, {
                 "brand_id": state_data["brand_id"],
                 "user_id": state_data["user_id"],
                 "access_token": access_token,
@@ -542,7 +559,7 @@ async def google_callback(
                 "expires_in": expires_in,
                 "locations": [{"id": loc["name"], "name": loc.get("title", loc["name"])} for loc in locations],
                 "created_at": datetime.now(timezone.utc)
-            }
+            })
             
             return RedirectResponse(f"{settings.FRONTEND_URL}/select-google-location?token={selection_token}")
         
@@ -553,7 +570,7 @@ async def google_callback(
 @router.get("/google-locations/{token}")
 async def get_google_locations(token: str):
     """Restituisce le locations Google Business disponibili per la selezione"""
-    data = pending_google_locations.get(token)
+    data = await pending_google_locations.get(token)
     if not data:
         raise HTTPException(status_code=404, detail="Token non valido o scaduto")
     
@@ -563,10 +580,10 @@ async def get_google_locations(token: str):
 async def select_google_location(
     token: str,
     location_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Salva la location Google Business selezionata"""
-    data = pending_google_locations.pop(token, None)
+    data = await pending_google_locations.pop(token)
     if not data:
         raise HTTPException(status_code=404, detail="Token non valido o scaduto")
     
@@ -581,10 +598,10 @@ async def select_google_location(
         raise HTTPException(status_code=400, detail="Location non trovata")
     
     # Rimuovi vecchia connessione
-    db.query(SocialConnection).filter(
+    await db.execute(delete(SocialConnection).where(
         SocialConnection.brand_id == data["brand_id"],
         SocialConnection.platform == "google_business"
-    ).delete()
+    ))
     
     # Salva nuova connessione
     connection = SocialConnection(
@@ -599,7 +616,7 @@ async def select_google_location(
         connected_by_user_id=data["user_id"]
     )
     db.add(connection)
-    db.commit()
+    await db.commit()
     
     return {"success": True, "location_name": selected_location["name"]}
 
@@ -608,14 +625,14 @@ async def instagram_callback(
     code: str = None,
     state: str = None,
     error: str = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Callback OAuth Instagram (via Facebook Graph API)"""
     if error or not code or not state:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error={error or 'missing_code'}")
     
     # Verifica state
-    state_data = oauth_states.pop(state, None)
+    state_data = await oauth_states.pop(state)
     if not state_data:
         return RedirectResponse(f"{settings.FRONTEND_URL}?social_error=invalid_state")
     
@@ -637,7 +654,9 @@ async def instagram_callback(
                 logger.error(f"Instagram token error: {token_data}")
                 return RedirectResponse(f"{settings.FRONTEND_URL}?social_error={token_data['error'].get('message', 'token_error')}")
             
-            access_token = token_data["access_token"]
+            # Token utente long-lived: i token pagina derivati non scadono
+            long_lived = await exchange_meta_token(client, token_data["access_token"])
+            access_token = long_lived.get("access_token", token_data["access_token"])
             
             # Ottieni pagine Facebook collegate
             pages_response = await client.get(
@@ -692,10 +711,10 @@ async def instagram_callback(
             user_id = state_data["user_id"]
             
             # Rimuovi connessioni Instagram esistenti per questo brand
-            db.query(SocialConnection).filter(
+            await db.execute(delete(SocialConnection).where(
                 SocialConnection.brand_id == brand_id,
                 SocialConnection.platform == "instagram"
-            ).delete()
+            ))
             
             connection = SocialConnection(
                 brand_id=brand_id,
@@ -707,7 +726,7 @@ async def instagram_callback(
                 is_active=True
             )
             db.add(connection)
-            db.commit()
+            await db.commit()
             
             logger.info(f"Instagram connected: {ig_info.get('username')} for brand {brand_id}")
             return RedirectResponse(f"{settings.FRONTEND_URL}/?social_connected=instagram")
@@ -719,19 +738,19 @@ async def instagram_callback(
 @router.delete("/disconnect/{connection_id}")
 async def disconnect_social(
     connection_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async)
 ):
     """Disconnetti un account social"""
-    connection = db.query(SocialConnection).join(Brand).filter(
+    connection = await db.scalar(select(SocialConnection).join(Brand).where(
         SocialConnection.id == connection_id,
         Brand.organization_id == current_user.organization_id
-    ).first()
+    ))
     
     if not connection:
         raise HTTPException(status_code=404, detail="Connessione non trovata")
     
     connection.is_active = False
-    db.commit()
+    await db.commit()
     
     return {"message": "Account disconnesso"}
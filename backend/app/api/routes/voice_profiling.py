@@ -3,14 +3,14 @@ Voice Profiling Router
 WebSocket endpoint per interviste vocali di profilazione brand
 """
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import json
 import asyncio
 import base64
 import os
 import logging
 
-from app.core.database import get_db
+from app.core.database import get_async_db
 from app.models.brand import Brand
 from app.services.voice_profiling_service import (
     VoiceProfilingService,
@@ -47,10 +47,10 @@ async def check_service():
 
 
 @router.post("/brand/{brand_id}/init")
-async def init_profiling(brand_id: int, db: Session = Depends(get_db)):
+async def init_profiling(brand_id: int, db: AsyncSession = Depends(get_async_db)):
     """Inizializza sessione di profilazione per un brand"""
     
-    brand = db.query(Brand).filter(Brand.id == brand_id).first()
+    brand = await db.get(Brand, brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail="Brand non trovato")
     
@@ -298,13 +298,13 @@ async def get_profile(brand_id: int):
 
 
 @router.post("/brand/{brand_id}/save")
-async def save_profile(brand_id: int, db: Session = Depends(get_db)):
+async def save_profile(brand_id: int, db: AsyncSession = Depends(get_async_db)):
     """Salva il profilo nel brand"""
     service = active_sessions.get(brand_id)
     if not service:
         raise HTTPException(status_code=404, detail="Nessuna sessione attiva")
     
-    brand = db.query(Brand).filter(Brand.id == brand_id).first()
+    brand = await db.get(Brand, brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail="Brand non trovato")
     
@@ -323,7 +323,7 @@ async def save_profile(brand_id: int, db: Session = Depends(get_db)):
     # Salva profilo completo come JSON
     brand.ai_profile = json.dumps(profile, ensure_ascii=False)
     
-    db.commit()
+    await db.commit()
     
     # Cleanup
     await service.disconnect()
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -7,6 +7,12 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str
+    # Pool per processo: lo scheduler tiene una sessione per pubblicazione in corso
+    DATABASE_POOL_SIZE: int = 10
+    DATABASE_MAX_OVERFLOW: int = 20
+    # Pool separato del motore asyncpg (route async): si somma al precedente nel conto delle connessioni
+    DATABASE_ASYNC_POOL_SIZE: int = 5
+    DATABASE_ASYNC_MAX_OVERFLOW: int = 10
     
     # JWT
     SECRET_KEY: str
@@ -18,6 +24,48 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = ""
     PERPLEXITY_API_KEY: str = ""
     
+    # Embeddings (provider "openai" o "fake" per test locali)
+    EMBEDDING_PROVIDER: str = "openai"
+    EMBEDDING_MAX_IN_FLIGHT: int = 4
+    
+    # Analisi documenti lunghi (map-reduce)
+    ANALYSIS_MAP_MODEL: str = "claude-3-5-haiku-20241022"
+    ANALYSIS_MAX_CONCURRENCY: int = 5
+    ANALYSIS_MAP_GROUP_TOKENS: int = 3000
+    ANALYSIS_TOKEN_BUDGET: int = 60000
+    
+    # Generazione immagini (job in background)
+    IMAGE_GENERATION_MAX_CONCURRENCY_PER_ORG: int = 3
+    MEDIA_DERIVATIVE_WORKERS: int = 2
+    MEDIA_STORE_DIR: str = "/var/www/noscite-calendar/backend/uploads/media"
+    MEDIA_GC_GRACE_HOURS: int = 24
+    CHUNKED_UPLOAD_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+    CHUNKED_UPLOAD_EXPIRY_HOURS: int = 24
+    
+    # Scheduler pubblicazioni (coda indicizzata su scheduled_at)
+    SCHEDULER_TIMEZONE: str = "Europe/Rome"
+    SCHEDULER_POLL_SECONDS: int = 15
+    SCHEDULER_CATCH_UP_MINUTES: int = 30
+    SCHEDULER_LEASE_SECONDS: int = 600
+    SCHEDULER_MAX_IN_FLIGHT: int = 20
+    SCHEDULER_PLATFORM_CONCURRENCY: str = "linkedin=4,facebook=4,instagram=2,google_business=4"
+    PUBLISH_MAX_RETRIES: int = 5
+    PUBLISH_RETRY_BASE_SECONDS: int = 30
+    PUBLISH_RETRY_MAX_SECONDS: int = 3600
+    PUBLISH_STAGING_LEAD_MINUTES: int = 10  # 0 = niente staging
+    PUBLISH_STAGING_RETRY_SECONDS: int = 120
+    PUBLISHER_CONNECT_TIMEOUT: float = 5.0
+    PUBLISHER_READ_TIMEOUT: float = 60.0
+    PUBLISHER_MAX_CONNECTIONS: int = 20
+    PUBLISHER_KEEPALIVE_EXPIRY: float = 60.0
+    LINKEDIN_API_VERSION: str = "202501"
+    # Endpoint delle piattaforme (sovrascrivibili per puntare a un server finto nei load test)
+    LINKEDIN_API_BASE: str = "https://api.linkedin.com"
+    LINKEDIN_TOKEN_URL: str = "https://www.linkedin.com/oauth/v2/accessToken"
+    GRAPH_API_BASE: str = "https://graph.facebook.com/v18.0"
+    INSTAGRAM_UPLOAD_BASE: str = "https://rupload.facebook.com/ig-api-upload/v18.0"
+    GOOGLE_TOKEN_URL: str = "https://oauth2.googleapis.com/token"
+    
     # App
     DEBUG: bool = True
     CORS_ORIGINS: str = "http://localhost:3000"
@@ -39,9 +87,39 @@ class Settings(BaseSettings):
     # Encryption (per token OAuth)
     ENCRYPTION_KEY: Optional[str] = None
     
+    # Stato temporaneo condiviso tra worker (state OAuth, selezioni pagina/location)
+    REDIS_URL: Optional[str] = None
+    OAUTH_STATE_TTL_SECONDS: int = 600
+    OAUTH_SELECTION_TTL_SECONDS: int = 900
+    
+    # Refresh proattivo dei token OAuth (anticipo sulla scadenza in minuti, per piattaforma)
+    TOKEN_REFRESH_POLL_SECONDS: int = 300
+    TOKEN_REFRESH_BATCH_SIZE: int = 50
+    TOKEN_REFRESH_CONCURRENCY: int = 8
+    TOKEN_REFRESH_RETRY_SECONDS: int = 900
+    TOKEN_REFRESH_LEAD_MINUTES: str = "google_business=15,linkedin=10080,facebook=10080,instagram=10080"
+    
     @property
     def cors_origins_list(self) -> List[str]:
         return [origin.strip() for origin in self.CORS_ORIGINS.split(",")]
+    
+    @staticmethod
+    def _platform_values(value: str) -> Dict[str, int]:
+        """"linkedin=4,facebook=4" -> {"linkedin": 4, "facebook": 4}"""
+        values = {}
+        for item in value.split(","):
+            platform, _, number = item.partition("=")
+            if platform.strip() and number.strip():
+                values[platform.strip()] = int(number)
+        return values
+    
+    @property
+    def scheduler_platform_limits(self) -> Dict[str, int]:
+        return self._platform_values(self.SCHEDULER_PLATFORM_CONCURRENCY)
+    
+    @property
+    def token_refresh_leads(self) -> Dict[str, int]:
+        return self._platform_values(self.TOKEN_REFRESH_LEAD_MINUTES)
 
 
 settings = Settings()
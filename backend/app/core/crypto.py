@@ -0,0 +1,66 @@
+"""
+Cifratura a riposo dei segreti (token OAuth delle connessioni social) con ENCRYPTION_KEY.
+
+I valori cifrati hanno il prefisso "enc:v1:" (Fernet); quelli senza prefisso sono righe
+scritte prima della cifratura e vengono letti così come sono. ENCRYPTION_KEY può contenere
+più chiavi separate da virgola: la prima cifra, tutte decifrano (rotazione delle chiavi).
+"""
+import base64
+import hashlib
+from functools import lru_cache
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from sqlalchemy.types import Text, TypeDecorator
+
+from app.core.config import settings
+
+ENCRYPTED_PREFIX = "enc:v1:"
+
+
+def _fernet_key(key: str) -> bytes:
+    """Chiave Fernet valida così com'è, altrimenti derivata con sha256 da una passphrase"""
+    try:
+        Fernet(key.encode())
+        return key.encode()
+    except ValueError:
+        return base64.urlsafe_b64encode(hashlib.sha256(key.encode()).digest())
+
+
+@lru_cache
+def get_cipher() -> Optional[MultiFernet]:
+    keys = [key.strip() for key in (settings.ENCRYPTION_KEY or "").split(",") if key.strip()]
+    if not keys:
+        return None
+    return MultiFernet([Fernet(_fernet_key(key)) for key in keys])
+
+
+def encrypt_secret(value: Optional[str]) -> Optional[str]:
+    cipher = get_cipher()
+    if value is None or cipher is None or value.startswith(ENCRYPTED_PREFIX):
+        return value
+    return ENCRYPTED_PREFIX + cipher.encrypt(value.encode()).decode()
+
+
+def decrypt_secret(value: Optional[str]) -> Optional[str]:
+    if value is None or not value.startswith(ENCRYPTED_PREFIX):
+        return value
+    cipher = get_cipher()
+    if cipher is None:
+        raise ValueError("Segreto cifrato ma ENCRYPTION_KEY non è configurata")
+    try:
+        return cipher.decrypt(value[len(ENCRYPTED_PREFIX):].encode()).decode()
+    except InvalidToken:
+        raise ValueError("Segreto cifrato con una ENCRYPTION_KEY non più configurata")
+
+
+class EncryptedText(TypeDecorator):
+    """Colonna Text cifrata in scrittura e decifrata in lettura, trasparente per il codice"""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return encrypt_secret(value)
+
+    def process_result_value(self, value, dialect):
+        return decrypt_secret(value)
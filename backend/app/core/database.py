@@ -1,9 +1,17 @@
+import asyncio
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+engine = create_engine(
+    settings.DATABASE_URL,
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -13,3 +21,46 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# === ASYNC (route async) ===
+
+def async_database_url(url: str):
+    """Stesso database di DATABASE_URL con il driver asyncpg (sslmode di psycopg2 -> ssl)"""
+    url = make_url(url)
+    if url.drivername in ("postgresql", "postgresql+psycopg2"):
+        url = url.set(drivername="postgresql+asyncpg")
+    connect_args = {}
+    if url.drivername == "postgresql+asyncpg" and "sslmode" in url.query:
+        connect_args["ssl"] = url.query["sslmode"]
+        url = url.difference_update_query(["sslmode"])
+    return url, connect_args
+
+
+_async_url, _async_connect_args = async_database_url(settings.DATABASE_URL)
+async_engine = create_async_engine(
+    _async_url,
+    pool_size=settings.DATABASE_ASYNC_POOL_SIZE,
+    max_overflow=settings.DATABASE_ASYNC_MAX_OVERFLOW,
+    connect_args=_async_connect_args
+)
+# expire_on_commit=False: dopo il commit gli attributi restano leggibili senza I/O implicito
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def run_with_session(fn, *args):
+    """
+    Esegue in un thread codice sincrono scritto per Session (servizi, chiamate SDK bloccanti)
+    con una sessione propria, senza bloccare l'event loop.
+    """
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+    return await asyncio.to_thread(call)
@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, List, Sequence
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Cursore keyset opaco: i valori dell'ultima riga nell'ordine di ordinamento"""
+    payload = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    """
+    Valori del cursore convertiti nei tipi della chiave di ordinamento (date/datetime da ISO,
+    int, str): un cursore manomesso dà 400 invece di arrivare al database.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor non valido")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise HTTPException(status_code=400, detail="Cursor non valido")
+    return [cursor_value(value, expected) for value, expected in zip(values, types)]
+
+
+def cursor_value(value: Any, expected: type) -> Any:
+    if expected in (date, datetime):
+        if isinstance(value, str):
+            try:
+                return expected.fromisoformat(value)
+            except ValueError:
+                pass
+    elif expected is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif isinstance(value, expected):
+        return value
+    raise HTTPException(status_code=400, detail="Cursor non valido")
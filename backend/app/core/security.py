@@ -4,9 +4,11 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from .config import settings
-from .database import get_db
+from .database import get_async_db, get_db
 from app.models.user import User
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -28,24 +30,42 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
+def credentials_error() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def email_from_token(token: str) -> str:
+    """Email (sub) di un JWT valido; 401 altrimenti"""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            raise credentials_error()
     except JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == email).first()
+        raise credentials_error()
+    return email
+
+# Dipendenza sincrona (threadpool): le route di profilo modificano current_user con la stessa Session
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> User:
+    user = db.query(User).filter(User.email == email_from_token(token)).first()
+    if user is None:
+        raise credentials_error()
+    return user
+
+# Dipendenza delle route async: stessa AsyncSession della route, transazione di lettura chiusa
+# subito (expire_on_commit=False) così la connessione non resta occupata durante le attese
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    user = await db.scalar(select(User).where(User.email == email_from_token(token)))
+    await db.commit()
     if user is None:
-        raise credentials_exception
+        raise credentials_error()
     return user
@@ -0,0 +1,126 @@
+"""
+Store chiave-valore con scadenza per lo stato temporaneo condiviso tra worker.
+
+Usato dai flussi OAuth (state dell'autorizzazione, pagine Facebook e location Google in
+attesa di selezione): il callback può arrivare su un worker o un nodo diverso da quello che
+ha iniziato il flusso, quindi lo stato non può stare in un dict del processo.
+
+- RedisTTLStore: produzione (REDIS_URL), SET EX per la scadenza e GETDEL per il pop atomico
+- InMemoryTTLStore: sviluppo e test, un solo processo
+
+I valori sono dict serializzati in JSON e, se ENCRYPTION_KEY è configurata, cifrati (le
+selezioni in attesa contengono token di accesso).
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.crypto import decrypt_secret, encrypt_secret
+
+logger = logging.getLogger(__name__)
+
+
+def dump_value(value: Dict[str, Any]) -> str:
+    return encrypt_secret(json.dumps(value, default=str))
+
+
+def load_value(raw: Optional[str]) -> Optional[Dict[str, Any]]:
+    if raw is None:
+        return None
+    return json.loads(decrypt_secret(raw))
+
+
+# === BACKEND ===
+
+class InMemoryTTLStore:
+    """Dict di processo con scadenza: le chiavi scadute vengono rimosse in lettura e a ogni scrittura"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, str]] = {}
+        self._lock = asyncio.Lock()
+
+    def _purge(self, now: float):
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: int):
+        async with self._lock:
+            now = time.monotonic()
+            self._purge(now)
+            self._data[key] = (now + ttl_seconds, dump_value(value))
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(key)
+        if not entry or entry[0] <= time.monotonic():
+            return None
+        return load_value(entry[1])
+
+    async def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        async with self._lock:
+            entry = self._data.pop(key, None)
+        if not entry or entry[0] <= time.monotonic():
+            return None
+        return load_value(entry[1])
+
+    async def aclose(self):
+        self._data.clear()
+
+
+class RedisTTLStore:
+    """Redis condiviso da tutti i worker e i nodi dell'API"""
+
+    def __init__(self, url: str, prefix: str = "noscite:"):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: int):
+        await self._redis.set(self.prefix + key, dump_value(value), ex=ttl_seconds)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return load_value(await self._redis.get(self.prefix + key))
+
+    async def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        # GETDEL (Redis >= 6.2): un solo worker può consumare lo state
+        return load_value(await self._redis.getdel(self.prefix + key))
+
+    async def aclose(self):
+        await self._redis.aclose()
+
+
+# === NAMESPACE ===
+
+class TTLNamespace:
+    """Vista su uno store con prefisso e TTL fissi (es. gli state OAuth)"""
+
+    def __init__(self, store, name: str, ttl_seconds: int):
+        self.store = store
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        await self.store.set(self._key(key), value, self.ttl_seconds)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self.store.get(self._key(key))
+
+    async def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self.store.pop(self._key(key))
+
+
+def build_ttl_store():
+    if settings.REDIS_URL:
+        return RedisTTLStore(settings.REDIS_URL)
+    logger.warning("REDIS_URL non configurato: stato OAuth in memoria (un solo worker)")
+    return InMemoryTTLStore()
+
+
+ttl_store = build_ttl_store()
@@ -1,8 +1,10 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from app.core.database import engine, Base
-from app.api.routes import auth, brands, projects, posts, generation, export, admin, oauth, social, documents, voice_profiling
+from app.core.database import engine, async_engine, Base
+from app.core.ttl_store import ttl_store
+from app.services.media_derivatives import media_derivative_service
+from app.api.routes import auth, brands, projects, posts, generation, export, admin, oauth, social, documents, voice_profiling, media
 
 # Create tables
 Base.metadata.create_all(bind=engine)
@@ -20,6 +22,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Location", "Upload-Offset", "Upload-Length", "Upload-Expires"],
 )
 
 # Routes
@@ -34,6 +37,19 @@ app.include_router(oauth.router, prefix="/api/oauth", tags=["OAuth"])
 app.include_router(social.router, prefix="/api/social", tags=["Social"])
 app.include_router(documents.router, prefix="/api/documents", tags=["Documents"])
 app.include_router(voice_profiling.router, prefix="/api", tags=["Voice Profiling"])
+app.include_router(media.router, prefix="/api/media", tags=["Media"])
+
+@app.on_event("shutdown")
+def shutdown_media_pool():
+    media_derivative_service.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_ttl_store():
+    await ttl_store.aclose()
+
+@app.on_event("shutdown")
+async def shutdown_async_engine():
+    await async_engine.dispose()
 
 @app.get("/")
 def root():
@@ -1,6 +1,8 @@
 from .user import User
 from .brand import Brand
 from .project import Project, ProjectStatus
-from .post import Post
+from .post import Post, PostTombstone
 from .social_connection import SocialConnection, PostPublication
 from .brand_document import BrandDocument, DocumentChunk
+from .image_job import ImageGenerationJob
+from .media import MediaBlob, MediaReference, MediaUpload
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, JSON, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
@@ -7,6 +8,9 @@ from app.core.database import Base
 
 class BrandDocument(Base):
     __tablename__ = "brand_documents"
+    __table_args__ = (
+        Index("ix_brand_documents_brand_uploaded", "brand_id", "uploaded_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     brand_id = Column(Integer, ForeignKey("brands.id", ondelete="CASCADE"), nullable=False)
@@ -32,6 +36,12 @@ class BrandDocument(Base):
     summary = Column(Text)
     key_topics = Column(JSON)
     
+    # Statistiche ingestion (denormalizzate, aggiornate da process_document)
+    chunks_count = Column(Integer, default=0, server_default="0", nullable=False)
+    total_tokens = Column(Integer, default=0, server_default="0", nullable=False)
+    embedding_bytes = Column(BigInteger, default=0, server_default="0", nullable=False)
+    ingested_at = Column(DateTime(timezone=True))
+    
     # Relationships
     brand = relationship("Brand", back_populates="documents")
     uploaded_by = relationship("User")
@@ -40,16 +50,21 @@ class BrandDocument(Base):
 
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
+    __table_args__ = (
+        Index("ix_document_chunks_content_tsv", "content_tsv", postgresql_using="gin"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, ForeignKey("brand_documents.id", ondelete="CASCADE"), nullable=False)
-    brand_id = Column(Integer, ForeignKey("brands.id", ondelete="CASCADE"), nullable=False)
+    document_id = Column(Integer, ForeignKey("brand_documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    brand_id = Column(Integer, ForeignKey("brands.id", ondelete="CASCADE"), nullable=False, index=True)
     
     # Contenuto
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
     token_count = Column(Integer)
     
+    content_tsv = Column(TSVECTOR, Computed("to_tsvector('italian', content)", persisted=True))
+    
     # Embedding
     embedding = Column(Vector(1536))
     
@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON, Text
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class ImageGenerationJob(Base):
+    """Generazione immagini/carosello eseguita in background, interrogabile per id"""
+    __tablename__ = "image_generation_jobs"
+    
+    id = Column(String(32), primary_key=True)  # uuid hex
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, index=True)
+    organization_id = Column(Integer, nullable=False)
+    
+    kind = Column(String(20), nullable=False)  # single, carousel
+    status = Column(String(20), default="queued")  # queued, running, completed, partial, failed
+    
+    # Parametri richiesta
+    visual_suggestion = Column(Text)
+    image_format = Column(String(20), default="1080x1080")
+    is_carousel = Column(Boolean, default=False)
+    num_slides = Column(Integer, default=1)
+    
+    # Risultati (slide riuscite, nell'ordine del carosello)
+    completed_slides = Column(Integer, default=0)
+    prompts = Column(JSON, default=list)
+    images = Column(JSON, default=list)
+    errors = Column(JSON, default=list)  # [{"slide": i, "error": "..."}]
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    
+    post = relationship("Post")
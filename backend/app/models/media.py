@@ -0,0 +1,68 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class MediaBlob(Base):
+    """File media salvato una sola volta, con nome = sha256 del contenuto"""
+    __tablename__ = "media_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    ext = Column(String(10), nullable=False)
+    content_type = Column(String(100))
+    size = Column(BigInteger, nullable=False)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Aggiornato anche quando una scrittura viene deduplicata: protegge il blob dal GC
+    last_written_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    references = relationship("MediaReference", back_populates="blob", cascade="all, delete-orphan")
+
+
+class MediaReference(Base):
+    """Uso di un blob da parte di un post (immagine, slide, derivata, video)"""
+    __tablename__ = "media_references"
+    __table_args__ = (
+        UniqueConstraint("sha256", "post_id", "role", name="uq_media_references_blob_post_role"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), ForeignKey("media_blobs.sha256", ondelete="CASCADE"), nullable=False, index=True)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, index=True)
+    role = Column(String(20), nullable=False)  # image, carousel, derivative
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    blob = relationship("MediaBlob", back_populates="references")
+
+
+class MediaUpload(Base):
+    """Upload a blocchi riprendibile (create -> PATCH per offset -> finalize)"""
+    __tablename__ = "media_uploads"
+    __table_args__ = (
+        Index("ix_media_uploads_status_expires", "status", "expires_at"),
+    )
+    
+    id = Column(String(32), primary_key=True)  # uuid hex
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, index=True)
+    organization_id = Column(Integer, nullable=False)
+    
+    filename = Column(String(255))
+    content_type = Column(String(100), nullable=False)
+    ext = Column(String(10), nullable=False)
+    
+    # Dimensione dichiarata, byte ricevuti e sha256 atteso (opzionale) del file completo
+    size = Column(BigInteger, nullable=False)
+    offset = Column(BigInteger, nullable=False, default=0)
+    sha256 = Column(String(64))
+    
+    status = Column(String(20), default="uploading")  # uploading, completed, expired, failed
+    media_url = Column(String(500))
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    completed_at = Column(DateTime(timezone=True))
+    
+    post = relationship("Post")
@@ -1,16 +1,57 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, JSON, Text, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Date, ForeignKey, JSON, Text, DateTime, Boolean, Index
+from sqlalchemy import Sequence, FetchedValue, DDL, event
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.types import UserDefinedType
+from sqlalchemy.sql import func, text
+from app.core.config import settings
 from app.core.database import Base
 
+# Versione di riga globale e monotona: ogni insert/update/delete di un post prende un nuovo valore
+post_version_seq = Sequence("post_version_seq", metadata=Base.metadata)
+
+
+class XID8(UserDefinedType):
+    """xid8 di Postgres (id della transazione che ha scritto la riga), letto come int da entrambi i driver"""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "xid8"
+
+    def bind_processor(self, dialect):
+        return lambda value: None if value is None else str(value)
+
+    def result_processor(self, dialect, coltype):
+        return lambda value: None if value is None else int(value)
+
+
 class Post(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        Index(
+            "ix_posts_project_schedule",
+            "project_id",
+            text("COALESCE(scheduled_date, '9999-12-31'::date)"),
+            text("COALESCE(scheduled_time, '')"),
+            "id"
+        ),
+        Index("ix_posts_project_version", "project_id", "version"),
+        Index("ix_posts_project_version_xid", "project_id", "version_xid"),
+        # Coda dei post da pubblicare: solo le righe ancora in attesa (o con lease scaduto)
+        Index(
+            "ix_posts_due",
+            "scheduled_at",
+            postgresql_where=text("publication_status IN ('scheduled', 'pending', 'draft', 'publishing')")
+        ),
+    )
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
     platform = Column(String(50), nullable=False)
     scheduled_date = Column(Date)
     scheduled_time = Column(String(10))
+    # Istante assoluto di pubblicazione, calcolato dal trigger posts_set_scheduled_at
+    scheduled_at = Column(DateTime(timezone=True), server_default=FetchedValue(), server_onupdate=FetchedValue())
     title = Column(String(255))
     content = Column(Text)
     hashtags = Column(JSON, default=list)
@@ -26,12 +67,121 @@ class Post(Base):
     image_format = Column(String(20), default="1080x1080")  # 1080x1080, 1080x1920, 1920x1080
     carousel_images = Column(JSON, default=list)  # Array URL per carosello
     carousel_prompts = Column(JSON, default=list)  # Array prompt per carosello
+    media_derivatives = Column(JSON, default=dict)  # {url sorgente: {width, height, renditions: [...]}}
     is_carousel = Column(Boolean, default=False)
     content_type = Column(String(20), default="post")  # post, story, reel
     status = Column(String(20), default="draft")
     created_at = Column(DateTime, server_default=func.now())
+    # Gestiti dal trigger posts_bump_version (vedi sotto)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), server_onupdate=FetchedValue())
+    version = Column(
+        BigInteger,
+        server_default=post_version_seq.next_value(),
+        server_onupdate=FetchedValue(),
+        nullable=False
+    )
+    # Transazione dell'ultima scrittura: la versione si prende durante la transazione, non al
+    # commit, quindi la sincronizzazione usa l'orizzonte delle transazioni (vedi get_post_changes)
+    version_xid = Column(XID8, server_default=text("pg_current_xact_id()"), server_onupdate=FetchedValue())
     
+    # Riepilogo delle PostPublication: draft, pending, scheduled, publishing, published, partial, failed, missed
     publication_status = Column(String(50), default="draft")
     
     project = relationship("Project", back_populates="posts")
     publications = relationship("PostPublication", back_populates="post", cascade="all, delete-orphan")
+
+
+class PostTombstone(Base):
+    """Traccia dei post eliminati, per la sincronizzazione incrementale del calendario"""
+    __tablename__ = "post_tombstones"
+    __table_args__ = (
+        Index("ix_post_tombstones_project_version", "project_id", "version"),
+        Index("ix_post_tombstones_project_version_xid", "project_id", "version_xid"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, nullable=False)
+    project_id = Column(Integer, nullable=False)  # niente FK: il progetto può essere già stato eliminato
+    version = Column(BigInteger, nullable=False)
+    version_xid = Column(XID8, server_default=text("pg_current_xact_id()"))
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# === TRIGGER DI VERSIONE ===
+# A livello DB così coprono anche le delete/update bulk (Query.delete, cascade da progetto)
+
+POST_VERSION_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION posts_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := nextval('post_version_seq');
+    NEW.version_xid := pg_current_xact_id();
+    NEW.updated_at := now();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION posts_record_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO post_tombstones (post_id, project_id, version, deleted_at)
+    VALUES (OLD.id, OLD.project_id, nextval('post_version_seq'), now());
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql;
+
+-- Confronto via jsonb: le colonne json non hanno operatore di uguaglianza
+DROP TRIGGER IF EXISTS posts_bump_version ON posts;
+CREATE TRIGGER posts_bump_version
+    BEFORE UPDATE ON posts
+    FOR EACH ROW WHEN (to_jsonb(OLD) IS DISTINCT FROM to_jsonb(NEW))
+    EXECUTE FUNCTION posts_bump_version();
+
+DROP TRIGGER IF EXISTS posts_record_tombstone ON posts;
+CREATE TRIGGER posts_record_tombstone
+    AFTER DELETE ON posts
+    FOR EACH ROW EXECUTE FUNCTION posts_record_tombstone();
+"""
+
+event.listen(
+    Post.__table__,
+    "after_create",
+    DDL(POST_VERSION_TRIGGERS_SQL).execute_if(dialect="postgresql")
+)
+
+
+# === ORARIO DI PUBBLICAZIONE ===
+# scheduled_date + scheduled_time ("HH:MM", ora locale) -> timestamptz, anche per gli update set-based.
+# Orari non interpretabili danno NULL: il post non entra nella coda di pubblicazione.
+
+POST_SCHEDULED_AT_SQL = """
+CREATE OR REPLACE FUNCTION posts_scheduled_at(d date, t text) RETURNS timestamptz AS $$
+DECLARE
+    hhmm text;
+BEGIN
+    hhmm := substring(t from '^\\s*(\\d{1,2}[:.]\\d{2})');
+    IF d IS NULL OR hhmm IS NULL THEN
+        RETURN NULL;
+    END IF;
+    RETURN (d + replace(hhmm, '.', ':')::time) AT TIME ZONE '__TZ__';
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION posts_set_scheduled_at() RETURNS trigger AS $$
+BEGIN
+    NEW.scheduled_at := posts_scheduled_at(NEW.scheduled_date, NEW.scheduled_time);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_set_scheduled_at ON posts;
+CREATE TRIGGER posts_set_scheduled_at
+    BEFORE INSERT OR UPDATE OF scheduled_date, scheduled_time ON posts
+    FOR EACH ROW EXECUTE FUNCTION posts_set_scheduled_at();
+""".replace("__TZ__", settings.SCHEDULER_TIMEZONE)
+
+event.listen(
+    Post.__table__,
+    "after_create",
+    DDL(POST_SCHEDULED_AT_SQL).execute_if(dialect="postgresql")
+)
@@ -1,20 +1,32 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index, JSON
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from app.core.database import Base
+from app.core.crypto import EncryptedText
 
 
 class SocialConnection(Base):
     __tablename__ = "social_connections"
+    __table_args__ = (
+        # Coda del refresher: connessioni attive in ordine di scadenza del token
+        Index("ix_social_connections_token_expires_at", "token_expires_at", postgresql_where=text("is_active")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     brand_id = Column(Integer, ForeignKey("brands.id", ondelete="CASCADE"), nullable=False)
     platform = Column(String(50), nullable=False)  # linkedin, facebook, instagram, google_business
     
-    # Token OAuth
-    access_token = Column(Text, nullable=False)
-    refresh_token = Column(Text)
+    # Token OAuth (cifrati con ENCRYPTION_KEY)
+    access_token = Column(EncryptedText, nullable=False)
+    refresh_token = Column(EncryptedText)
     token_expires_at = Column(DateTime(timezone=True))
+    refresh_token_expires_at = Column(DateTime(timezone=True))
+    
+    # Refresh proattivo: ultimo tentativo/successo, errore, e se serve ricollegare l'account
+    token_refreshed_at = Column(DateTime(timezone=True))
+    refresh_attempted_at = Column(DateTime(timezone=True))
+    refresh_error = Column(Text)
+    needs_reauth = Column(Boolean, default=False, server_default=text("false"), nullable=False)
     
     # Info account esterno
     external_account_id = Column(String(255), nullable=False)
@@ -36,15 +48,33 @@ class SocialConnection(Base):
 
 class PostPublication(Base):
     __tablename__ = "post_publications"
+    __table_args__ = (
+        # Coda dello scheduler: pubblicazioni "scheduled" in scadenza, in ordine di orario
+        Index("ix_post_publications_status_scheduled_for", "status", "scheduled_for"),
+        # Coda dei retry: solo le pubblicazioni in attesa di un nuovo tentativo
+        Index("ix_post_publications_retry", "next_retry_at", postgresql_where=text("status = 'retrying'")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
     social_connection_id = Column(Integer, ForeignKey("social_connections.id", ondelete="CASCADE"), nullable=False)
     
     # Stato pubblicazione
-    status = Column(String(50), default="pending")  # pending, scheduled, publishing, published, failed
+    # pending, scheduled, publishing, retrying, published, failed (non ritentabile), dead_letter (retry esauriti), missed
+    status = Column(String(50), default="pending")
     scheduled_for = Column(DateTime(timezone=True))
     published_at = Column(DateTime(timezone=True))
+    # Creata dallo scheduler dalla data del post: scheduled_for segue posts.scheduled_at
+    from_calendar = Column(Boolean, default=False, server_default=text("false"), nullable=False)
+    
+    # Staging prima dell'orario: id di media/container già caricati e impronta del post
+    staged_media = Column(JSON(none_as_null=True))
+    staged_at = Column(DateTime(timezone=True))
+    staging_error = Column(Text)
+    
+    # Lease dello scheduler che la sta pubblicando (scaduto = riassegnabile)
+    lease_owner = Column(String(100))
+    lease_until = Column(DateTime(timezone=True))
     
     # Riferimento esterno
     external_post_id = Column(String(255))
@@ -54,6 +84,7 @@ class PostPublication(Base):
     error_message = Column(Text)
     retry_count = Column(Integer, default=0)
     last_retry_at = Column(DateTime(timezone=True))
+    next_retry_at = Column(DateTime(timezone=True))
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
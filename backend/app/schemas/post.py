@@ -29,6 +29,8 @@ class PostUpdate(BaseModel):
     status: Optional[str] = None
     pillar: Optional[str] = None
     cta: Optional[str] = None
+    # Versione letta dal client: se non coincide con quella corrente l'update fallisce con 409
+    version: Optional[int] = None
 
 class PostResponse(PostBase):
     id: int
@@ -39,11 +41,14 @@ class PostResponse(PostBase):
     image_format: Optional[str] = None
     carousel_images: Optional[list] = None
     carousel_prompts: Optional[list] = None
+    media_derivatives: Optional[dict] = None
     is_carousel: Optional[bool] = False
     content_type: Optional[str] = None
     publication_status: Optional[str] = None
     call_to_action: Optional[str] = None
     created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    version: Optional[int] = None
     
     class Config:
         from_attributes = True
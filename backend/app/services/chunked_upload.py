@@ -0,0 +1,289 @@
+"""
+Upload a blocchi riprendibili (stile tus) per i media grandi, soprattutto video.
+
+Il client crea l'upload dichiarando dimensione (ed eventualmente sha256), poi invia
+i byte con PATCH a partire da Upload-Offset: ogni blocco viene accodato al file parziale
+su disco in streaming, senza tenerlo in memoria. Se la connessione cade i byte ricevuti
+restano validi e il client riprende dall'offset restituito da HEAD. Il finalize verifica
+dimensione e hash, sposta il file nel media store e aggiorna i campi media del post.
+"""
+import asyncio
+import base64
+import fcntl
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Optional
+
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from app.core.config import settings
+from app.core.database import run_with_session
+from app.models.media import MediaUpload
+from app.models.post import Post
+from app.services.media_store import CHUNK_SIZE, media_store, normalize_ext
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TYPES = ["image/jpeg", "image/png", "image/webp", "image/gif"]
+VIDEO_TYPES = ["video/mp4", "video/quicktime", "video/webm", "video/mov"]
+
+
+class UploadError(Exception):
+    """Errore di protocollo, con lo status HTTP da restituire"""
+
+    def __init__(self, status_code: int, detail: str, offset: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.offset = offset
+
+
+def parse_checksum_header(value: Optional[str]) -> Optional[bytes]:
+    """Header "Upload-Checksum: sha256 <base64>" -> digest atteso del blocco"""
+    if not value:
+        return None
+    algorithm, _, encoded = value.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise UploadError(400, "Algoritmo checksum non supportato (usa sha256)")
+    try:
+        return base64.b64decode(encoded.strip(), validate=True)
+    except ValueError:
+        raise UploadError(400, "Checksum non valido")
+
+
+class ChunkedUploadService:
+    def __init__(self, expiry_hours: int = 24):
+        self.expiry = timedelta(hours=expiry_hours)
+
+    @property
+    def uploads_dir(self):
+        # Stesso filesystem dei blob: il finalize è un rename, non una copia
+        return media_store.root / "uploads"
+
+    def part_path(self, upload_id: str) -> str:
+        return str(self.uploads_dir / f"{upload_id}.part")
+
+    # === CREATE ===
+
+    def create(
+        self,
+        db: Session,
+        post: Post,
+        organization_id: int,
+        filename: Optional[str],
+        content_type: str,
+        size: int,
+        sha256: Optional[str] = None
+    ) -> MediaUpload:
+        media_type = "video" if content_type in VIDEO_TYPES else "image"
+        ext = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ("mp4" if media_type == "video" else "jpg")
+
+        upload = MediaUpload(
+            id=uuid.uuid4().hex,
+            post_id=post.id,
+            organization_id=organization_id,
+            filename=filename,
+            content_type=content_type,
+            ext=normalize_ext(ext, content_type),
+            size=size,
+            offset=0,
+            sha256=sha256.lower() if sha256 else None,
+            status="uploading",
+            expires_at=datetime.now(timezone.utc) + self.expiry
+        )
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+        open(self.part_path(upload.id), "wb").close()
+        db.add(upload)
+        db.commit()
+        db.refresh(upload)
+        return upload
+
+    def check_active(self, upload: MediaUpload):
+        if upload.status == "completed":
+            raise UploadError(409, "Upload già completato", offset=upload.offset)
+        if upload.status != "uploading" or upload.expires_at < datetime.now(timezone.utc):
+            raise UploadError(410, "Upload scaduto, ricomincia da capo")
+
+    # === APPEND ===
+
+    def load(self, db: Session, post_id: int, upload_id: str, organization_id: int) -> MediaUpload:
+        """Upload dell'organizzazione (staccato dalla sessione, che il chiamante chiude)"""
+        upload = db.query(MediaUpload).filter(
+            MediaUpload.id == upload_id,
+            MediaUpload.post_id == post_id,
+            MediaUpload.organization_id == organization_id
+        ).first()
+        if not upload:
+            raise UploadError(404, "Upload non trovato")
+        return upload
+
+    def confirm(self, db: Session, upload_id: str, offset: int, written: int) -> MediaUpload:
+        """Registra i byte accodati se l'upload è ancora attivo e fermo all'offset di partenza"""
+        upload = db.query(MediaUpload).filter(MediaUpload.id == upload_id).with_for_update().first()
+        if not upload:
+            raise UploadError(410, "Upload annullato, ricomincia da capo")
+        self.check_active(upload)
+        if upload.offset != offset:
+            raise UploadError(409, "Offset non corrispondente", offset=upload.offset)
+
+        now = datetime.now(timezone.utc)
+        upload.offset = offset + written
+        upload.updated_at = now
+        upload.expires_at = now + self.expiry
+        db.commit()
+        db.refresh(upload)
+        return upload
+
+    async def append(
+        self,
+        post_id: int,
+        upload_id: str,
+        organization_id: int,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+        checksum: Optional[bytes] = None
+    ) -> MediaUpload:
+        """
+        Accoda il corpo della richiesta al file parziale a partire da offset e restituisce
+        l'upload aggiornato. Mentre arriva il corpo non resta aperta nessuna transazione: un
+        solo PATCH alla volta per upload grazie al lock esclusivo sul file parziale (condiviso
+        tra i worker, come il media store), lettura e conferma dell'offset in sessioni brevi.
+        """
+        upload = await run_with_session(self.load, post_id, upload_id, organization_id)
+        path = self.part_path(upload.id)
+        if not os.path.exists(path):
+            raise UploadError(410, "File parziale non trovato, ricomincia da capo")
+
+        digest = hashlib.sha256()
+        written = 0
+        interrupted = False
+        buffer = bytearray()
+
+        def write_buffer():
+            # Hash e scrittura nel thread: il loop resta libero per le altre richieste
+            digest.update(buffer)
+            f.write(buffer)
+
+        f = await asyncio.to_thread(open, path, "r+b")
+        try:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError(423, "Upload già in corso da un'altra richiesta")
+            # Riletto sotto lock: un PATCH appena concluso può aver spostato l'offset
+            upload = await run_with_session(self.load, post_id, upload_id, organization_id)
+            self.check_active(upload)
+            if offset != upload.offset:
+                raise UploadError(409, "Offset non corrispondente", offset=upload.offset)
+
+            # Eventuali byte oltre l'offset confermato vengono da una scrittura interrotta
+            await asyncio.to_thread(f.truncate, offset)
+            await asyncio.to_thread(f.seek, offset)
+            try:
+                async for chunk in chunks:
+                    if offset + written + len(buffer) + len(chunk) > upload.size:
+                        await asyncio.to_thread(f.truncate, offset)
+                        raise UploadError(413, "Il blocco supera la dimensione dichiarata", offset=offset)
+                    buffer += chunk
+                    if len(buffer) >= CHUNK_SIZE:
+                        await asyncio.to_thread(write_buffer)
+                        written += len(buffer)
+                        buffer.clear()
+            except ClientDisconnect:
+                interrupted = True
+            if buffer:
+                await asyncio.to_thread(write_buffer)
+                written += len(buffer)
+                buffer.clear()
+
+            if checksum is not None and (interrupted or digest.digest() != checksum):
+                # Un blocco con checksum vale solo se arrivato intero e corretto
+                await asyncio.to_thread(f.truncate, offset)
+                if interrupted:
+                    raise UploadError(400, "Blocco incompleto", offset=offset)
+                raise UploadError(460, "Checksum del blocco non corrispondente", offset=offset)
+
+            await asyncio.to_thread(f.flush)
+            await asyncio.to_thread(os.fsync, f.fileno())
+            # Conferma prima di rilasciare il lock (alla chiusura del file)
+            upload = await run_with_session(self.confirm, upload.id, offset, written)
+        finally:
+            await asyncio.to_thread(f.close)
+
+        if interrupted:
+            logger.info(f"[UPLOAD] {upload.id} interrupted at {upload.offset}/{upload.size}")
+        return upload
+
+    # === FINALIZE ===
+
+    def finalize(self, db: Session, upload: MediaUpload, post: Post) -> Dict:
+        """Verifica il file completo, lo sposta nel media store e lo collega al post"""
+        if upload.status == "completed":
+            return {"media_url": upload.media_url, "media_type": self.media_type(upload)}
+        self.check_active(upload)
+        if upload.offset != upload.size:
+            raise UploadError(409, f"Upload incompleto: ricevuti {upload.offset} di {upload.size} byte", offset=upload.offset)
+
+        path = self.part_path(upload.id)
+        sha256, size = media_store.hash_file(path)
+        if size != upload.size or (upload.sha256 and sha256 != upload.sha256):
+            self.discard(upload, status="failed")
+            db.commit()
+            raise UploadError(422, "Verifica di integrità fallita: il file ricevuto non corrisponde")
+
+        media_type = self.media_type(upload)
+        media_url = media_store.commit_file(db, path, sha256, size, upload.ext, upload.content_type)
+
+        post.image_url = media_url
+        post.media_type = media_type
+        media_store.sync_post_references(db, post)
+
+        upload.status = "completed"
+        upload.media_url = media_url
+        upload.completed_at = datetime.now(timezone.utc)
+        db.commit()
+        logger.info(f"[UPLOAD] {upload.id} completed: {size} bytes -> {media_url}")
+        return {"media_url": media_url, "media_type": media_type}
+
+    def media_type(self, upload: MediaUpload) -> str:
+        return "video" if upload.content_type in VIDEO_TYPES else "image"
+
+    # === PULIZIA ===
+
+    def discard(self, upload: MediaUpload, status: str = "expired"):
+        """Elimina il file parziale e chiude l'upload (senza commit)"""
+        try:
+            os.remove(self.part_path(upload.id))
+        except FileNotFoundError:
+            pass
+        upload.status = status
+
+    def expire_uploads(self, db: Session) -> int:
+        """Chiude gli upload abbandonati e rimuove i file parziali senza upload attivo"""
+        now = datetime.now(timezone.utc)
+        expired = db.query(MediaUpload).filter(
+            MediaUpload.status == "uploading",
+            MediaUpload.expires_at < now
+        ).with_for_update(skip_locked=True).all()
+        for upload in expired:
+            self.discard(upload)
+        db.commit()
+
+        if self.uploads_dir.exists():
+            active = {upload_id for (upload_id,) in db.query(MediaUpload.id).filter(MediaUpload.status == "uploading")}
+            cutoff = now.timestamp() - self.expiry.total_seconds()
+            for path in self.uploads_dir.glob("*.part"):
+                if path.stem not in active and path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+
+        if expired:
+            logger.info(f"[UPLOAD] Expired {len(expired)} abandoned uploads")
+        return len(expired)
+
+
+# Singleton di processo
+chunked_upload_service = ChunkedUploadService(expiry_hours=settings.CHUNKED_UPLOAD_EXPIRY_HOURS)
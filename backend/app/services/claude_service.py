@@ -37,23 +37,44 @@ async def generate_calendar_posts(
     buyer_personas: dict = None,
     brand_id: int = None,
     db = None,
-    project_id: int = None
+    project_id: int = None,
+    rag_mode: str = "per_batch"
 ) -> tuple[list, dict]:
     """
     Genera post per il calendario editoriale.
+    rag_mode: "per_batch" (contesto KB mirato per ogni settimana) o "global" (stesso contesto per tutti i batch)
     Returns: (posts_list, personas_data)
     """
     client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
     
+    # Finestre dei batch (7 giorni ciascuno)
+    total_days = (end_date - start_date).days + 1
+    batch_size = 7
+    batches = (total_days + batch_size - 1) // batch_size
+    batch_windows = []
+    for batch_num in range(batches):
+        batch_start = start_date + timedelta(days=batch_num * batch_size)
+        batch_end = min(batch_start + timedelta(days=batch_size - 1), end_date)
+        batch_windows.append((batch_start, batch_end))
+    
     # STEP 0: Recupera contesto dalla Knowledge Base (RAG)
-    rag_context = ""
+    rag_contexts = ["" for _ in batch_windows]
     if brand_id and db:
         try:
-            # Cerca contesto rilevante basato su brief e temi
-            search_query = f"{brand_name} {project_info.get('brief', '')} {' '.join(themes or [])}"
-            rag_context = rag_service.get_context_for_generation(db, brand_id, search_query, max_tokens=3000)
-            if rag_context:
-                logger.info(f"[RAG] Found relevant context from documents ({len(rag_context)} chars)")
+            if rag_mode == "per_batch":
+                # Una query per batch (pillar + date speciali della settimana), embeddate e cercate insieme
+                search_queries = [
+                    build_batch_rag_query(brand_name, project_info, themes, batch_num, batch_start, batch_end)
+                    for batch_num, (batch_start, batch_end) in enumerate(batch_windows)
+                ]
+                rag_contexts = rag_service.get_contexts_for_queries(db, brand_id, search_queries, max_tokens=1500)
+            else:
+                # Cerca contesto rilevante basato su brief e temi
+                search_query = f"{brand_name} {project_info.get('brief', '')} {' '.join(themes or [])}"
+                rag_context = rag_service.get_context_for_generation(db, brand_id, search_query, max_tokens=3000)
+                rag_contexts = [rag_context for _ in batch_windows]
+            if any(rag_contexts):
+                logger.info(f"[RAG] Found relevant context from documents ({sum(len(c) for c in rag_contexts)} chars, mode={rag_mode})")
         except Exception as e:
             logger.warning(f"[RAG] Error getting context: {e}")
     
@@ -101,14 +122,8 @@ async def generate_calendar_posts(
     
     # STEP 2: Genera contenuti in batch
     all_posts = []
-    total_days = (end_date - start_date).days + 1
-    batch_size = 7
-    batches = (total_days + batch_size - 1) // batch_size
     
-    for batch_num in range(batches):
-        batch_start = start_date + timedelta(days=batch_num * batch_size)
-        batch_end = min(batch_start + timedelta(days=batch_size - 1), end_date)
-        
+    for batch_num, (batch_start, batch_end) in enumerate(batch_windows):
         logger.info(f"[CLAUDE] Batch {batch_num + 1}/{batches}: {batch_start} to {batch_end}")
         
         # Aggiorna progress tracker
@@ -131,7 +146,7 @@ async def generate_calendar_posts(
             posts_per_week=posts_per_week,
             themes=themes,
             url_context=url_context,
-            rag_context=rag_context,
+            rag_context=rag_contexts[batch_num],
             style_guide=style_guide or DEFAULT_STYLE_GUIDE,
             buyer_personas=buyer_personas,
             content_mix_data=content_mix_data,
@@ -308,6 +323,37 @@ Rispondi SOLO con il JSON array, senza markdown.
         return []
 
 
+def build_batch_rag_query(
+    brand_name: str,
+    project_info: dict,
+    themes: list,
+    batch_num: int,
+    start_date,
+    end_date
+) -> str:
+    """Query RAG mirata per un batch: pillar a rotazione e date speciali che cadono nella settimana"""
+    themes = themes or []
+    # Ruota i pillar così che ogni settimana recuperi contesto su temi diversi
+    focus_themes = [themes[(batch_num + i) % len(themes)] for i in range(min(2, len(themes)))] if themes else []
+    
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+    special = []
+    for item in project_info.get("special_dates") or []:
+        if not isinstance(item, dict):
+            continue
+        date_str = str(item.get("date", ""))[:10]
+        if start_str <= date_str <= end_str:
+            label = item.get("name") or item.get("title") or item.get("description") or ""
+            if label:
+                special.append(label)
+    
+    parts = [brand_name, " ".join(focus_themes), " ".join(special)]
+    if not focus_themes and not special:
+        parts.append(project_info.get("brief") or "")
+    return " ".join(p for p in parts if p).strip()
+
+
 def format_personas_for_prompt(personas_data: dict) -> str:
     """Formatta le personas per il prompt"""
     if not personas_data or "personas" not in personas_data:
@@ -0,0 +1,231 @@
+"""
+Batcher globale (per processo) delle richieste di embedding.
+
+Le ingestion concorrenti accodano i propri chunk; un worker li unisce in richieste
+riempite fino ai limiti del provider (numero input e token), con un numero limitato
+di richieste in volo e backoff su 429/5xx. I risultati tornano al chiamante originale
+nello stesso ordine dei testi inviati.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from typing import List, Optional
+
+import numpy as np
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+
+
+class EmbeddingRateLimitError(Exception):
+    """429 simulato dal provider fake"""
+
+    def __init__(self, retry_after: float = 1.0):
+        super().__init__("Rate limit exceeded")
+        self.status_code = 429
+        self.retry_after = retry_after
+
+
+# === PROVIDERS ===
+
+class OpenAIEmbeddingProvider:
+    max_inputs = 2048
+    max_tokens = 300000
+
+    def __init__(self):
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        response = await self.client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+class FakeEmbeddingProvider:
+    """Provider locale deterministico per test di throughput (nessuna chiamata di rete)"""
+    max_inputs = 2048
+    max_tokens = 300000
+
+    def __init__(self, latency_ms: float = 150, per_input_ms: float = 0.2, requests_per_second: Optional[float] = None):
+        self.latency_ms = latency_ms
+        self.per_input_ms = per_input_ms
+        self.requests_per_second = requests_per_second
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _check_rate_limit(self):
+        if not self.requests_per_second:
+            return
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        if self._window_count > self.requests_per_second:
+            raise EmbeddingRateLimitError(retry_after=1.0 - (now - self._window_start))
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        self._check_rate_limit()
+        await asyncio.sleep((self.latency_ms + self.per_input_ms * len(texts)) / 1000)
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+            vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+
+def get_embedding_provider():
+    if settings.EMBEDDING_PROVIDER == "fake":
+        return FakeEmbeddingProvider()
+    return OpenAIEmbeddingProvider()
+
+
+# === BATCHER ===
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        provider=None,
+        max_in_flight: int = 4,
+        linger_ms: float = 25,
+        max_retries: int = 6,
+        max_inputs: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ):
+        self._provider = provider
+        self.max_in_flight = max_in_flight
+        self.linger = linger_ms / 1000
+        self.max_retries = max_retries
+        self._max_inputs = max_inputs
+        self._max_tokens = max_tokens
+
+        self._loop = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"requests": 0, "inputs": 0, "retries": 0}
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            self._provider = get_embedding_provider()
+        return self._provider
+
+    @property
+    def max_inputs(self) -> int:
+        return self._max_inputs or self.provider.max_inputs
+
+    @property
+    def max_tokens(self) -> int:
+        return self._max_tokens or self.provider.max_tokens
+
+    def _ensure_worker(self):
+        # Il worker è legato all'event loop corrente (i task background possono girare su loop diversi)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._worker = loop.create_task(self._run())
+
+    async def embed(self, texts: List[str], token_counts: Optional[List[int]] = None) -> List[List[float]]:
+        """Accoda i testi e attende i loro embedding, nello stesso ordine"""
+        if not texts:
+            return []
+        self._ensure_worker()
+
+        futures = []
+        for i, text in enumerate(texts):
+            tokens = token_counts[i] if token_counts and token_counts[i] else len(text) // 3 + 1
+            future = self._loop.create_future()
+            self._queue.put_nowait((text, tokens, future))
+            futures.append(future)
+
+        return list(await asyncio.gather(*futures))
+
+    async def _run(self):
+        carry = None
+        while True:
+            first = carry or await self._queue.get()
+            carry = None
+            batch = [first]
+            batch_tokens = first[1]
+            deadline = self._loop.time() + self.linger
+
+            # Riempie la richiesta fino ai limiti del provider, aspettando al più "linger"
+            while len(batch) < self.max_inputs:
+                if self._queue.empty():
+                    remaining = deadline - self._loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+
+                if batch_tokens + item[1] > self.max_tokens:
+                    carry = item
+                    break
+                batch.append(item)
+                batch_tokens += item[1]
+
+            # Backpressure: mentre si attende uno slot la coda continua a riempirsi
+            await self._semaphore.acquire()
+            self._loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            embeddings = await self._request_with_backoff([item[0] for item in batch])
+            for (_, _, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+        except Exception as e:
+            logger.error(f"[EMBED] Batch of {len(batch)} inputs failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._semaphore.release()
+
+    async def _request_with_backoff(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                self.stats["requests"] += 1
+                embeddings = await self.provider.embed(texts)
+                self.stats["inputs"] += len(texts)
+                return embeddings
+            except Exception as e:
+                status = getattr(e, "status_code", None)
+                if status not in (429, 500, 502, 503, 504) or attempt >= self.max_retries:
+                    raise
+                delay = self._retry_after(e) or min(30.0, 0.5 * (2 ** attempt))
+                delay += random.uniform(0, delay / 2)
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning(f"[EMBED] HTTP {status}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _retry_after(self, error) -> Optional[float]:
+        if getattr(error, "retry_after", None):
+            return max(0.0, float(error.retry_after))
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                return float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                return None
+        return None
+
+
+# Singleton di processo
+embedding_batcher = EmbeddingBatcher(max_in_flight=settings.EMBEDDING_MAX_IN_FLIGHT)
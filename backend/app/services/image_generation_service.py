@@ -0,0 +1,350 @@
+"""
+Generazione immagini dei post in background.
+
+Le richieste creano un ImageGenerationJob e tornano subito; il job genera i prompt,
+renderizza le slide in parallelo (con un limite di concorrenza per organizzazione)
+scrivendo ogni immagine direttamente su disco, e salva sul post anche i caroselli
+parziali se alcune slide falliscono.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_with_session
+from app.models.brand import Brand
+from app.models.image_job import ImageGenerationJob
+from app.models.post import Post
+from app.services.claude_service import generate_image_prompt
+from app.services.openai_service import OpenAIService
+from app.services.media_derivatives import media_derivative_service
+from app.services.media_store import media_store
+
+logger = logging.getLogger(__name__)
+
+MAX_CAROUSEL_SLIDES = 5
+FINAL_STATUSES = ("completed", "partial", "failed")
+
+# Dimensioni ottimali per piattaforma
+PLATFORM_SIZES = {
+    "instagram": "1024x1024",      # Feed quadrato
+    "instagram_story": "1024x1024", # Stories/Reels verticale
+    "linkedin": "1024x1024",        # Landscape professionale
+    "facebook": "1024x1024",        # Landscape engagement
+    "google_business": "1024x1024", # Quadrato per local
+    "twitter": "1024x1024",         # Landscape
+    "blog": "1024x1024"             # Header landscape
+}
+
+# Mappa formati a dimensioni DALL-E
+FORMAT_TO_DALLE = {
+    "1080x1080": "1024x1024",
+    "1080x1920": "1024x1792",  # Verticale (story/reel)
+    "1920x1080": "1792x1024"   # Orizzontale (landscape)
+}
+
+
+class ImageGenerationService:
+    def __init__(self, max_concurrency_per_org: int = 3):
+        self.max_concurrency_per_org = max_concurrency_per_org
+        self._org_semaphores: Dict[int, asyncio.Semaphore] = {}
+        self._openai: Optional[OpenAIService] = None
+
+    @property
+    def openai(self) -> OpenAIService:
+        if self._openai is None:
+            self._openai = OpenAIService()
+        return self._openai
+
+    def _org_semaphore(self, organization_id: int) -> asyncio.Semaphore:
+        if organization_id not in self._org_semaphores:
+            self._org_semaphores[organization_id] = asyncio.Semaphore(self.max_concurrency_per_org)
+        return self._org_semaphores[organization_id]
+
+    # === JOB ===
+
+    def create_job(
+        self,
+        db: Session,
+        post: Post,
+        organization_id: int,
+        kind: str,
+        visual_suggestion: str,
+        image_format: str = "1080x1080",
+        is_carousel: bool = False,
+        num_slides: int = 1
+    ) -> ImageGenerationJob:
+        job = ImageGenerationJob(
+            id=uuid.uuid4().hex,
+            post_id=post.id,
+            organization_id=organization_id,
+            kind=kind,
+            status="queued",
+            visual_suggestion=visual_suggestion,
+            image_format=image_format,
+            is_carousel=is_carousel,
+            num_slides=min(max(num_slides, 1), MAX_CAROUSEL_SLIDES) if is_carousel else 1,
+            completed_slides=0,
+            prompts=[],
+            images=[],
+            errors=[]
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+
+    async def run_job(self, job_id: str):
+        """
+        Esegue un job (da BackgroundTasks): prompt, slide in parallelo, salvataggio sul post.
+        Ogni passo sul database usa una sessione breve in un thread: il job gira nel processo
+        dell'API e non deve bloccare l'event loop né tenere connessioni durante le chiamate AI.
+        """
+        images: List[str] = []
+        try:
+            started = await run_with_session(self._start_job, job_id)
+            if not started:
+                return
+            job, post, brand = started
+            post_id = post.id
+
+            try:
+                prompts = await self._build_prompts(job, post, brand)
+            except Exception as e:
+                logger.error(f"[IMAGE-JOB] {job_id} prompt generation failed: {e}")
+                await run_with_session(self._fail_job, job_id, str(e))
+                return
+
+            await run_with_session(self._save_prompts, job_id, prompts)
+
+            if job.kind == "single":
+                size = PLATFORM_SIZES.get(post.platform, "1024x1024")
+            else:
+                size = FORMAT_TO_DALLE.get(job.image_format, "1024x1024")
+
+            semaphore = self._org_semaphore(job.organization_id)
+
+            async def render(prompt: str) -> str:
+                async with semaphore:
+                    return await self._render_slide(job_id, prompt, size)
+
+            results = await asyncio.gather(
+                *(render(prompt) for prompt in prompts),
+                return_exceptions=True
+            )
+
+            image_prompts, errors = [], []
+            for i, result in enumerate(results):
+                if isinstance(result, Exception):
+                    logger.error(f"[IMAGE-JOB] {job_id} slide {i} failed: {result}")
+                    errors.append({"slide": i, "error": str(result)})
+                else:
+                    images.append(result)
+                    image_prompts.append(prompts[i])
+
+            status = await run_with_session(self._finish_job, job_id, images, image_prompts, errors)
+            logger.info(f"[IMAGE-JOB] {job_id} {status}: {len(images)}/{len(prompts)} images")
+        except Exception as e:
+            logger.error(f"[IMAGE-JOB] {job_id} error: {e}")
+            images = []
+            try:
+                await run_with_session(self._fail_job, job_id, str(e), True)
+            except Exception as mark_error:
+                logger.error(f"[IMAGE-JOB] {job_id} could not be marked failed: {mark_error}")
+
+        # Formati piattaforma e thumbnail in locale, senza altre generazioni AI
+        if images:
+            try:
+                await media_derivative_service.generate_for_post(post_id)
+            except Exception as e:
+                logger.error(f"[IMAGE-JOB] {job_id} derivatives error: {e}")
+
+    # === PASSI SUL DATABASE (sessioni brevi, in un thread) ===
+
+    def _start_job(self, db: Session, job_id: str):
+        """Porta il job a running; (job, post, brand) staccati dalla sessione, None se non eseguibile"""
+        job = db.query(ImageGenerationJob).filter(ImageGenerationJob.id == job_id).first()
+        if not job:
+            return None
+        post = db.query(Post).filter(Post.id == job.post_id).first()
+        if not post:
+            job.status = "failed"
+            job.errors = [{"slide": None, "error": "Post non trovato"}]
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+            return None
+        brand = db.query(Brand).filter(Brand.id == post.project.brand_id).first()
+
+        job.status = "running"
+        job.started_at = datetime.now(timezone.utc)
+        db.commit()
+        loaded = (job, post, brand)
+        for obj in loaded:
+            if obj is not None:
+                db.refresh(obj)
+        return loaded
+
+    def _save_prompts(self, db: Session, job_id: str, prompts: List[str]):
+        db.query(ImageGenerationJob).filter(ImageGenerationJob.id == job_id).update(
+            {"prompts": prompts}, synchronize_session=False
+        )
+        db.commit()
+
+    def _store_slide(self, db: Session, job_id: str, tmp_path: str) -> str:
+        """Salva una slide nel media store e avanza il contatore del job (incremento atomico)"""
+        image_url = media_store.put_file(db, tmp_path, "png", "image/png")
+        db.query(ImageGenerationJob).filter(ImageGenerationJob.id == job_id).update(
+            {"completed_slides": func.coalesce(ImageGenerationJob.completed_slides, 0) + 1},
+            synchronize_session=False
+        )
+        db.commit()
+        return image_url
+
+    def _finish_job(self, db: Session, job_id: str, images: List[str], prompts: List[str], errors: List[Dict]) -> str:
+        job = db.query(ImageGenerationJob).filter(ImageGenerationJob.id == job_id).first()
+        if images:
+            post = db.query(Post).filter(Post.id == job.post_id).first()
+            self._apply_to_post(job, post, images, prompts)
+            media_store.sync_post_references(db, post)
+
+        job.images = images
+        job.errors = errors
+        job.status = "failed" if not images else ("partial" if errors else "completed")
+        job.finished_at = datetime.now(timezone.utc)
+        db.commit()
+        return job.status
+
+    def _fail_job(self, db: Session, job_id: str, error: str, append: bool = False):
+        job = db.query(ImageGenerationJob).filter(ImageGenerationJob.id == job_id).first()
+        if not job:
+            return
+        entry = {"slide": None, "error": error}
+        job.status = "failed"
+        job.errors = ((job.errors or []) if append else []) + [entry]
+        job.finished_at = datetime.now(timezone.utc)
+        db.commit()
+
+    def _apply_to_post(self, job: ImageGenerationJob, post: Post, images: List[str], prompts: List[str]):
+        if job.kind == "single":
+            post.image_url = images[0]
+            post.image_prompt = prompts[0]
+            return
+
+        post.image_format = job.image_format
+        post.is_carousel = job.is_carousel
+        post.image_url = images[0]
+        if job.is_carousel:
+            post.carousel_images = images
+            post.carousel_prompts = prompts
+        else:
+            post.image_prompt = prompts[0]
+
+    # === PROMPT ===
+
+    async def _build_prompts(self, job: ImageGenerationJob, post: Post, brand: Optional[Brand]) -> List[str]:
+        if job.kind == "single":
+            prompt = await asyncio.to_thread(
+                generate_image_prompt,
+                post_content=post.content or "",
+                platform=post.platform,
+                pillar=post.pillar or "",
+                brand_name=brand.name if brand else "",
+                brand_sector=brand.sector if brand else "",
+                brand_colors=brand.colors if brand else "",
+                visual_suggestion=job.visual_suggestion or ""
+            )
+            return [prompt]
+
+        from anthropic import AsyncAnthropic
+        client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+
+        if job.is_carousel and job.num_slides > 1:
+            num_images = job.num_slides
+            orientation = 'verticale' if '1920' in job.image_format else 'quadrato' if '1080x1080' in job.image_format else 'orizzontale'
+            carousel_prompt = f"""Genera {num_images} prompt DALL-E per un carosello Instagram.
+
+CONTENUTO POST:
+{post.content}
+
+SUGGERIMENTO VISUAL:
+{job.visual_suggestion}
+
+BRAND: {brand.name if brand else 'N/A'}
+SETTORE: {brand.sector if brand else 'N/A'}
+FORMATO: {job.image_format} ({orientation})
+
+ISTRUZIONI:
+1. Ogni slide deve essere collegata ma avere un focus diverso
+2. La prima slide deve catturare l'attenzione (hook visivo)
+3. Le slide centrali sviluppano il concetto
+4. L'ultima slide può avere una CTA visiva
+5. Stile coerente tra tutte le slide
+6. NO TESTO nelle immagini
+7. Prompt in inglese, dettagliati
+
+Rispondi SOLO con un JSON array di {num_images} prompt:
+["prompt slide 1", "prompt slide 2", ...]
+"""
+            response = await client.messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=2000,
+                messages=[{"role": "user", "content": carousel_prompt}]
+            )
+            content = response.content[0].text.strip()
+            json_match = re.search(r'\[[\s\S]*\]', content)
+            if json_match:
+                return json.loads(json_match.group())[:num_images]
+            return [job.visual_suggestion] * num_images
+
+        single_prompt = f"""Genera un prompt DALL-E dettagliato per questa immagine.
+
+CONTENUTO POST:
+{post.content}
+
+SUGGERIMENTO VISUAL:
+{job.visual_suggestion}
+
+BRAND: {brand.name if brand else 'N/A'}
+SETTORE: {brand.sector if brand else 'N/A'}
+FORMATO: {job.image_format}
+
+ISTRUZIONI:
+- Prompt in inglese, molto dettagliato
+- Specifica stile, colori, composizione
+- NO TESTO nell'immagine
+- Adatto per social media professionale
+
+Rispondi SOLO con il prompt, niente altro.
+"""
+        response = await client.messages.create(
+            model="claude-sonnet-4-20250514",
+            max_tokens=500,
+            messages=[{"role": "user", "content": single_prompt}]
+        )
+        return [response.content[0].text.strip()]
+
+    # === RENDER ===
+
+    async def _render_slide(self, job_id: str, prompt: str, size: str) -> str:
+        """Genera una slide su un file temporaneo e la salva nel media store; restituisce l'URL"""
+        tmp_path = media_store.temp_path(".png")
+        try:
+            await self.openai.generate_image_to_file(prompt=prompt, filepath=tmp_path, size=size)
+            return await run_with_session(self._store_slide, job_id, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+# Singleton di processo (i semafori per organizzazione sono condivisi tra i job)
+image_generation_service = ImageGenerationService(
+    max_concurrency_per_org=settings.IMAGE_GENERATION_MAX_CONCURRENCY_PER_ORG
+)
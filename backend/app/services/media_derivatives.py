@@ -0,0 +1,204 @@
+"""
+Pipeline locale delle derivate media (Pillow).
+
+Da un'immagine master genera, senza nuove chiamate AI:
+- crop/resize per i formati delle piattaforme (JPEG, accettato da tutte le API social)
+- thumbnail quadrate WebP (e AVIF se Pillow lo supporta) per la griglia del calendario
+- dimensioni responsive WebP per l'anteprima
+
+Il lavoro CPU gira in un process pool; i file prodotti finiscono nel media store e il
+risultato viene salvato su Post.media_derivatives indicizzato per URL dell'immagine sorgente.
+"""
+import asyncio
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageOps, features
+
+from app.core.config import settings
+from app.services.media_store import media_store
+
+logger = logging.getLogger(__name__)
+
+# Formati crop (nome = dimensioni, come Post.image_format)
+CROP_FORMATS = {
+    "1080x1080": (1080, 1080),  # quadrato
+    "1080x1350": (1080, 1350),  # verticale feed
+    "1080x1920": (1080, 1920),  # story/reel
+    "1920x1080": (1920, 1080),  # orizzontale
+    "1200x627": (1200, 627),    # link share LinkedIn
+    "1200x900": (1200, 900),    # Google Business
+}
+
+# Formati accettati per piattaforma, il primo è il default
+PLATFORM_FORMATS = {
+    "instagram": ["1080x1080", "1080x1350", "1080x1920"],
+    "facebook": ["1080x1080", "1080x1350", "1920x1080"],
+    "linkedin": ["1080x1080", "1200x627", "1080x1350"],
+    "google_business": ["1200x900", "1080x1080"],
+}
+
+THUMBNAIL_SIZES = [160, 320]
+RESPONSIVE_WIDTHS = [480, 960, 1440]
+
+
+def formats_for_post(platform: Optional[str], image_format: Optional[str]) -> List[str]:
+    formats = list(PLATFORM_FORMATS.get(platform or "", ["1080x1080"]))
+    if image_format in CROP_FORMATS and image_format not in formats:
+        formats.append(image_format)
+    return formats
+
+
+# === WORKER (process pool) ===
+
+def build_derivatives(source_path: str, output_dir: str, formats: List[str]) -> Dict:
+    """Genera tutte le derivate di un'immagine. Gira in un processo separato."""
+    os.makedirs(output_dir, exist_ok=True)
+    thumb_formats = ["webp"] + (["avif"] if features.check("avif") else [])
+    renditions = []
+
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+        rgb = img.convert("RGB")
+
+        def save(image: Image.Image, name: str, fmt: str, role: str, **options):
+            path = os.path.join(output_dir, f"{name}.{fmt}")
+            image.save(path, format=fmt.upper(), **options)
+            renditions.append({
+                "name": name,
+                "role": role,
+                "format": fmt,
+                "width": image.width,
+                "height": image.height,
+                "bytes": os.path.getsize(path),
+                "path": path
+            })
+
+        for name in formats:
+            size = CROP_FORMATS[name]
+            cropped = ImageOps.fit(rgb, size, method=Image.LANCZOS, centering=(0.5, 0.5))
+            save(cropped, name, "jpeg", "platform", quality=90, optimize=True, progressive=True)
+
+        for side in THUMBNAIL_SIZES:
+            thumb = ImageOps.fit(rgb, (side, side), method=Image.LANCZOS)
+            for fmt in thumb_formats:
+                save(thumb, f"thumb_{side}", fmt, "thumbnail", quality=75)
+
+        for target in RESPONSIVE_WIDTHS:
+            if target >= width:
+                continue  # niente upscaling
+            resized = rgb.resize((target, round(height * target / width)), Image.LANCZOS)
+            save(resized, f"w{target}", "webp", "responsive", quality=80)
+
+    return {"width": width, "height": height, "renditions": renditions}
+
+
+# === SERVICE ===
+
+class MediaDerivativeService:
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def generate(self, source_url: str, formats: List[str]) -> Optional[Dict]:
+        """Derivate di una singola immagine locale (None se il file non esiste o non è un'immagine)"""
+        from app.core.database import SessionLocal
+
+        if not source_url.startswith("/"):
+            return None
+        source_path = media_store.local_path(source_url)
+        if not os.path.exists(source_path):
+            return None
+
+        output_dir = media_store.temp_path()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.pool, build_derivatives, source_path, output_dir, formats)
+            # Sessione breve a parte: l'upsert su media_blobs blocca la riga fino al commit,
+            # che arriva prima di tornare all'event loop
+            db = SessionLocal()
+            try:
+                for rendition in result["renditions"]:
+                    rendition["url"] = media_store.put_file(
+                        db, rendition.pop("path"), rendition["format"], f"image/{rendition['format']}"
+                    )
+                db.commit()
+            finally:
+                db.close()
+            return result
+        except Exception as e:
+            logger.error(f"[MEDIA] Derivatives failed for {source_url}: {e}")
+            return None
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    async def generate_for_post(self, post_id: int):
+        """Genera le derivate di tutte le immagini del post e le registra su media_derivatives"""
+        from app.core.database import SessionLocal
+        from app.models.post import Post
+
+        db = SessionLocal()
+        try:
+            post = db.query(Post).filter(Post.id == post_id).first()
+            if not post or post.media_type == "video":
+                return
+
+            sources = [url for url in [post.image_url] + list(post.carousel_images or []) if url]
+            sources = list(dict.fromkeys(sources))
+            formats = formats_for_post(post.platform, post.image_format)
+            existing = dict(post.media_derivatives or {})
+
+            # Le immagini del post non dipendono l'una dall'altra: tutte in parallelo nel pool
+            pending = [url for url in sources if url not in existing]
+            # Nessuna transazione aperta durante il lavoro nel pool
+            db.commit()
+            results = await asyncio.gather(*(self.generate(url, formats) for url in pending))
+
+            derivatives = {url: existing[url] for url in sources if url in existing}
+            derivatives.update({url: result for url, result in zip(pending, results) if result})
+
+            db.refresh(post)
+            post.media_derivatives = derivatives
+            media_store.sync_post_references(db, post)
+            db.commit()
+            logger.info(f"[MEDIA] Post {post_id}: derivatives for {len(derivatives)} images")
+        finally:
+            db.close()
+
+
+def rendition_url(post, source_url: Optional[str], platform: str) -> Optional[str]:
+    """
+    Rendition da usare per pubblicare source_url sulla piattaforma: il formato del post se la
+    piattaforma lo accetta, altrimenti il suo default. Senza derivate restituisce l'originale.
+    """
+    if not source_url:
+        return source_url
+    entry = (post.media_derivatives or {}).get(source_url)
+    if not entry:
+        return source_url
+
+    accepted = PLATFORM_FORMATS.get(platform, [])
+    wanted = post.image_format if post.image_format in accepted else (accepted[0] if accepted else None)
+    for rendition in entry.get("renditions", []):
+        if rendition["role"] == "platform" and rendition["name"] == wanted:
+            return rendition["url"]
+    return source_url
+
+
+# Singleton di processo
+media_derivative_service = MediaDerivativeService(max_workers=settings.MEDIA_DERIVATIVE_WORKERS)
@@ -0,0 +1,282 @@
+"""
+Media store content-addressed.
+
+Ogni file (immagine generata, upload, derivata, video) è salvato una sola volta come
+blobs/ab/cd/<sha256>.<ext> e servito da /api/media/<sha256>.<ext>: scritture identiche
+vengono deduplicate e gli URL sono immutabili (cache lunga lato client/CDN).
+
+media_references registra quali post usano ciascun blob; il GC mark-and-sweep
+riallinea i riferimenti dai post e cancella i blob non più referenziati.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.media import MediaBlob, MediaReference
+from app.models.post import Post
+
+logger = logging.getLogger(__name__)
+
+MEDIA_URL_PREFIX = "/api/media/"
+LEGACY_ROOT = "/var/www/noscite-calendar/backend"  # vecchi file /uploads/posts/...
+CHUNK_SIZE = 1024 * 1024
+BLOB_NAME_RE = re.compile(r"^([0-9a-f]{64})\.([a-z0-9]{1,10})$")
+EXT_RE = re.compile(r"^[a-z0-9]{1,10}$")
+# Estensione di ripiego quando quella del nome file non è usabile (es. "photo.jpg_large")
+CONTENT_TYPE_EXTS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "video/mp4": "mp4",
+    "video/quicktime": "mov",
+    "video/mov": "mov",
+    "video/webm": "webm",
+}
+
+
+def normalize_ext(ext: Optional[str], content_type: Optional[str] = None) -> str:
+    """Estensione valida per il nome del blob (BLOB_NAME_RE): dal file, dal content type o bin"""
+    ext = (ext or "").lower().lstrip(".")
+    if EXT_RE.match(ext):
+        return ext
+    return CONTENT_TYPE_EXTS.get((content_type or "").split(";")[0].strip().lower(), "bin")
+
+
+class MediaStore:
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.tmp_dir = self.root / "tmp"
+
+    # === PERCORSI / URL ===
+
+    def blob_path(self, sha256: str, ext: str) -> Path:
+        return self.blobs_dir / sha256[:2] / sha256[2:4] / f"{sha256}.{ext}"
+
+    def url_for(self, sha256: str, ext: str) -> str:
+        return f"{MEDIA_URL_PREFIX}{sha256}.{ext}"
+
+    def parse_url(self, url: Optional[str]) -> Optional[Tuple[str, str]]:
+        if not url or not url.startswith(MEDIA_URL_PREFIX):
+            return None
+        match = BLOB_NAME_RE.match(url[len(MEDIA_URL_PREFIX):])
+        return (match.group(1), match.group(2)) if match else None
+
+    def local_path(self, url: str) -> str:
+        """Percorso su disco di un URL media (blob o file legacy sotto /uploads)"""
+        parsed = self.parse_url(url)
+        if parsed:
+            return str(self.blob_path(*parsed))
+        return os.path.join(LEGACY_ROOT, url.lstrip("/"))
+
+    def public_url(self, url: str) -> str:
+        """URL assoluto di un media locale, per le API che scaricano il file da sé"""
+        return f"{settings.BASE_URL.rstrip('/')}{url}" if url.startswith("/") else url
+
+    def temp_path(self, suffix: str = "") -> str:
+        """File temporaneo sullo stesso filesystem dei blob (lo spostamento finale è un rename)"""
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        return str(self.tmp_dir / f"{uuid.uuid4().hex}{suffix}")
+
+    # === LETTURA ===
+
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(length)
+
+    async def aiter_file(self, path: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Byte start..end (inclusi) del file a blocchi, letti in un thread senza bloccare il loop"""
+        f = await asyncio.to_thread(open, path, "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+    # === SCRITTURA ===
+
+    def hash_file(self, path: str) -> Tuple[str, int]:
+        """(sha256, dimensione) di un file letto a blocchi"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        return digest.hexdigest(), size
+
+    def put_file(self, db: Session, path: str, ext: str, content_type: Optional[str] = None) -> str:
+        """Sposta un file nello store (o lo scarta se il contenuto esiste già) e restituisce l'URL"""
+        sha256, size = self.hash_file(path)
+        return self.commit_file(db, path, sha256, size, ext, content_type)
+
+    def put_upload(self, db: Session, upload, ext: str, content_type: Optional[str] = None) -> str:
+        """Scrive un UploadFile a blocchi calcolando l'hash in streaming (da route sincrone)"""
+        tmp_path = self.temp_path()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                while chunk := upload.file.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.commit_file(db, tmp_path, digest.hexdigest(), size, ext, content_type)
+
+    def commit_file(self, db: Session, tmp_path: str, sha256: str, size: int, ext: str, content_type: Optional[str]) -> str:
+        """Registra un file già hashato e lo sposta nello store (tmp_path deve stare sotto root)"""
+        ext = normalize_ext(ext, content_type)
+        # Se il blob esiste già vale l'estensione registrata (stesso contenuto = stesso URL)
+        stored_ext = db.execute(
+            pg_insert(MediaBlob)
+            .values(sha256=sha256, ext=ext, content_type=content_type, size=size)
+            .on_conflict_do_update(index_elements=["sha256"], set_={"last_written_at": text("now()")})
+            .returning(MediaBlob.ext)
+        ).scalar_one()
+
+        dest = self.blob_path(sha256, stored_ext)
+        if dest.exists():
+            os.remove(tmp_path)
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, dest)
+        return self.url_for(sha256, stored_ext)
+
+    # === RIFERIMENTI ===
+
+    def post_media_hashes(self, post: Post) -> Set[Tuple[str, str]]:
+        """(sha256, ruolo) dei blob usati da un post"""
+        refs = set()
+        urls = [(post.image_url, "image")]
+        urls += [(url, "carousel") for url in (post.carousel_images or [])]
+        for entry in (post.media_derivatives or {}).values():
+            urls += [(r.get("url"), "derivative") for r in entry.get("renditions", [])]
+        for url, role in urls:
+            parsed = self.parse_url(url)
+            if parsed:
+                refs.add((parsed[0], role))
+        return refs
+
+    def sync_post_references(self, db: Session, post: Post):
+        """Riallinea media_references ai campi media attuali del post (senza commit)"""
+        refs = self.post_media_hashes(post)
+        db.query(MediaReference).filter(MediaReference.post_id == post.id).delete(synchronize_session=False)
+        if not refs:
+            return
+        known = {
+            sha for (sha,) in db.query(MediaBlob.sha256).filter(MediaBlob.sha256.in_({sha for sha, _ in refs}))
+        }
+        rows = [{"sha256": sha, "post_id": post.id, "role": role} for sha, role in refs if sha in known]
+        if rows:
+            db.execute(pg_insert(MediaReference).values(rows).on_conflict_do_nothing())
+
+    # === GARBAGE COLLECTION ===
+
+    def collect_garbage(self, db: Session, grace_hours: int = 24, dry_run: bool = False) -> Dict:
+        """
+        Mark: riallinea i riferimenti di tutti i post con media.
+        Sweep: elimina i blob senza riferimenti non scritti nelle ultime grace_hours,
+        poi i file su disco senza riga (scritture interrotte) e i temporanei vecchi.
+        """
+        stats = {"posts_scanned": 0, "blobs_deleted": 0, "bytes_freed": 0, "orphan_files_deleted": 0}
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+
+        # Mark
+        posts = db.query(Post).filter(
+            (Post.image_url.isnot(None)) | (Post.carousel_images.isnot(None)) | (Post.media_derivatives.isnot(None))
+        ).yield_per(500)
+        for post in posts:
+            self.sync_post_references(db, post)
+            stats["posts_scanned"] += 1
+        if dry_run:
+            db.flush()
+        else:
+            db.commit()
+
+        # Sweep blob registrati
+        unreferenced = """
+            FROM media_blobs b
+            WHERE b.last_written_at < :cutoff
+              AND NOT EXISTS (SELECT 1 FROM media_references r WHERE r.sha256 = b.sha256)
+        """
+        if dry_run:
+            rows = db.execute(text(f"SELECT b.sha256, b.ext, b.size {unreferenced}"), {"cutoff": cutoff}).all()
+            db.rollback()
+        else:
+            rows = db.execute(
+                text(f"DELETE {unreferenced} RETURNING b.sha256, b.ext, b.size"), {"cutoff": cutoff}
+            ).all()
+
+        for sha256, ext, size in rows:
+            stats["blobs_deleted"] += 1
+            stats["bytes_freed"] += size or 0
+            if not dry_run:
+                self._unlink(self.blob_path(sha256, ext))
+        # Commit dopo la rimozione dei file: una put concorrente dello stesso contenuto
+        # resta in attesa sulla riga e poi riscrive il file
+        if not dry_run:
+            db.commit()
+
+        # Sweep file senza riga e temporanei abbandonati
+        cutoff_ts = time.time() - grace_hours * 3600
+        known = {sha for (sha,) in db.query(MediaBlob.sha256)}
+        for path in self._iter_files(self.blobs_dir):
+            match = BLOB_NAME_RE.match(path.name)
+            if (not match or match.group(1) not in known) and path.stat().st_mtime < cutoff_ts:
+                stats["orphan_files_deleted"] += 1
+                stats["bytes_freed"] += path.stat().st_size
+                if not dry_run:
+                    self._unlink(path)
+        for path in self._iter_files(self.tmp_dir):
+            if path.stat().st_mtime < cutoff_ts and not dry_run:
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    self._unlink(path)
+
+        logger.info(f"[MEDIA-GC] {'(dry run) ' if dry_run else ''}{stats}")
+        return stats
+
+    def _iter_files(self, directory: Path) -> Iterable[Path]:
+        if not directory.exists():
+            return []
+        if directory == self.tmp_dir:
+            return list(directory.iterdir())
+        return [p for p in directory.rglob("*") if p.is_file()]
+
+    def _unlink(self, path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# Singleton di processo
+media_store = MediaStore(settings.MEDIA_STORE_DIR)
@@ -1,11 +1,122 @@
-from openai import OpenAI
-from typing import Optional
+from openai import AsyncOpenAI
+from typing import Optional, AsyncIterator
 import base64
+import json
+import os
+import re
+import httpx
 from app.core.config import settings
 
+B64_JSON_KEY = b'"b64_json"'
+
+
+async def write_b64_json_stream(chunks: AsyncIterator[bytes], filepath: str) -> Optional[dict]:
+    """
+    Decodifica su disco il campo b64_json di una risposta images.generate mentre arriva,
+    senza tenere in memoria né la stringa base64 né l'immagine.
+    Restituisce None se l'immagine è stata scritta, altrimenti il JSON della risposta
+    (es. quando il modello restituisce un url).
+    """
+    head = bytearray()
+    pending = b""
+    state = "search"  # search -> value -> done
+    tmp_path = f"{filepath}.part"
+    
+    try:
+        with open(tmp_path, "wb") as f:
+            async for chunk in chunks:
+                if state == "search":
+                    head += chunk
+                    idx = head.find(B64_JSON_KEY)
+                    if idx == -1:
+                        continue
+                    match = re.match(rb'\s*:\s*"', head[idx + len(B64_JSON_KEY):])
+                    if not match:
+                        continue  # separatore non ancora arrivato
+                    chunk = bytes(head[idx + len(B64_JSON_KEY) + match.end():])
+                    head.clear()
+                    state = "value"
+                
+                if state == "value":
+                    end = chunk.find(b'"')
+                    # Il base64 non contiene backslash: rimuove eventuali escape JSON ("\/")
+                    pending += (chunk if end == -1 else chunk[:end]).replace(b"\\", b"")
+                    usable = len(pending) // 4 * 4
+                    f.write(base64.b64decode(pending[:usable]))
+                    pending = pending[usable:]
+                    if end != -1:
+                        state = "done"
+        
+        if state == "search":
+            os.remove(tmp_path)
+            return json.loads(bytes(head))
+        if state != "done" or pending:
+            raise ValueError("Base64 troncato nella risposta")
+        os.replace(tmp_path, filepath)
+        return None
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def download_to_file(url: str, filepath: str):
+    """Scarica un'immagine su disco a blocchi"""
+    tmp_path = f"{filepath}.part"
+    try:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0)) as client:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                with open(tmp_path, "wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        f.write(chunk)
+        os.replace(tmp_path, filepath)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 class OpenAIService:
     def __init__(self):
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    
+    async def generate_image_to_file(
+        self,
+        prompt: str,
+        filepath: str,
+        size: str = "1024x1024",
+        style: str = "vivid"
+    ):
+        """Genera immagine con GPT Image (o DALL-E 3 come fallback) e la salva in filepath"""
+        detailed_prompt = await self._enhance_prompt_with_gpt4(prompt)
+        
+        try:
+            async with self.client.images.with_streaming_response.generate(
+                model="gpt-image-1",
+                prompt=detailed_prompt,
+                size=size,
+                quality="high",
+                n=1
+            ) as response:
+                body = await write_b64_json_stream(response.iter_bytes(), filepath)
+            if body is None:
+                return
+            url = body["data"][0].get("url")
+            if not url:
+                raise ValueError("Nessuna immagine nella risposta")
+            await download_to_file(url, filepath)
+        except Exception as e:
+            print(f"gpt-image-1 failed, falling back to DALL-E 3: {e}")
+            response = await self.client.images.generate(
+                model="dall-e-3",
+                prompt=detailed_prompt,
+                size=size,
+                quality="standard",
+                style=style,
+                n=1
+            )
+            await download_to_file(response.data[0].url, filepath)
     
     async def generate_image(
         self,
@@ -20,7 +131,7 @@ class OpenAIService:
         
         try:
             # Prova prima con gpt-image-1 (migliore per infografiche)
-            response = self.client.images.generate(
+            response = await self.client.images.generate(
                 model="gpt-image-1",
                 prompt=detailed_prompt,
                 size=size,
@@ -38,7 +149,7 @@ class OpenAIService:
         except Exception as e:
             # Fallback a DALL-E 3
             print(f"gpt-image-1 failed, falling back to DALL-E 3: {e}")
-            response = self.client.images.generate(
+            response = await self.client.images.generate(
                 model="dall-e-3",
                 prompt=detailed_prompt,
                 size=size,
@@ -51,7 +162,7 @@ class OpenAIService:
     async def _enhance_prompt_with_gpt4(self, original_prompt: str) -> str:
         """Usa GPT-4 per creare un prompt dettagliato come ChatGPT"""
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model="gpt-4o",
                 messages=[
                     {
@@ -0,0 +1,87 @@
+"""
+Classificazione degli errori di pubblicazione e calcolo del backoff dei retry.
+
+Un errore è ritentabile se è transitorio (rete, 5xx, rate limit, media non ancora pronto);
+token scaduti, permessi, contenuti rifiutati e parametri non validi falliscono subito.
+Il backoff è esponenziale con jitter, e rispetta il tempo di attesa indicato dalla piattaforma.
+"""
+import json
+import random
+from typing import Optional, Tuple
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Codici errore Graph API (Facebook/Instagram) transitori
+# 1/2: errore/servizio temporaneo, 4/17/32/613: rate limit app/utente/pagina,
+# 341: limite applicazione, 9007: media Instagram non ancora pronto
+GRAPH_RETRYABLE_CODES = {1, 2, 4, 17, 32, 341, 613, 9007}
+# 80001-80014: rate limit "business use case"
+GRAPH_BUC_RATE_LIMIT_CODES = range(80001, 80015)
+# 10/200-299: permessi, 100: parametro non valido, 190: token non valido/scaduto, 368: bloccato per policy
+GRAPH_FATAL_CODES = {10, 100, 190, 368}
+
+# Errori LinkedIn da non ritentare anche se arrivano con status ritentabile
+LINKEDIN_FATAL_MARKERS = ("DUPLICATE_POST", "duplicate", "INVALID_ACCESS_TOKEN", "REVOKED_ACCESS_TOKEN")
+
+
+def classify_failure(platform: str, result: dict) -> Tuple[bool, Optional[float]]:
+    """(ritentabile, attesa suggerita in secondi) per l'esito fallito di publish_post"""
+    if result.get("network_error"):
+        return True, None
+    if result.get("token_refresh_pending"):
+        # Token scaduto ma rinnovabile: si riprova dopo il prossimo giro del refresher
+        return True, result.get("retry_after")
+
+    status = result.get("status_code")
+    retry_after = result.get("retry_after")
+    error_text = str(result.get("error") or "")
+
+    if platform in ("facebook", "instagram"):
+        code = result.get("error_code")
+        if result.get("is_transient"):
+            return True, retry_after
+        if code in GRAPH_FATAL_CODES or (isinstance(code, int) and 200 <= code <= 299):
+            return False, None
+        if code in GRAPH_RETRYABLE_CODES or code in GRAPH_BUC_RATE_LIMIT_CODES:
+            return True, retry_after
+        return status in RETRYABLE_STATUS, retry_after
+
+    if platform == "linkedin":
+        if any(marker in error_text for marker in LINKEDIN_FATAL_MARKERS):
+            return False, None
+        return status in RETRYABLE_STATUS, retry_after
+
+    return status in RETRYABLE_STATUS, retry_after
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Attesa indicata dalla risposta: Retry-After, o il regain access dei rate limit Graph"""
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+    usage = response.headers.get("x-business-use-case-usage")
+    if usage:
+        try:
+            minutes = [
+                entry.get("estimated_time_to_regain_access", 0)
+                for entries in json.loads(usage).values()
+                for entry in entries
+            ]
+        except (ValueError, AttributeError, TypeError):
+            minutes = []
+        if minutes and max(minutes) > 0:
+            return max(minutes) * 60.0
+    return None
+
+
+def next_retry_delay(attempt: int, base_seconds: float, max_seconds: float, retry_after: Optional[float] = None) -> float:
+    """Backoff esponenziale con jitter (attempt parte da 1); mai meno del Retry-After indicato"""
+    delay = min(max_seconds, base_seconds * (2 ** (attempt - 1)))
+    delay = random.uniform(delay / 2, delay)
+    if retry_after:
+        delay = max(delay, min(retry_after, max_seconds))
+    return delay
@@ -1,246 +1,782 @@
+import asyncio
+import hashlib
 import httpx
+import json
 import os
 import logging
 from datetime import datetime, timezone
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.models.post import Post
 from app.models.social_connection import SocialConnection, PostPublication
 from app.models.project import Project
 from app.models.brand import Brand
+from app.services.media_derivatives import rendition_url
+from app.services.media_store import media_store
+from app.services.publish_retry import retry_after_seconds
 
 logger = logging.getLogger(__name__)
 
+try:
+    import h2  # noqa: F401  (httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Attesa dell'elaborazione dei container Instagram: backoff da 1s a 10s, al più 5 minuti
+INSTAGRAM_POLL_SECONDS = 1
+INSTAGRAM_POLL_MAX_SECONDS = 10
+INSTAGRAM_PROCESSING_TIMEOUT = 300
+# Massimo elementi per carosello Instagram / post multi-foto Facebook
+MAX_CAROUSEL_ITEMS = 10
+
+
+def response_json(response: httpx.Response) -> dict:
+    """Corpo JSON della risposta ({} se non è JSON, es. pagine di errore 502)"""
+    try:
+        body = response.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def linkedin_failure(response: httpx.Response) -> dict:
+    return {
+        "success": False,
+        "error": response.text or f"HTTP {response.status_code}",
+        "status_code": response.status_code,
+        "retry_after": retry_after_seconds(response)
+    }
+
+
+def graph_failure(response: httpx.Response, result: dict, default_message: str) -> dict:
+    """Esito fallito Graph API con i dati per classificare l'errore (codice, transitorio, attesa)"""
+    error = result.get("error", {}) if isinstance(result.get("error"), dict) else {}
+    return {
+        "success": False,
+        "error": error.get("message") or default_message,
+        "status_code": response.status_code,
+        "error_code": error.get("code"),
+        "is_transient": bool(error.get("is_transient")),
+        "retry_after": retry_after_seconds(response)
+    }
+
+
+def post_text(post: Post) -> str:
+    """Testo del post con gli hashtag in coda"""
+    content = post.content
+    if post.hashtags:
+        hashtags = " ".join([f"#{h}" if not h.startswith("#") else h for h in post.hashtags])
+        content = f"{content}\n\n{hashtags}"
+    return content
+
+
+def linkedin_author(connection: SocialConnection) -> str:
+    # Determina se pubblicare come persona o organizzazione
+    if connection.account_type == "organization":
+        return f"urn:li:organization:{connection.external_account_id}"
+    return f"urn:li:person:{connection.external_account_id}"
+
+
+def carousel_urls(post: Post) -> List[str]:
+    """Immagini del carosello (senza duplicati), vuoto se il post non è un carosello"""
+    if not post.is_carousel or post.media_type == "video":
+        return []
+    urls = list(dict.fromkeys(url for url in (post.carousel_images or []) if url))
+    return urls[:MAX_CAROUSEL_ITEMS] if len(urls) > 1 else []
+
+
+def staging_fingerprint(post: Post) -> str:
+    """Impronta di testo e media: i container creati in staging valgono solo se non cambia"""
+    payload = json.dumps(
+        [post.content, post.hashtags, post.image_url, post.media_type, post.image_format, carousel_urls(post)],
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
 class PublisherService:
-    
-    async def publish_to_linkedin(self, post: Post, connection: SocialConnection) -> dict:
-        """Pubblica su LinkedIn"""
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            # Prepara contenuto
-            content = post.content
-            if post.hashtags:
-                hashtags = " ".join([f"#{h}" if not h.startswith("#") else h for h in post.hashtags])
-                content = f"{content}\n\n{hashtags}"
-            
-            # Determina se pubblicare come persona o organizzazione
-            if connection.account_type == "organization":
-                author = f"urn:li:organization:{connection.external_account_id}"
-            else:
-                author = f"urn:li:person:{connection.external_account_id}"
-            
-            headers = {
+    """
+    I client HTTP sono uno per API (LinkedIn, Graph per Facebook/Instagram), a lunga vita e
+    condivisi tra le pubblicazioni concorrenti: connessioni keep-alive e TLS già negoziati
+    vengono riusati invece di aprire un client nuovo per ogni post.
+    """
+
+    def __init__(
+        self,
+        linkedin_api_base: str = "https://api.linkedin.com",
+        graph_api_base: str = "https://graph.facebook.com/v18.0",
+        instagram_upload_base: str = "https://rupload.facebook.com/ig-api-upload/v18.0",
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        max_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True
+    ):
+        self.linkedin_api_base = linkedin_api_base.rstrip("/")
+        self.graph_api_base = graph_api_base.rstrip("/")
+        self.instagram_upload_base = instagram_upload_base.rstrip("/")
+        self.timeout = httpx.Timeout(connect_timeout, read=read_timeout, write=read_timeout, pool=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        # LinkedIn e Graph API negoziano HTTP/2 via ALPN; senza h2 si resta su HTTP/1.1
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # === CLIENT HTTP ===
+
+    def client(self, api: str) -> httpx.AsyncClient:
+        """Client condiviso per l'API ("linkedin" o "graph"), creato alla prima richiesta"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Le connessioni del pool sono legate all'event loop che le ha aperte
+            self._clients = {}
+            self._loop = loop
+        client = self._clients.get(api)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, http2=self.http2)
+            self._clients[api] = client
+        return client
+
+    async def aclose(self):
+        """Chiude i client e le connessioni keep-alive (allo shutdown dello scheduler)"""
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            if not client.is_closed:
+                await client.aclose()
+
+    # === STAGING ===
+
+    async def stage_post(self, post: Post, connection: SocialConnection) -> dict:
+        """
+        Prepara la pubblicazione prima dell'orario: valida la connessione, carica i media e crea
+        i container. Restituisce {"success", "staged"} con gli id da passare a publish_post.
+        """
+        validation = await self.validate_connection(connection)
+        if not validation["success"]:
+            return validation
+
+        platform = connection.platform
+        if platform == "linkedin":
+            result = await self.stage_linkedin_media(post, connection)
+        elif platform == "facebook":
+            result = await self.stage_facebook_media(post, connection)
+        elif platform == "instagram":
+            if not post.image_url:
+                return {"success": False, "error": "Instagram richiede un'immagine"}
+            result = await self.create_instagram_container(post, connection)
+        else:
+            return {"success": False, "error": f"Piattaforma {platform} non supportata"}
+
+        if not result["success"]:
+            return result
+        staged = {key: value for key, value in result.items() if key != "success"}
+        staged["fingerprint"] = staging_fingerprint(post)
+        return {"success": True, "staged": staged}
+
+    async def validate_connection(self, connection: SocialConnection) -> dict:
+        """Token non scaduto e, per la Graph API, ancora accettato per l'account"""
+        if connection.token_expires_at and connection.token_expires_at <= datetime.now(timezone.utc):
+            return {"success": False, "error": "Token scaduto, ricollega l'account"}
+        if connection.platform not in ("facebook", "instagram"):
+            return {"success": True}
+
+        response = await self.client("graph").get(
+            f"{self.graph_api_base}/{connection.external_account_id}",
+            params={"fields": "id", "access_token": connection.access_token}
+        )
+        result = response_json(response)
+        if "id" not in result:
+            logger.error(f"{connection.platform} connection check error: {response.status_code} {result}")
+            return graph_failure(response, result, "Connessione non valida")
+        return {"success": True}
+
+    # === LINKEDIN ===
+
+    def linkedin_headers(self, connection: SocialConnection, versioned: bool = False) -> dict:
+        headers = {
+            "Authorization": f"Bearer {connection.access_token}",
+            "Content-Type": "application/json",
+            "X-Restli-Protocol-Version": "2.0.0"
+        }
+        if versioned:
+            headers["LinkedIn-Version"] = settings.LINKEDIN_API_VERSION
+        return headers
+
+    async def stage_linkedin_media(self, post: Post, connection: SocialConnection) -> dict:
+        """Upload del media: {"media_asset"} per le immagini, {"video_urn"} per i video"""
+        if not post.image_url:
+            return {"success": True}
+        if post.media_type == "video":
+            return await self.upload_linkedin_video(post, connection)
+        return await self.upload_linkedin_image(post, connection)
+
+    async def upload_linkedin_image(self, post: Post, connection: SocialConnection) -> dict:
+        client = self.client("linkedin")
+
+        # Step 1: Registra upload
+        register_payload = {
+            "registerUploadRequest": {
+                "recipes": ["urn:li:digitalmediaRecipe:feedshare-image"],
+                "owner": linkedin_author(connection),
+                "serviceRelationships": [{
+                    "relationshipType": "OWNER",
+                    "identifier": "urn:li:userGeneratedContent"
+                }]
+            }
+        }
+        register_response = await client.post(
+            f"{self.linkedin_api_base}/v2/assets?action=registerUpload",
+            json=register_payload,
+            headers=self.linkedin_headers(connection)
+        )
+        if register_response.status_code not in [200, 201]:
+            logger.error(f"LinkedIn register upload error: {register_response.text}")
+            return linkedin_failure(register_response)
+
+        register_data = register_response.json()
+        upload_url = register_data["value"]["uploadMechanism"]["com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest"]["uploadUrl"]
+
+        # Step 2: Upload immagine, in streaming dal disco senza caricare il file in memoria
+        image_path = media_store.local_path(rendition_url(post, post.image_url, "linkedin"))
+        if not os.path.exists(image_path):
+            logger.error(f"Image file not found: {image_path}")
+            return {"success": False, "error": f"Immagine non trovata: {post.image_url}"}
+
+        upload_response = await client.put(
+            upload_url,
+            content=media_store.aiter_file(image_path),
+            headers={
                 "Authorization": f"Bearer {connection.access_token}",
-                "Content-Type": "application/json",
-                "X-Restli-Protocol-Version": "2.0.0"
+                "Content-Type": "application/octet-stream",
+                "Content-Length": str(os.path.getsize(image_path))
             }
-            
-            media_asset = None
-            
-            # Se c'è un'immagine, uploadala
-            if post.image_url:
-                try:
-                    # Step 1: Registra upload
-                    register_payload = {
-                        "registerUploadRequest": {
-                            "recipes": ["urn:li:digitalmediaRecipe:feedshare-image"],
-                            "owner": author,
-                            "serviceRelationships": [{
-                                "relationshipType": "OWNER",
-                                "identifier": "urn:li:userGeneratedContent"
-                            }]
-                        }
-                    }
-                    
-                    register_response = await client.post(
-                        "https://api.linkedin.com/v2/assets?action=registerUpload",
-                        json=register_payload,
-                        headers=headers
-                    )
-                    
-                    if register_response.status_code not in [200, 201]:
-                        logger.error(f"LinkedIn register upload error: {register_response.text}")
-                    else:
-                        register_data = register_response.json()
-                        upload_url = register_data["value"]["uploadMechanism"]["com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest"]["uploadUrl"]
-                        media_asset = register_data["value"]["asset"]
-                        
-                        # Step 2: Upload immagine
-                        image_path = f"/var/www/noscite-calendar/backend{post.image_url}"
-                        
-                        if os.path.exists(image_path):
-                            with open(image_path, "rb") as f:
-                                image_data = f.read()
-                            
-                            upload_response = await client.put(
-                                upload_url,
-                                content=image_data,
-                                headers={
-                                    "Authorization": f"Bearer {connection.access_token}",
-                                    "Content-Type": "application/octet-stream"
-                                }
-                            )
-                            
-                            if upload_response.status_code not in [200, 201]:
-                                logger.error(f"LinkedIn upload image error: {upload_response.status_code}")
-                                media_asset = None
-                        else:
-                            logger.error(f"Image file not found: {image_path}")
-                            media_asset = None
-                            
-                except Exception as e:
-                    logger.error(f"LinkedIn image upload error: {str(e)}")
-                    media_asset = None
-            
-            # Step 3: Crea il post
-            if media_asset:
-                payload = {
-                    "author": author,
-                    "lifecycleState": "PUBLISHED",
-                    "specificContent": {
-                        "com.linkedin.ugc.ShareContent": {
-                            "shareCommentary": {"text": content},
-                            "shareMediaCategory": "IMAGE",
-                            "media": [{
-                                "status": "READY",
-                                "media": media_asset
-                            }]
-                        }
-                    },
-                    "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
-                }
-            else:
-                payload = {
-                    "author": author,
-                    "lifecycleState": "PUBLISHED",
-                    "specificContent": {
-                        "com.linkedin.ugc.ShareContent": {
-                            "shareCommentary": {"text": content},
-                            "shareMediaCategory": "NONE"
-                        }
-                    },
-                    "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
+        )
+        if upload_response.status_code not in [200, 201]:
+            logger.error(f"LinkedIn upload image error: {upload_response.status_code}")
+            return linkedin_failure(upload_response)
+
+        return {"success": True, "media_asset": register_data["value"]["asset"]}
+
+    async def upload_linkedin_video(self, post: Post, connection: SocialConnection) -> dict:
+        """
+        Video con la Videos API: initializeUpload restituisce un URL per ogni parte (multipart
+        per i file grandi), ogni parte viene inviata in streaming dal disco e finalizeUpload
+        riceve gli ETag.
+        """
+        client = self.client("linkedin")
+        video_path = media_store.local_path(post.image_url)
+        if not os.path.exists(video_path):
+            return {"success": False, "error": f"Video non trovato: {post.image_url}"}
+        headers = self.linkedin_headers(connection, versioned=True)
+
+        init_response = await client.post(
+            f"{self.linkedin_api_base}/rest/videos?action=initializeUpload",
+            json={"initializeUploadRequest": {
+                "owner": linkedin_author(connection),
+                "fileSizeBytes": os.path.getsize(video_path),
+                "uploadCaptions": False,
+                "uploadThumbnail": False
+            }},
+            headers=headers
+        )
+        if init_response.status_code not in [200, 201]:
+            logger.error(f"LinkedIn video initialize error: {init_response.status_code} - {init_response.text}")
+            return linkedin_failure(init_response)
+        upload = response_json(init_response).get("value", {})
+
+        part_ids = []
+        for instruction in upload.get("uploadInstructions", []):
+            first_byte, last_byte = instruction["firstByte"], instruction["lastByte"]
+            part_response = await client.put(
+                instruction["uploadUrl"],
+                content=media_store.aiter_file(video_path, first_byte, last_byte),
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(last_byte - first_byte + 1)
                 }
-            
-            response = await client.post(
-                "https://api.linkedin.com/v2/ugcPosts",
-                json=payload,
-                headers=headers
             )
-            
-            if response.status_code in [200, 201]:
-                result = response.json()
-                post_id = result.get("id", "")
-                return {
-                    "success": True,
-                    "external_post_id": post_id,
-                    "external_post_url": f"https://www.linkedin.com/feed/update/{post_id}"
-                }
+            if part_response.status_code not in [200, 201]:
+                logger.error(f"LinkedIn video part error: {part_response.status_code} (bytes {first_byte}-{last_byte})")
+                return linkedin_failure(part_response)
+            part_ids.append(part_response.headers.get("etag"))
+
+        finalize_response = await client.post(
+            f"{self.linkedin_api_base}/rest/videos?action=finalizeUpload",
+            json={"finalizeUploadRequest": {
+                "video": upload.get("video"),
+                "uploadToken": upload.get("uploadToken", ""),
+                "uploadedPartIds": part_ids
+            }},
+            headers=headers
+        )
+        if finalize_response.status_code not in [200, 201]:
+            logger.error(f"LinkedIn video finalize error: {finalize_response.status_code} - {finalize_response.text}")
+            return linkedin_failure(finalize_response)
+
+        return {"success": True, "video_urn": upload.get("video")}
+
+    async def publish_to_linkedin(self, post: Post, connection: SocialConnection, staged: Optional[dict] = None) -> dict:
+        """Pubblica su LinkedIn (con i media già caricati in staging, se presenti)"""
+        if staged is None:
+            if post.image_url and post.media_type == "video":
+                staged = await self.upload_linkedin_video(post, connection)
+                if not staged["success"]:
+                    return staged
             else:
-                logger.error(f"LinkedIn publish error: {response.status_code} - {response.text}")
-                return {"success": False, "error": response.text}
-    async def publish_to_facebook(self, post: Post, connection: SocialConnection) -> dict:
-        """Pubblica su Facebook"""
-        async with httpx.AsyncClient() as client:
-            content = post.content
-            if post.hashtags:
-                hashtags = " ".join([f"#{h}" if not h.startswith("#") else h for h in post.hashtags])
-                content = f"{content}\n\n{hashtags}"
-            
-            page_id = connection.external_account_id
-            
-            if post.image_url:
-                # Post con immagine
-                response = await client.post(
-                    f"https://graph.facebook.com/v18.0/{page_id}/photos",
-                    data={
-                        "caption": content,
-                        "url": post.image_url,
-                        "access_token": connection.access_token
+                try:
+                    staged = await self.stage_linkedin_media(post, connection)
+                except Exception as e:
+                    staged = {"success": False, "error": str(e)}
+                if not staged["success"]:
+                    # Se l'immagine non si carica si pubblica comunque il testo
+                    logger.error(f"LinkedIn image upload error: {staged.get('error')}")
+                    staged = {}
+
+        if staged.get("video_urn"):
+            return await self.create_linkedin_video_post(post, connection, staged["video_urn"])
+
+        content = post_text(post)
+        author = linkedin_author(connection)
+        media_asset = staged.get("media_asset")
+
+        # Step 3: Crea il post
+        if media_asset:
+            payload = {
+                "author": author,
+                "lifecycleState": "PUBLISHED",
+                "specificContent": {
+                    "com.linkedin.ugc.ShareContent": {
+                        "shareCommentary": {"text": content},
+                        "shareMediaCategory": "IMAGE",
+                        "media": [{
+                            "status": "READY",
+                            "media": media_asset
+                        }]
                     }
-                )
-            else:
-                # Post solo testo
-                response = await client.post(
-                    f"https://graph.facebook.com/v18.0/{page_id}/feed",
-                    data={
-                        "message": content,
-                        "access_token": connection.access_token
+                },
+                "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
+            }
+        else:
+            payload = {
+                "author": author,
+                "lifecycleState": "PUBLISHED",
+                "specificContent": {
+                    "com.linkedin.ugc.ShareContent": {
+                        "shareCommentary": {"text": content},
+                        "shareMediaCategory": "NONE"
                     }
-                )
-            
+                },
+                "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
+            }
+
+        response = await self.client("linkedin").post(
+            f"{self.linkedin_api_base}/v2/ugcPosts",
+            json=payload,
+            headers=self.linkedin_headers(connection)
+        )
+
+        if response.status_code in [200, 201]:
             result = response.json()
-            
-            if "id" in result:
-                return {
-                    "success": True,
-                    "external_post_id": result["id"],
-                    "external_post_url": f"https://facebook.com/{result['id']}"
-                }
-            else:
-                logger.error(f"Facebook publish error: {result}")
-                return {"success": False, "error": result.get("error", {}).get("message", "Unknown error")}
-    
-    async def publish_to_instagram(self, post: Post, connection: SocialConnection) -> dict:
-        """Pubblica su Instagram"""
+            post_id = result.get("id", "")
+            return {
+                "success": True,
+                "external_post_id": post_id,
+                "external_post_url": f"https://www.linkedin.com/feed/update/{post_id}"
+            }
+        else:
+            logger.error(f"LinkedIn publish error: {response.status_code} - {response.text}")
+            return linkedin_failure(response)
+
+    async def create_linkedin_video_post(self, post: Post, connection: SocialConnection, video_urn: str) -> dict:
+        """Post video con la Posts API, l'unica che accetta gli urn:li:video"""
+        response = await self.client("linkedin").post(
+            f"{self.linkedin_api_base}/rest/posts",
+            json={
+                "author": linkedin_author(connection),
+                "commentary": post_text(post),
+                "visibility": "PUBLIC",
+                "distribution": {
+                    "feedDistribution": "MAIN_FEED",
+                    "targetEntities": [],
+                    "thirdPartyDistributionChannels": []
+                },
+                "content": {"media": {"id": video_urn}},
+                "lifecycleState": "PUBLISHED",
+                "isReshareDisabledByAuthor": False
+            },
+            headers=self.linkedin_headers(connection, versioned=True)
+        )
+        if response.status_code in [200, 201]:
+            post_id = response.headers.get("x-restli-id") or response_json(response).get("id", "")
+            return {
+                "success": True,
+                "external_post_id": post_id,
+                "external_post_url": f"https://www.linkedin.com/feed/update/{post_id}"
+            }
+        logger.error(f"LinkedIn video publish error: {response.status_code} - {response.text}")
+        return linkedin_failure(response)
+
+    # === FACEBOOK ===
+
+    async def stage_facebook_media(self, post: Post, connection: SocialConnection) -> dict:
+        """Video caricato senza la fase finale, foto caricate non pubblicate: {"video_id"} o {"photo_ids"}"""
         if not post.image_url:
-            return {"success": False, "error": "Instagram richiede un'immagine"}
-        
-        async with httpx.AsyncClient() as client:
-            ig_account_id = connection.external_account_id
-            
-            content = post.content
-            if post.hashtags:
-                hashtags = " ".join([f"#{h}" if not h.startswith("#") else h for h in post.hashtags])
-                content = f"{content}\n\n{hashtags}"
-            
-            # Step 1: Crea media container
-            container_response = await client.post(
-                f"https://graph.facebook.com/v18.0/{ig_account_id}/media",
+            return {"success": True}
+        if post.media_type == "video":
+            return await self.upload_facebook_video(post, connection)
+        return await self.upload_facebook_photos(post, connection)
+
+    async def upload_facebook_photos(self, post: Post, connection: SocialConnection) -> dict:
+        """Foto del post (tutte quelle del carosello) caricate non pubblicate, in parallelo"""
+        sources = carousel_urls(post) or [post.image_url]
+        responses = await asyncio.gather(*(
+            self.post_facebook_photo(post, connection, source, {"published": "false"})
+            for source in sources
+        ))
+        photo_ids = []
+        for response in responses:
+            result = response_json(response)
+            if "id" not in result:
+                logger.error(f"Facebook photo upload error: {response.status_code} {result}")
+                return graph_failure(response, result, "Photo upload failed")
+            photo_ids.append(result["id"])
+        return {"success": True, "photo_ids": photo_ids}
+
+    async def post_facebook_photo(self, post: Post, connection: SocialConnection, source_url: str, data: dict) -> httpx.Response:
+        """
+        POST /photos: i file locali vanno in multipart (letti a blocchi da httpx),
+        gli URL esterni li scarica Facebook
+        """
+        image_url = rendition_url(post, source_url, "facebook")
+        image_path = media_store.local_path(image_url) if image_url.startswith("/") else None
+        url = f"{self.graph_api_base}/{connection.external_account_id}/photos"
+        data = {**data, "access_token": connection.access_token}
+        if image_path and os.path.exists(image_path):
+            with open(image_path, "rb") as f:
+                return await self.client("graph").post(
+                    url,
+                    data=data,
+                    files={"source": (os.path.basename(image_path), f, "application/octet-stream")}
+                )
+        return await self.client("graph").post(url, data={**data, "url": media_store.public_url(image_url)})
+
+    async def upload_facebook_video(self, post: Post, connection: SocialConnection) -> dict:
+        """
+        Fasi start/transfer dell'upload resumable della Graph API: Facebook indica ogni volta
+        l'intervallo di byte del blocco successivo, letto dal disco solo in quel momento.
+        """
+        client = self.client("graph")
+        video_path = media_store.local_path(post.image_url)
+        if not os.path.exists(video_path):
+            return {"success": False, "error": f"Video non trovato: {post.image_url}"}
+        url = f"{self.graph_api_base}/{connection.external_account_id}/videos"
+
+        start_response = await client.post(url, data={
+            "upload_phase": "start",
+            "file_size": str(os.path.getsize(video_path)),
+            "access_token": connection.access_token
+        })
+        session = response_json(start_response)
+        if "upload_session_id" not in session:
+            logger.error(f"Facebook video start error: {start_response.status_code} {session}")
+            return graph_failure(start_response, session, "Video upload start failed")
+
+        start_offset, end_offset = int(session["start_offset"]), int(session["end_offset"])
+        while start_offset < end_offset:
+            chunk = await asyncio.to_thread(media_store.read_range, video_path, start_offset, end_offset - start_offset)
+            transfer_response = await client.post(
+                url,
                 data={
-                    "image_url": f"https://calendar.noscite.it{post.image_url}" if post.image_url.startswith("/") else post.image_url,
-                    "caption": content,
+                    "upload_phase": "transfer",
+                    "upload_session_id": session["upload_session_id"],
+                    "start_offset": str(start_offset),
                     "access_token": connection.access_token
-                }
+                },
+                files={"video_file_chunk": ("chunk", chunk, "application/octet-stream")}
             )
-            container_result = container_response.json()
-            
-            if "id" not in container_result:
-                logger.error(f"Instagram container error: {container_result}")
-                return {"success": False, "error": container_result.get("error", {}).get("message", "Container creation failed")}
-            
-            container_id = container_result["id"]
-            
-            # Step 2: Pubblica il container
-            publish_response = await client.post(
-                f"https://graph.facebook.com/v18.0/{ig_account_id}/media_publish",
+            transfer = response_json(transfer_response)
+            if "start_offset" not in transfer:
+                logger.error(f"Facebook video transfer error: {transfer_response.status_code} {transfer}")
+                return graph_failure(transfer_response, transfer, "Video upload transfer failed")
+            start_offset, end_offset = int(transfer["start_offset"]), int(transfer["end_offset"])
+
+        return {"success": True, "video_id": session["video_id"], "upload_session_id": session["upload_session_id"]}
+
+    async def publish_to_facebook(self, post: Post, connection: SocialConnection, staged: Optional[dict] = None) -> dict:
+        """Pubblica su Facebook (con i media già caricati in staging, se presenti)"""
+        client = self.client("graph")
+        content = post_text(post)
+        page_id = connection.external_account_id
+        staged = staged or {}
+
+        if post.image_url and post.media_type == "video":
+            if not staged.get("video_id"):
+                staged = await self.upload_facebook_video(post, connection)
+                if not staged["success"]:
+                    return staged
+            # La fase finish pubblica il video caricato
+            response = await client.post(
+                f"{self.graph_api_base}/{page_id}/videos",
                 data={
-                    "creation_id": container_id,
+                    "upload_phase": "finish",
+                    "upload_session_id": staged["upload_session_id"],
+                    "description": content,
                     "access_token": connection.access_token
                 }
             )
-            publish_result = publish_response.json()
-            
-            if "id" in publish_result:
-                return {
-                    "success": True,
-                    "external_post_id": publish_result["id"],
-                    "external_post_url": f"https://instagram.com/p/{publish_result['id']}"
+            result = response_json(response)
+            if result.get("success"):
+                result = {"id": staged["video_id"]}
+        elif post.image_url and (staged.get("photo_ids") or carousel_urls(post)):
+            # Foto già caricate (in staging o qui in parallelo): il post le allega
+            if not staged.get("photo_ids"):
+                staged = await self.upload_facebook_photos(post, connection)
+                if not staged["success"]:
+                    return staged
+            data = {"message": content, "access_token": connection.access_token}
+            for i, photo_id in enumerate(staged["photo_ids"]):
+                data[f"attached_media[{i}]"] = json.dumps({"media_fbid": photo_id})
+            response = await client.post(f"{self.graph_api_base}/{page_id}/feed", data=data)
+            result = response_json(response)
+        elif post.image_url:
+            # Post con immagine
+            response = await self.post_facebook_photo(post, connection, post.image_url, {"caption": content})
+            result = response_json(response)
+        else:
+            # Post solo testo
+            response = await client.post(
+                f"{self.graph_api_base}/{page_id}/feed",
+                data={
+                    "message": content,
+                    "access_token": connection.access_token
                 }
-            else:
-                logger.error(f"Instagram publish error: {publish_result}")
-                return {"success": False, "error": publish_result.get("error", {}).get("message", "Publish failed")}
-    
-    async def publish_post(self, post: Post, connection: SocialConnection) -> dict:
-        """Pubblica un post sulla piattaforma appropriata"""
+            )
+            result = response_json(response)
+
+        if "id" in result:
+            return {
+                "success": True,
+                "external_post_id": result["id"],
+                "external_post_url": f"https://facebook.com/{result['id']}"
+            }
+        else:
+            logger.error(f"Facebook publish error: {response.status_code} {result}")
+            return graph_failure(response, result, "Unknown error")
+
+    # === INSTAGRAM ===
+
+    async def create_instagram_container(self, post: Post, connection: SocialConnection) -> dict:
+        """Container pronto da pubblicare: {"container_id"}"""
+        if post.media_type == "video":
+            return await self.create_instagram_video_container(post, connection)
+        if carousel_urls(post):
+            return await self.create_instagram_carousel_container(post, connection)
+        return await self.create_instagram_image_container(post, connection, post.image_url, caption=post_text(post))
+
+    async def create_instagram_image_container(
+        self,
+        post: Post,
+        connection: SocialConnection,
+        source_url: str,
+        caption: Optional[str] = None
+    ) -> dict:
+        # Le immagini Instagram le scarica solo da URL pubblico
+        data = {
+            "image_url": media_store.public_url(rendition_url(post, source_url, "instagram")),
+            "access_token": connection.access_token
+        }
+        if caption is None:
+            data["is_carousel_item"] = "true"
+        else:
+            data["caption"] = caption
+        response = await self.client("graph").post(
+            f"{self.graph_api_base}/{connection.external_account_id}/media",
+            data=data
+        )
+        result = response_json(response)
+        if "id" not in result:
+            logger.error(f"Instagram container error: {response.status_code} {result}")
+            return graph_failure(response, result, "Container creation failed")
+        return {"success": True, "container_id": result["id"]}
+
+    async def create_instagram_carousel_container(self, post: Post, connection: SocialConnection) -> dict:
+        """
+        Carosello: i container figli si creano tutti in parallelo, si attende la loro
+        elaborazione con un solo polling, poi si crea il container CAROUSEL che li raccoglie.
+        """
+        children = await asyncio.gather(*(
+            self.create_instagram_image_container(post, connection, source)
+            for source in carousel_urls(post)
+        ))
+        failed = next((child for child in children if not child["success"]), None)
+        if failed:
+            return failed
+        child_ids = [child["container_id"] for child in children]
+
+        failure = await self.wait_instagram_containers(connection, child_ids)
+        if failure:
+            return failure
+
+        response = await self.client("graph").post(
+            f"{self.graph_api_base}/{connection.external_account_id}/media",
+            data={
+                "media_type": "CAROUSEL",
+                "children": ",".join(child_ids),
+                "caption": post_text(post),
+                "access_token": connection.access_token
+            }
+        )
+        result = response_json(response)
+        if "id" not in result:
+            logger.error(f"Instagram carousel container error: {response.status_code} {result}")
+            return graph_failure(response, result, "Carousel container creation failed")
+
+        failure = await self.wait_instagram_containers(connection, [result["id"]])
+        if failure:
+            return failure
+        return {"success": True, "container_id": result["id"]}
+
+    async def wait_instagram_containers(self, connection: SocialConnection, container_ids: List[str]) -> Optional[dict]:
+        """
+        Attende che i container siano FINISHED, interrogandoli tutti insieme (?ids=) con backoff.
+        Restituisce None se sono pronti, altrimenti l'esito fallito.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + INSTAGRAM_PROCESSING_TIMEOUT
+        delay = INSTAGRAM_POLL_SECONDS
+        pending = list(container_ids)
+        while True:
+            response = await self.client("graph").get(
+                f"{self.graph_api_base}/",
+                params={"ids": ",".join(pending), "fields": "status_code", "access_token": connection.access_token}
+            )
+            result = response_json(response)
+            statuses = {container_id: (result.get(container_id) or {}).get("status_code") for container_id in pending}
+            failed = [container_id for container_id, status in statuses.items() if status in ("ERROR", "EXPIRED")]
+            if failed:
+                return {"success": False, "error": f"Elaborazione media Instagram fallita ({', '.join(failed)})"}
+            pending = [container_id for container_id, status in statuses.items() if status != "FINISHED"]
+            if not pending:
+                return None
+            if loop.time() + delay > deadline:
+                # Stesso codice dell'errore "media non pronto": il retry lo ritenta più tardi
+                return {"success": False, "error": "Elaborazione media Instagram non completata", "error_code": 9007}
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INSTAGRAM_POLL_MAX_SECONDS)
+
+    async def create_instagram_video_container(self, post: Post, connection: SocialConnection) -> dict:
+        """
+        Container Reel con upload resumable: il file viene inviato in streaming dal disco a
+        rupload.facebook.com invece di far scaricare a Instagram un URL pubblico, poi si attende
+        che il container finisca l'elaborazione.
+        """
+        client = self.client("graph")
+        video_path = media_store.local_path(post.image_url)
+        if not os.path.exists(video_path):
+            return {"success": False, "error": f"Video non trovato: {post.image_url}"}
+
+        container_response = await client.post(
+            f"{self.graph_api_base}/{connection.external_account_id}/media",
+            data={
+                "media_type": "REELS",
+                "upload_type": "resumable",
+                "caption": post_text(post),
+                "access_token": connection.access_token
+            }
+        )
+        container_result = response_json(container_response)
+        if "id" not in container_result:
+            logger.error(f"Instagram video container error: {container_response.status_code} {container_result}")
+            return graph_failure(container_response, container_result, "Container creation failed")
+        container_id = container_result["id"]
+
+        size = os.path.getsize(video_path)
+        upload_response = await client.post(
+            f"{self.instagram_upload_base}/{container_id}",
+            content=media_store.aiter_file(video_path),
+            headers={
+                "Authorization": f"OAuth {connection.access_token}",
+                "offset": "0",
+                "file_size": str(size),
+                "Content-Length": str(size)
+            }
+        )
+        upload_result = response_json(upload_response)
+        if upload_response.status_code != 200 or not upload_result.get("success", True):
+            logger.error(f"Instagram video upload error: {upload_response.status_code} {upload_result}")
+            return graph_failure(upload_response, upload_result, "Video upload failed")
+
+        failure = await self.wait_instagram_containers(connection, [container_id])
+        if failure:
+            return failure
+        return {"success": True, "container_id": container_id}
+
+    async def publish_to_instagram(self, post: Post, connection: SocialConnection, staged: Optional[dict] = None) -> dict:
+        """Pubblica su Instagram (con il container già creato in staging, se presente)"""
+        if not post.image_url:
+            return {"success": False, "error": "Instagram richiede un'immagine"}
+
+        # Step 1: Crea media container
+        container = staged if staged and staged.get("container_id") else await self.create_instagram_container(post, connection)
+        if not container.get("container_id"):
+            return container
+
+        # Step 2: Pubblica il container
+        publish_response = await self.client("graph").post(
+            f"{self.graph_api_base}/{connection.external_account_id}/media_publish",
+            data={
+                "creation_id": container["container_id"],
+                "access_token": connection.access_token
+            }
+        )
+        publish_result = response_json(publish_response)
+
+        if "id" in publish_result:
+            return {
+                "success": True,
+                "external_post_id": publish_result["id"],
+                "external_post_url": f"https://instagram.com/p/{publish_result['id']}"
+            }
+        else:
+            logger.error(f"Instagram publish error: {publish_response.status_code} {publish_result}")
+            return graph_failure(publish_response, publish_result, "Publish failed")
+
+    # === PUBBLICAZIONE ===
+
+    async def publish_post(self, post: Post, connection: SocialConnection, staged: Optional[dict] = None) -> dict:
+        """
+        Pubblica un post sulla piattaforma appropriata. Con staged (da stage_post) resta solo la
+        chiamata di pubblicazione; se il post è cambiato dopo lo staging si rifà tutto.
+        """
         platform = connection.platform
-        
+        if staged and staged.get("fingerprint") != staging_fingerprint(post):
+            logger.info(f"Post {post.id} changed after staging: publishing without staged media")
+            staged = None
+
         if platform == "linkedin":
-            return await self.publish_to_linkedin(post, connection)
+            return await self.publish_to_linkedin(post, connection, staged)
         elif platform == "facebook":
-            return await self.publish_to_facebook(post, connection)
+            return await self.publish_to_facebook(post, connection, staged)
         elif platform == "instagram":
-            return await self.publish_to_instagram(post, connection)
+            return await self.publish_to_instagram(post, connection, staged)
         else:
             return {"success": False, "error": f"Piattaforma {platform} non supportata"}
 
 
-publisher_service = PublisherService()
+# Singleton di processo (client e pool di connessioni condivisi tra le pubblicazioni)
+publisher_service = PublisherService(
+    linkedin_api_base=settings.LINKEDIN_API_BASE,
+    graph_api_base=settings.GRAPH_API_BASE,
+    instagram_upload_base=settings.INSTAGRAM_UPLOAD_BASE,
+    connect_timeout=settings.PUBLISHER_CONNECT_TIMEOUT,
+    read_timeout=settings.PUBLISHER_READ_TIMEOUT,
+    max_connections=settings.PUBLISHER_MAX_CONNECTIONS,
+    keepalive_expiry=settings.PUBLISHER_KEEPALIVE_EXPIRY
+)
@@ -1,18 +1,28 @@
 from datetime import datetime
+from collections import OrderedDict, deque
+import asyncio
+import codecs
+import hashlib
+import itertools
+import json
+import math
 import os
+import threading
 import uuid
+import numpy as np
 import tiktoken
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, AsyncIterator
 from pathlib import Path
 import PyPDF2
 from docx import Document as DocxDocument
 from pptx import Presentation
 from openai import OpenAI
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, insert
 
 from app.core.config import settings
 from app.models.brand_document import BrandDocument, DocumentChunk
+from app.services.embedding_batcher import embedding_batcher, EMBEDDING_DIMENSIONS
 
 # Directory per upload
 UPLOAD_DIR = Path("/var/www/noscite-calendar/uploads/documents")
@@ -21,47 +31,79 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 # Tokenizer per contare token
 encoding = tiktoken.get_encoding("cl100k_base")
 
+# Configurazione text search di Postgres (deve coincidere con la colonna content_tsv)
+FTS_CONFIG = "italian"
+
+
+class LRUCache:
+    """Piccola cache LRU thread-safe (embedding delle query, contesti assemblati)"""
+    
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
 
 class RAGService:
     def __init__(self):
         self.openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
         self.chunk_size = 500
         self.chunk_overlap = 50
+        # Cache query -> embedding e (brand, query, versione KB) -> contesto
+        self.embedding_cache = LRUCache(maxsize=512)
+        self.context_cache = LRUCache(maxsize=128)
     
     # === FILE EXTRACTION ===
+    # Gli estrattori sono generatori di sezioni (pagina, paragrafo, tabella, slide):
+    # il testo completo del documento non viene mai tenuto in memoria.
     
-    def extract_text_from_pdf(self, file_path: str) -> str:
-        text = ""
+    def iter_pdf_sections(self, file_path: str) -> Iterator[Dict[str, Any]]:
         try:
             with open(file_path, 'rb') as file:
                 reader = PyPDF2.PdfReader(file)
-                for page in reader.pages:
+                for page_number, page in enumerate(reader.pages, 1):
                     page_text = page.extract_text()
                     if page_text:
-                        text += page_text + "\n\n"
+                        yield {"text": page_text, "page_number": page_number}
         except Exception as e:
             print(f"Errore estrazione PDF: {e}")
-        return text.strip()
     
-    def extract_text_from_docx(self, file_path: str) -> str:
-        text = ""
+    def iter_docx_sections(self, file_path: str) -> Iterator[Dict[str, Any]]:
         try:
             doc = DocxDocument(file_path)
             for para in doc.paragraphs:
                 if para.text.strip():
-                    text += para.text + "\n\n"
+                    yield {"text": para.text}
             for table in doc.tables:
+                rows = []
                 for row in table.rows:
                     row_text = " | ".join(cell.text for cell in row.cells)
                     if row_text.strip():
-                        text += row_text + "\n"
-                text += "\n"
+                        rows.append(row_text)
+                if rows:
+                    yield {"text": "\n".join(rows)}
         except Exception as e:
             print(f"Errore estrazione DOCX: {e}")
-        return text.strip()
     
-    def extract_text_from_pptx(self, file_path: str) -> str:
-        text = ""
+    def iter_pptx_sections(self, file_path: str) -> Iterator[Dict[str, Any]]:
         try:
             prs = Presentation(file_path)
             for slide_num, slide in enumerate(prs.slides, 1):
@@ -70,102 +112,131 @@ class RAGService:
                     if hasattr(shape, "text") and shape.text.strip():
                         slide_text += shape.text + "\n"
                 if slide_text.strip() != f"--- Slide {slide_num} ---":
-                    text += slide_text + "\n"
+                    yield {"text": slide_text, "page_number": slide_num}
         except Exception as e:
             print(f"Errore estrazione PPTX: {e}")
-        return text.strip()
     
-    def extract_text_from_txt(self, file_path: str) -> str:
+    def _detect_text_encoding(self, file_path: str) -> str:
+        """Verifica UTF-8 leggendo il file a blocchi (memoria costante), altrimenti latin-1"""
+        decoder = codecs.getincrementaldecoder('utf-8')()
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
+            return 'utf-8'
         except UnicodeDecodeError:
-            with open(file_path, 'r', encoding='latin-1') as f:
-                return f.read()
+            return 'latin-1'
     
-    def extract_text(self, file_path: str, file_type: str) -> str:
+    def iter_txt_sections(self, file_path: str, max_section_chars: int = 65536) -> Iterator[Dict[str, Any]]:
+        """Paragrafi (separati da riga vuota) letti riga per riga; paragrafi enormi vengono spezzati"""
+        encoding_name = self._detect_text_encoding(file_path)
+        with open(file_path, 'r', encoding=encoding_name) as f:
+            lines = []
+            size = 0
+            for line in f:
+                if not line.strip():
+                    if lines:
+                        yield {"text": "".join(lines)}
+                        lines, size = [], 0
+                    continue
+                lines.append(line)
+                size += len(line)
+                if size >= max_section_chars:
+                    yield {"text": "".join(lines)}
+                    lines, size = [], 0
+            if lines:
+                yield {"text": "".join(lines)}
+    
+    def iter_sections(self, file_path: str, file_type: str) -> Iterator[Dict[str, Any]]:
         extractors = {
-            'pdf': self.extract_text_from_pdf,
-            'docx': self.extract_text_from_docx,
-            'doc': self.extract_text_from_docx,
-            'pptx': self.extract_text_from_pptx,
-            'ppt': self.extract_text_from_pptx,
-            'txt': self.extract_text_from_txt,
-            'md': self.extract_text_from_txt,
+            'pdf': self.iter_pdf_sections,
+            'docx': self.iter_docx_sections,
+            'doc': self.iter_docx_sections,
+            'pptx': self.iter_pptx_sections,
+            'ppt': self.iter_pptx_sections,
+            'txt': self.iter_txt_sections,
+            'md': self.iter_txt_sections,
         }
         extractor = extractors.get(file_type.lower())
         if extractor:
-            return extractor(file_path)
-        return ""
+            yield from extractor(file_path)
+    
+    def extract_text(self, file_path: str, file_type: str) -> str:
+        """Testo completo del documento (solo per file piccoli: l'ingestion usa iter_sections)"""
+        return "\n\n".join(s["text"].strip() for s in self.iter_sections(file_path, file_type)).strip()
     
     # === CHUNKING ===
     
     def count_tokens(self, text: str) -> int:
         return len(encoding.encode(text))
     
-    def chunk_text(self, text: str) -> List[Dict[str, Any]]:
-        chunks = []
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-        
+    def iter_chunks(self, sections: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Chunker in streaming: consuma sezioni e produce chunk da ~chunk_size token"""
         current_chunk = ""
         current_tokens = 0
+        current_page = None
         chunk_index = 0
         
-        for para in paragraphs:
-            para_tokens = self.count_tokens(para)
+        for section in sections:
+            page = section.get("page_number")
+            paragraphs = (p.strip() for p in section["text"].split('\n\n'))
             
-            if para_tokens > self.chunk_size:
-                if current_chunk:
-                    chunks.append({
-                        "index": chunk_index,
-                        "content": current_chunk.strip(),
-                        "token_count": current_tokens
-                    })
-                    chunk_index += 1
-                    current_chunk = ""
-                    current_tokens = 0
+            for para in paragraphs:
+                if not para:
+                    continue
+                if not current_chunk:
+                    current_page = page
+                para_tokens = self.count_tokens(para)
                 
-                sentences = para.replace('. ', '.|').split('|')
-                for sentence in sentences:
-                    sent_tokens = self.count_tokens(sentence)
-                    if current_tokens + sent_tokens > self.chunk_size:
-                        if current_chunk:
-                            chunks.append({
-                                "index": chunk_index,
-                                "content": current_chunk.strip(),
-                                "token_count": current_tokens
-                            })
-                            chunk_index += 1
-                        current_chunk = sentence
-                        current_tokens = sent_tokens
-                    else:
-                        current_chunk += " " + sentence
-                        current_tokens += sent_tokens
-            
-            elif current_tokens + para_tokens > self.chunk_size:
-                if current_chunk:
-                    chunks.append({
-                        "index": chunk_index,
-                        "content": current_chunk.strip(),
-                        "token_count": current_tokens
-                    })
-                    chunk_index += 1
+                if para_tokens > self.chunk_size:
+                    if current_chunk:
+                        yield self._make_chunk(chunk_index, current_chunk, current_tokens, current_page)
+                        chunk_index += 1
+                        current_chunk = ""
+                        current_tokens = 0
+                    current_page = page
+                    
+                    sentences = para.replace('. ', '.|').split('|')
+                    for sentence in sentences:
+                        sent_tokens = self.count_tokens(sentence)
+                        if current_tokens + sent_tokens > self.chunk_size:
+                            if current_chunk:
+                                yield self._make_chunk(chunk_index, current_chunk, current_tokens, current_page)
+                                chunk_index += 1
+                            current_chunk = sentence
+                            current_tokens = sent_tokens
+                            current_page = page
+                        else:
+                            current_chunk += " " + sentence
+                            current_tokens += sent_tokens
                 
-                overlap_text = current_chunk[-200:] if len(current_chunk) > 200 else ""
-                current_chunk = overlap_text + "\n\n" + para
-                current_tokens = self.count_tokens(current_chunk)
-            else:
-                current_chunk += "\n\n" + para
-                current_tokens += para_tokens
+                elif current_tokens + para_tokens > self.chunk_size:
+                    if current_chunk:
+                        yield self._make_chunk(chunk_index, current_chunk, current_tokens, current_page)
+                        chunk_index += 1
+                    
+                    overlap_text = current_chunk[-200:] if len(current_chunk) > 200 else ""
+                    current_chunk = overlap_text + "\n\n" + para
+                    current_tokens = self.count_tokens(current_chunk)
+                    current_page = page
+                else:
+                    current_chunk += "\n\n" + para
+                    current_tokens += para_tokens
         
         if current_chunk.strip():
-            chunks.append({
-                "index": chunk_index,
-                "content": current_chunk.strip(),
-                "token_count": self.count_tokens(current_chunk)
-            })
-        
-        return chunks
+            yield self._make_chunk(chunk_index, current_chunk, self.count_tokens(current_chunk), current_page)
+    
+    def _make_chunk(self, index: int, content: str, token_count: int, page_number: Optional[int]) -> Dict[str, Any]:
+        return {
+            "index": index,
+            "content": content.strip(),
+            "token_count": token_count,
+            "page_number": page_number
+        }
+    
+    def chunk_text(self, text: str) -> List[Dict[str, Any]]:
+        return list(self.iter_chunks([{"text": text}]))
     
     # === EMBEDDINGS ===
     
@@ -176,6 +247,15 @@ class RAGService:
         )
         return response.data[0].embedding
     
+    def get_query_embedding(self, query: str) -> List[float]:
+        """Embedding di una query di ricerca, con cache LRU"""
+        key = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        embedding = self.embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.generate_embedding(query)
+            self.embedding_cache.set(key, embedding)
+        return embedding
+    
     def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
         response = self.openai_client.embeddings.create(
             model="text-embedding-3-small",
@@ -183,16 +263,23 @@ class RAGService:
         )
         return [item.embedding for item in response.data]
     
-    # === DOCUMENT ANALYSIS ===
-    
-    async def analyze_document(self, document: BrandDocument, text: str, db: Session) -> Dict[str, Any]:
-        """Analizza il documento con AI per estrarre summary, tipo e key topics"""
-        from anthropic import Anthropic
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Embedding di più query: quelle non in cache vengono calcolate con una sola chiamata API"""
+        keys = [hashlib.sha256(q.encode("utf-8")).hexdigest() for q in queries]
+        embeddings = [self.embedding_cache.get(k) for k in keys]
         
-        client = Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-        text_sample = text[:8000] if len(text) > 8000 else text
+        missing = [i for i, e in enumerate(embeddings) if e is None]
+        if missing:
+            computed = self.generate_embeddings_batch([queries[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+                self.embedding_cache.set(keys[i], embedding)
         
-        prompt = f"""Analizza questo documento aziendale e fornisci:
+        return embeddings
+    
+    # === DOCUMENT ANALYSIS ===
+    
+    ANALYSIS_PROMPT = """Analizza questo documento aziendale e fornisci:
 
 1. **Tipo documento**: Classifica in UNA categoria:
    - brand_guidelines, company_presentation, product_info, case_study
@@ -206,27 +293,118 @@ class RAGService:
 
 5. **Target Audience**: A chi è rivolto.
 
-DOCUMENTO:
-{text_sample}
+{source_label}:
+{source}
 
 Rispondi SOLO in JSON:
 {{"document_type": "tipo", "summary": "riassunto", "key_topics": ["t1", "t2"], "tone_of_voice": "tono", "target_audience": "target"}}"""
+    
+    MAP_PROMPT = """Questa è la sezione {part} di {total_parts} di un documento aziendale.
+Riassumi in 3-5 frasi i contenuti chiave della sezione, indicando temi principali, prodotti/servizi citati,
+tono usato e a chi si rivolge. Rispondi solo con il riassunto, senza premesse.
 
+SEZIONE:
+{content}"""
+    
+    def _parse_json_response(self, response_text: str) -> Dict[str, Any]:
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0]
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0]
+        return json.loads(response_text.strip())
+    
+    def _group_chunks_for_map(self, chunks: Iterable[Dict[str, Any]], total_tokens: Optional[int] = None) -> List[str]:
+        """
+        Raggruppa i chunk in sezioni da ~ANALYSIS_MAP_GROUP_TOKENS token.
+        Se il documento supera il budget, tiene una sezione ogni "stride" così che il
+        riassunto copri tutto il documento e non solo l'inizio. Accetta un iteratore:
+        vengono tenuti in memoria solo i testi delle sezioni selezionate.
+        """
+        if total_tokens is None:
+            chunks = list(chunks)
+            total_tokens = sum(c["token_count"] or self.count_tokens(c["content"]) for c in chunks)
+        stride = max(1, math.ceil(total_tokens / settings.ANALYSIS_TOKEN_BUDGET))
+        
+        groups = []
+        current, current_tokens = [], 0
+        group_index = 0
+        for chunk in chunks:
+            tokens = chunk["token_count"] or self.count_tokens(chunk["content"])
+            if current_tokens and current_tokens + tokens > settings.ANALYSIS_MAP_GROUP_TOKENS:
+                if current:
+                    groups.append("\n\n".join(current))
+                current, current_tokens = [], 0
+                group_index += 1
+            if group_index % stride == 0:
+                current.append(chunk["content"])
+            current_tokens += tokens
+        if current:
+            groups.append("\n\n".join(current))
+        
+        return groups
+    
+    async def _map_summaries(self, client, sections: List[str]) -> List[str]:
+        """Riassunti delle sezioni in parallelo, con fan-out limitato, sul modello economico"""
+        semaphore = asyncio.Semaphore(settings.ANALYSIS_MAX_CONCURRENCY)
+        
+        async def summarize(index: int, content: str) -> str:
+            async with semaphore:
+                try:
+                    response = await client.messages.create(
+                        model=settings.ANALYSIS_MAP_MODEL,
+                        max_tokens=400,
+                        messages=[{"role": "user", "content": self.MAP_PROMPT.format(
+                            part=index + 1, total_parts=len(sections), content=content
+                        )}]
+                    )
+                    return response.content[0].text.strip()
+                except Exception as e:
+                    print(f"Errore riassunto sezione {index + 1}: {e}")
+                    return ""
+        
+        summaries = await asyncio.gather(*(summarize(i, c) for i, c in enumerate(sections)))
+        return [f"[Sezione {i + 1}/{len(sections)}] {s}" for i, s in enumerate(summaries) if s]
+    
+    async def analyze_document(
+        self,
+        document: BrandDocument,
+        text: str,
+        db: Session,
+        chunks: Optional[Iterable[Dict[str, Any]]] = None,
+        total_tokens: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Analizza il documento con AI per estrarre summary, tipo e key topics.
+        Se vengono passati i chunk (documenti lunghi) usa map-reduce: riassunti per sezione
+        in parallelo, poi un passaggio di reduce sull'insieme dei riassunti.
+        """
+        from anthropic import AsyncAnthropic
+        
+        client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+        
         try:
-            response = client.messages.create(
+            if chunks is None:
+                source_label = "DOCUMENTO"
+                source = text[:8000]
+            else:
+                sections = self._group_chunks_for_map(chunks, total_tokens)
+                summaries = await self._map_summaries(client, sections)
+                if summaries:
+                    source_label = "RIASSUNTI DELLE SEZIONI DEL DOCUMENTO (in ordine)"
+                    source = "\n\n".join(summaries)
+                else:
+                    source_label = "DOCUMENTO"
+                    source = text[:8000]
+            
+            response = await client.messages.create(
                 model="claude-sonnet-4-20250514",
                 max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+                messages=[{"role": "user", "content": self.ANALYSIS_PROMPT.format(
+                    source_label=source_label, source=source
+                )}]
             )
             
-            response_text = response.content[0].text
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0]
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0]
-            
-            import json
-            analysis = json.loads(response_text.strip())
+            analysis = self._parse_json_response(response.content[0].text)
             
             document.summary = analysis.get("summary", "")
             document.key_topics = {
@@ -248,57 +426,120 @@ Rispondi SOLO in JSON:
     
     # === DOCUMENT PROCESSING ===
     
+    async def iter_embedded_chunks(
+        self,
+        file_path: str,
+        file_type: str,
+        stats: Dict[str, Any],
+        window_size: int = 128,
+        max_pending: int = 4
+    ) -> AsyncIterator[List[tuple]]:
+        """
+        Pipeline in streaming: estrazione -> chunking -> embedding, a finestre di window_size chunk.
+        Al più max_pending finestre sono in attesa di embedding: la memoria di picco dipende
+        dalle finestre e non dalla dimensione del file.
+        In stats vengono raccolti caratteri totali e i primi 8000 caratteri (per l'analisi).
+        """
+        stats.setdefault("chars", 0)
+        stats.setdefault("head", "")
+        
+        def tracked_sections():
+            for section in self.iter_sections(file_path, file_type):
+                stats["chars"] += len(section["text"])
+                if len(stats["head"]) < 8000:
+                    stats["head"] = (stats["head"] + section["text"].strip() + "\n\n")[:8000]
+                yield section
+        
+        async def embed_window(window):
+            embeddings = await embedding_batcher.embed(
+                [c["content"] for c in window],
+                [c["token_count"] for c in window]
+            )
+            return list(zip(window, embeddings))
+        
+        chunks = self.iter_chunks(tracked_sections())
+        pending = deque()
+        try:
+            while True:
+                # Estrazione/parsing in un thread: il loop resta libero per le altre richieste
+                window = await asyncio.to_thread(lambda: list(itertools.islice(chunks, window_size)))
+                if window:
+                    pending.append(asyncio.ensure_future(embed_window(window)))
+                if pending and (not window or len(pending) >= max_pending):
+                    yield await pending.popleft()
+                if not window and not pending:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def iter_stored_chunks(self, db: Session, document_id: int) -> Iterator[Dict[str, Any]]:
+        """Rilegge i chunk salvati in streaming (per l'analisi map-reduce)"""
+        rows = db.query(DocumentChunk.content, DocumentChunk.token_count).filter(
+            DocumentChunk.document_id == document_id
+        ).order_by(DocumentChunk.chunk_index).yield_per(200)
+        for content, token_count in rows:
+            yield {"content": content, "token_count": token_count}
+    
     async def process_document(self, document: BrandDocument, db: Session) -> bool:
-        """Processa un documento: estrae testo, chunka, genera embeddings, analizza con AI"""
+        """
+        Processa un documento: estrae testo, chunka, genera embeddings, analizza con AI.
+        Chunk ed embedding vengono scritti nel DB a finestre, senza tenere in memoria
+        il testo completo o tutti gli embedding.
+        """
         try:
             document.extraction_status = "processing"
             db.commit()
             
-            text = self.extract_text(document.file_path, document.file_type)
+            stats: Dict[str, Any] = {}
+            chunks_count = 0
+            total_tokens = 0
+            async for window in self.iter_embedded_chunks(document.file_path, document.file_type, stats):
+                db.execute(insert(DocumentChunk), [
+                    {
+                        "document_id": document.id,
+                        "brand_id": document.brand_id,
+                        "chunk_index": chunk["index"],
+                        "content": chunk["content"],
+                        "token_count": chunk["token_count"],
+                        "page_number": chunk["page_number"],
+                        "embedding": embedding
+                    }
+                    for chunk, embedding in window
+                ])
+                db.commit()
+                chunks_count += len(window)
+                total_tokens += sum(chunk["token_count"] for chunk, _ in window)
             
-            if not text:
+            if not stats.get("chars"):
                 document.extraction_status = "failed"
                 db.commit()
                 return False
             
             document.extraction_status = "completed"
-            db.commit()
-            
-            # Analisi AI
+            document.chunks_count = chunks_count
+            document.total_tokens = total_tokens
+            document.embedding_bytes = chunks_count * EMBEDDING_DIMENSIONS * 4
+            document.ingested_at = datetime.now()
             document.analysis_status = "processing"
             db.commit()
-            await self.analyze_document(document, text, db)
-            
-            # Chunking
-            chunks = self.chunk_text(text)
-            if not chunks:
-                return True
             
-            # Embeddings in batch
-            chunk_texts = [c["content"] for c in chunks]
-            all_embeddings = []
-            for i in range(0, len(chunk_texts), 100):
-                batch = chunk_texts[i:i+100]
-                embeddings = self.generate_embeddings_batch(batch)
-                all_embeddings.extend(embeddings)
-            
-            # Salva chunks
-            for chunk, embedding in zip(chunks, all_embeddings):
-                db_chunk = DocumentChunk(
-                    document_id=document.id,
-                    brand_id=document.brand_id,
-                    chunk_index=chunk["index"],
-                    content=chunk["content"],
-                    token_count=chunk["token_count"],
-                    embedding=embedding
+            # Analisi AI: i documenti lunghi vengono riletti dal DB in streaming per il map-reduce
+            if stats["chars"] > 8000 and chunks_count:
+                await self.analyze_document(
+                    document, stats["head"], db,
+                    chunks=self.iter_stored_chunks(db, document.id),
+                    total_tokens=total_tokens
                 )
-                db.add(db_chunk)
-            
-            db.commit()
+            else:
+                await self.analyze_document(document, stats["head"], db)
             return True
             
         except Exception as e:
             print(f"Errore processing documento: {e}")
+            db.rollback()
+            # Niente chunk parziali: un documento fallito non deve finire nel contesto RAG
+            db.query(DocumentChunk).filter(DocumentChunk.document_id == document.id).delete()
             document.extraction_status = "failed"
             document.analysis_status = "failed"
             db.commit()
@@ -307,7 +548,7 @@ Rispondi SOLO in JSON:
     # === SEMANTIC SEARCH ===
     
     def search_similar(self, db: Session, brand_id: int, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        query_embedding = self.generate_embedding(query)
+        query_embedding = self.get_query_embedding(query)
         
         sql = text("""
             SELECT 
@@ -339,20 +580,329 @@ Rispondi SOLO in JSON:
             for row in result
         ]
     
-    def get_context_for_generation(self, db: Session, brand_id: int, topic: str, max_tokens: int = 2000) -> str:
-        chunks = self.search_similar(db, brand_id, topic, limit=10)
+    def search_lexical(self, db: Session, brand_id: int, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Ricerca full-text (tsvector + GIN): nessuna chiamata di embedding"""
+        sql = text(f"""
+            SELECT 
+                dc.id, dc.content, dc.chunk_index, dc.document_id,
+                bd.original_filename,
+                ts_rank_cd(dc.content_tsv, q.query, 32) as rank
+            FROM document_chunks dc
+            JOIN brand_documents bd ON dc.document_id = bd.id,
+                 websearch_to_tsquery('{FTS_CONFIG}', :query) AS q(query)
+            WHERE dc.brand_id = :brand_id AND dc.content_tsv @@ q.query
+            ORDER BY rank DESC
+            LIMIT :limit
+        """)
+        
+        result = db.execute(sql, {"brand_id": brand_id, "query": query, "limit": limit})
         
-        context_parts = []
+        return [
+            {
+                "id": row[0],
+                "content": row[1],
+                "chunk_index": row[2],
+                "document_id": row[3],
+                "filename": row[4],
+                # Rank full-text (ts_rank_cd normalizzato), non confrontabile con la similarità coseno
+                "similarity": None,
+                "score": float(row[5]),
+                "match": "lexical"
+            }
+            for row in result
+        ]
+    
+    def search_hybrid(self, db: Session, brand_id: int, query: str, limit: int = 5, candidates: int = 30, rrf_k: int = 60) -> List[Dict[str, Any]]:
+        """Fonde ranking vettoriale e full-text con Reciprocal Rank Fusion, in un solo statement"""
+        query_embedding = self.get_query_embedding(query)
+        
+        sql = text(f"""
+            WITH vector_hits AS (
+                SELECT dc.id,
+                       1 - (dc.embedding <=> cast(:embedding as vector)) as similarity,
+                       ROW_NUMBER() OVER (ORDER BY dc.embedding <=> cast(:embedding as vector)) as rank
+                FROM document_chunks dc
+                WHERE dc.brand_id = :brand_id AND dc.embedding IS NOT NULL
+                ORDER BY dc.embedding <=> cast(:embedding as vector)
+                LIMIT :candidates
+            ),
+            lexical_hits AS (
+                SELECT dc.id,
+                       ROW_NUMBER() OVER (ORDER BY ts_rank_cd(dc.content_tsv, q.query, 32) DESC) as rank
+                FROM document_chunks dc,
+                     websearch_to_tsquery('{FTS_CONFIG}', :query) AS q(query)
+                WHERE dc.brand_id = :brand_id AND dc.content_tsv @@ q.query
+                ORDER BY rank
+                LIMIT :candidates
+            ),
+            fused AS (
+                SELECT COALESCE(v.id, l.id) as id,
+                       v.similarity,
+                       v.rank as vector_rank,
+                       l.rank as lexical_rank,
+                       COALESCE(1.0 / (:rrf_k + v.rank), 0) + COALESCE(1.0 / (:rrf_k + l.rank), 0) as score
+                FROM vector_hits v
+                FULL OUTER JOIN lexical_hits l ON v.id = l.id
+            )
+            SELECT 
+                dc.id, dc.content, dc.chunk_index, dc.document_id,
+                bd.original_filename,
+                COALESCE(f.similarity, 1 - (dc.embedding <=> cast(:embedding as vector))) as similarity,
+                f.score, f.vector_rank, f.lexical_rank
+            FROM fused f
+            JOIN document_chunks dc ON dc.id = f.id
+            JOIN brand_documents bd ON dc.document_id = bd.id
+            ORDER BY f.score DESC
+            LIMIT :limit
+        """)
+        
+        result = db.execute(sql, {
+            "brand_id": brand_id,
+            "embedding": str(query_embedding),
+            "query": query,
+            "candidates": candidates,
+            "rrf_k": rrf_k,
+            "limit": limit
+        })
+        
+        results = []
+        for row in result:
+            if row[7] is not None and row[8] is not None:
+                match = "hybrid"
+            else:
+                match = "vector" if row[7] is not None else "lexical"
+            results.append({
+                "id": row[0],
+                "content": row[1],
+                "chunk_index": row[2],
+                "document_id": row[3],
+                "filename": row[4],
+                "similarity": float(row[5]) if row[5] is not None else 0.0,
+                "score": float(row[6]),
+                "match": match
+            })
+        return results
+    
+    def is_keyword_query(self, query: str) -> bool:
+        """Query brevi tipo parola chiave (niente domande/frasi): basta la ricerca full-text"""
+        words = query.split()
+        return 0 < len(words) <= 3 and "?" not in query
+    
+    def search(self, db: Session, brand_id: int, query: str, limit: int = 5, mode: str = "auto") -> List[Dict[str, Any]]:
+        """
+        Ricerca nei documenti del brand.
+        mode: "auto" (full-text per query a parole chiave, altrimenti ibrida), "lexical", "vector", "hybrid"
+        """
+        if mode == "lexical":
+            return self.search_lexical(db, brand_id, query, limit)
+        if mode == "vector":
+            return self.search_similar(db, brand_id, query, limit)
+        if mode == "auto" and self.is_keyword_query(query):
+            results = self.search_lexical(db, brand_id, query, limit)
+            if results:
+                return results
+        return self.search_hybrid(db, brand_id, query, limit)
+    
+    def get_knowledge_base_version(self, db: Session, brand_id: int) -> str:
+        """Versione della knowledge base del brand: cambia quando i chunk vengono aggiunti o rimossi"""
+        row = db.execute(text("""
+            SELECT COUNT(*), COALESCE(MAX(id), 0)
+            FROM document_chunks
+            WHERE brand_id = :brand_id
+        """), {"brand_id": brand_id}).first()
+        return f"{row[0]}:{row[1]}"
+    
+    def search_candidates(self, db: Session, brand_id: int, query_embedding: List[float], limit: int = 30) -> List[Dict[str, Any]]:
+        """Top-k chunk per similarità, con token_count ed embedding per il reranking MMR"""
+        sql = text("""
+            SELECT 
+                dc.id, dc.content, dc.document_id, dc.token_count,
+                bd.original_filename,
+                1 - (dc.embedding <=> cast(:embedding as vector)) as similarity,
+                dc.embedding::real[] as embedding
+            FROM document_chunks dc
+            JOIN brand_documents bd ON dc.document_id = bd.id
+            WHERE dc.brand_id = :brand_id AND dc.embedding IS NOT NULL
+            ORDER BY dc.embedding <=> cast(:embedding as vector)
+            LIMIT :limit
+        """)
+        
+        result = db.execute(sql, {
+            "brand_id": brand_id,
+            "embedding": str(query_embedding),
+            "limit": limit
+        })
+        
+        return [
+            {
+                "id": row[0],
+                "content": row[1],
+                "document_id": row[2],
+                "token_count": row[3],
+                "filename": row[4],
+                "similarity": float(row[5]),
+                "embedding": row[6]
+            }
+            for row in result
+        ]
+    
+    def search_candidates_multi(
+        self,
+        db: Session,
+        brand_id: int,
+        query_embeddings: List[List[float]],
+        limit: int = 20
+    ) -> List[List[Dict[str, Any]]]:
+        """Top-k per più query in un solo statement (UNNEST dei vettori + LATERAL join)"""
+        if not query_embeddings:
+            return []
+        
+        sql = text("""
+            SELECT
+                q.ord, c.id, c.content, c.document_id, c.token_count,
+                c.original_filename, c.similarity, c.embedding
+            FROM unnest(cast(:embeddings as text[])) WITH ORDINALITY AS q(embedding, ord)
+            CROSS JOIN LATERAL (
+                SELECT
+                    dc.id, dc.content, dc.document_id, dc.token_count,
+                    bd.original_filename,
+                    1 - (dc.embedding <=> cast(q.embedding as vector)) as similarity,
+                    dc.embedding::real[] as embedding
+                FROM document_chunks dc
+                JOIN brand_documents bd ON dc.document_id = bd.id
+                WHERE dc.brand_id = :brand_id AND dc.embedding IS NOT NULL
+                ORDER BY dc.embedding <=> cast(q.embedding as vector)
+                LIMIT :limit
+            ) c
+            ORDER BY q.ord, c.similarity DESC
+        """)
+        
+        result = db.execute(sql, {
+            "brand_id": brand_id,
+            "embeddings": [str(e) for e in query_embeddings],
+            "limit": limit
+        })
+        
+        candidates: List[List[Dict[str, Any]]] = [[] for _ in query_embeddings]
+        for row in result:
+            candidates[row[0] - 1].append({
+                "id": row[1],
+                "content": row[2],
+                "document_id": row[3],
+                "token_count": row[4],
+                "filename": row[5],
+                "similarity": float(row[6]),
+                "embedding": row[7]
+            })
+        return candidates
+    
+    def select_mmr(
+        self,
+        candidates: List[Dict[str, Any]],
+        max_tokens: int,
+        lambda_mult: float = 0.7,
+        max_per_document: int = 3
+    ) -> List[Dict[str, Any]]:
+        """
+        Seleziona i chunk con Maximal Marginal Relevance entro il budget di token.
+        Usa il token_count salvato in DB e limita i chunk per singolo documento.
+        """
+        if not candidates:
+            return []
+        
+        vectors = np.array([c["embedding"] for c in candidates], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        relevance = np.array([c["similarity"] for c in candidates], dtype=np.float32)
+        # Similarità massima di ogni candidato rispetto ai chunk già scelti
+        max_sim_selected = np.zeros(len(candidates), dtype=np.float32)
+        
+        available = np.ones(len(candidates), dtype=bool)
+        per_document: Dict[int, int] = {}
+        selected = []
         total_tokens = 0
         
-        for chunk in chunks:
-            chunk_tokens = self.count_tokens(chunk["content"])
+        while available.any():
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim_selected
+            scores[~available] = -np.inf
+            idx = int(np.argmax(scores))
+            available[idx] = False
+            
+            chunk = candidates[idx]
+            chunk_tokens = chunk["token_count"] or self.count_tokens(chunk["content"])
             if total_tokens + chunk_tokens > max_tokens:
-                break
-            context_parts.append(f"[Da: {chunk['filename']}]\n{chunk['content']}")
+                continue
+            if per_document.get(chunk["document_id"], 0) >= max_per_document:
+                continue
+            
+            selected.append(chunk)
             total_tokens += chunk_tokens
+            per_document[chunk["document_id"]] = per_document.get(chunk["document_id"], 0) + 1
+            max_sim_selected = np.maximum(max_sim_selected, vectors @ vectors[idx])
+        
+        return selected
+    
+    def format_context(self, chunks: List[Dict[str, Any]]) -> str:
+        return "\n\n---\n\n".join(
+            f"[Da: {chunk['filename']}]\n{chunk['content']}" for chunk in chunks
+        )
+    
+    def get_context_for_generation(self, db: Session, brand_id: int, topic: str, max_tokens: int = 2000) -> str:
+        """
+        Assembla il contesto RAG per la generazione.
+        Il risultato è memoizzato per (brand, hash query, versione KB, budget):
+        generazioni ripetute per lo stesso brand non rifanno embedding né ricerca.
+        """
+        kb_version = self.get_knowledge_base_version(db, brand_id)
+        if kb_version.startswith("0:"):
+            return ""
+        
+        query_hash = hashlib.sha256(topic.encode("utf-8")).hexdigest()
+        cache_key = (brand_id, query_hash, kb_version, max_tokens)
+        context = self.context_cache.get(cache_key)
+        if context is not None:
+            return context
+        
+        query_embedding = self.get_query_embedding(topic)
+        candidates = self.search_candidates(db, brand_id, query_embedding, limit=30)
+        context = self.format_context(self.select_mmr(candidates, max_tokens))
+        
+        self.context_cache.set(cache_key, context)
+        return context
+    
+    def get_contexts_for_queries(self, db: Session, brand_id: int, queries: List[str], max_tokens: int = 1500) -> List[str]:
+        """
+        Come get_context_for_generation ma per più query (es. una per batch/settimana).
+        Le query non memoizzate vengono embeddate in una sola chiamata e cercate in un solo statement SQL.
+        """
+        if not queries:
+            return []
+        
+        kb_version = self.get_knowledge_base_version(db, brand_id)
+        if kb_version.startswith("0:"):
+            return ["" for _ in queries]
+        
+        cache_keys = [
+            (brand_id, hashlib.sha256(q.encode("utf-8")).hexdigest(), kb_version, max_tokens)
+            for q in queries
+        ]
+        contexts = [self.context_cache.get(k) for k in cache_keys]
+        
+        missing = [i for i, c in enumerate(contexts) if c is None]
+        if missing:
+            # Query duplicate (stessi pillar/date) vengono cercate una volta sola
+            unique_queries = list(dict.fromkeys(queries[i] for i in missing))
+            embeddings = self.get_query_embeddings(unique_queries)
+            candidates = self.search_candidates_multi(db, brand_id, embeddings, limit=20)
+            by_query = {
+                q: self.format_context(self.select_mmr(c, max_tokens))
+                for q, c in zip(unique_queries, candidates)
+            }
+            for i in missing:
+                contexts[i] = by_query[queries[i]]
+                self.context_cache.set(cache_keys[i], contexts[i])
         
-        return "\n\n---\n\n".join(context_parts)
+        return contexts
 
 
 # Singleton
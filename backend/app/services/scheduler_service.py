@@ -1,111 +1,723 @@
+"""
+Scheduler delle pubblicazioni: l'unità di lavoro è la PostPublication (post x connessione).
+
+Ogni tick:
+- materializza le pubblicazioni dei post in scadenza da calendario (posts.scheduled_at) che
+  non ne hanno ancora una, sulla connessione della piattaforma del post, con l'anticipo dello
+  staging; se la data del post cambia, la pubblicazione la segue;
+- reclama le pubblicazioni "scheduled" scadute con FOR UPDATE SKIP LOCKED assegnando un lease,
+  quindi più scheduler possono girare insieme senza pubblicare due volte; un lease scaduto
+  (worker morto a metà pubblicazione) rende la pubblicazione di nuovo reclamabile;
+- marca "missed" ciò che è scaduto da più della finestra di catch-up;
+- fa lo staging delle pubblicazioni che scadono entro l'anticipo configurato: valida la
+  connessione, carica i media e crea i container, così all'orario resta una sola chiamata.
+
+Gli errori transitori (rete, 5xx, rate limit) non bloccano il tick: la pubblicazione passa a
+"retrying" con next_retry_at (backoff esponenziale con jitter) e viene reclamata di nuovo dalla
+stessa coda quando scade; errori definitivi vanno a "failed", i retry esauriti a "dead_letter".
+
+Le pubblicazioni reclamate (anche più piattaforme dello stesso post) partono in parallelo, con
+un limite di concorrenza per piattaforma; ognuna passa scheduled -> publishing -> published/failed
+e lo stato del post viene ricalcolato come riepilogo delle sue pubblicazioni.
+"""
 import asyncio
 import logging
-from datetime import datetime, date, timezone
+import os
+import signal
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from app.core.database import SessionLocal
+from sqlalchemy import text
+import httpx
+from app.core.config import settings
+from app.core.database import SessionLocal, run_with_session
 from app.models.post import Post
 from app.models.social_connection import SocialConnection, PostPublication
-from app.models.project import Project
-from app.models.brand import Brand
 from app.services.publisher_service import publisher_service
+from app.services.publish_retry import classify_failure, next_retry_delay
+from app.services.token_refresher import build_token_refresher
 
 logger = logging.getLogger(__name__)
 
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Chiave dell'advisory lock che serializza la materializzazione tra più scheduler
+MATERIALIZE_LOCK_KEY = 727401
+
+
+# === CODA ===
+
+def materialize_due_posts(db: Session, catch_up_minutes: int, lead_seconds: int = 0) -> int:
+    """
+    Post in scadenza da calendario (entro lead_seconds) senza pubblicazioni attive: crea la
+    PostPublication sulla connessione attiva della piattaforma del post. Le pubblicazioni create
+    così seguono gli spostamenti della data del post finché restano "scheduled".
+    I post scaduti senza connessione falliscono.
+    """
+    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MATERIALIZE_LOCK_KEY})
+
+    # Data del post cambiata dopo la materializzazione: lo staging va rifatto
+    db.execute(text("""
+        UPDATE post_publications pp
+        SET scheduled_for = p.scheduled_at, staged_media = NULL, staged_at = NULL,
+            staging_error = NULL, lease_owner = NULL, lease_until = NULL, updated_at = now()
+        FROM posts p
+        WHERE p.id = pp.post_id AND pp.from_calendar AND pp.status = 'scheduled'
+          AND p.scheduled_at IS NOT NULL AND pp.scheduled_for <> p.scheduled_at
+    """))
+    db.execute(text("""
+        DELETE FROM post_publications pp
+        USING posts p
+        WHERE p.id = pp.post_id AND pp.from_calendar AND pp.status = 'scheduled'
+          AND p.scheduled_at IS NULL
+    """))
+
+    due = """
+        p.scheduled_at <= now() + make_interval(secs => :lead_seconds)
+        AND p.scheduled_at >= now() - make_interval(mins => :catch_up_minutes)
+        AND p.publication_status IN ('scheduled', 'pending', 'draft')
+        AND NOT EXISTS (
+            SELECT 1 FROM post_publications pp
+            WHERE pp.post_id = p.id AND pp.status IN ('pending', 'scheduled', 'publishing', 'retrying')
+        )
+    """
+    created = db.execute(text(f"""
+        INSERT INTO post_publications (post_id, social_connection_id, status, scheduled_for, from_calendar, retry_count, created_at, updated_at)
+        SELECT p.id, c.id, 'scheduled', p.scheduled_at, true, 0, now(), now()
+        FROM posts p
+        JOIN projects pr ON pr.id = p.project_id
+        JOIN LATERAL (
+            SELECT id FROM social_connections c
+            WHERE c.brand_id = pr.brand_id AND c.platform = p.platform AND c.is_active
+            ORDER BY c.id
+            LIMIT 1
+        ) c ON true
+        WHERE {due}
+        RETURNING post_id
+    """), {"catch_up_minutes": catch_up_minutes, "lead_seconds": lead_seconds}).scalars().all()
+
+    no_connection = db.execute(text(f"""
+        UPDATE posts p SET publication_status = 'failed'
+        FROM projects pr
+        WHERE pr.id = p.project_id
+          AND p.publication_status IN ('scheduled', 'pending')
+          AND {due}
+          AND NOT EXISTS (
+              SELECT 1 FROM social_connections c
+              WHERE c.brand_id = pr.brand_id AND c.platform = p.platform AND c.is_active
+          )
+        RETURNING p.id, p.platform
+    """), {"catch_up_minutes": catch_up_minutes, "lead_seconds": 0}).all()
+    db.commit()
+
+    for post_id, platform in no_connection:
+        logger.warning(f"No active connection for {platform}: post {post_id} failed")
+    return len(created)
+
+
+def claim_due_publications(db: Session, limit: int, lease_seconds: int, catch_up_minutes: int) -> List[Tuple[int, str]]:
+    """
+    Reclama fino a limit pubblicazioni scadute (scheduled nella finestra di catch-up, retrying
+    con next_retry_at passato, o publishing con lease scaduto): le porta a "publishing" con
+    lease insieme ai loro post e fa commit subito, così gli altri scheduler le saltano.
+    Restituisce (id, piattaforma).
+    """
+    rows = db.execute(text("""
+        WITH claimed AS (
+            UPDATE post_publications pp
+            SET status = 'publishing',
+                lease_owner = :owner,
+                lease_until = now() + make_interval(secs => :lease_seconds),
+                updated_at = now()
+            WHERE pp.id IN (
+                SELECT id FROM post_publications
+                WHERE (
+                    status = 'scheduled'
+                    AND scheduled_for <= now()
+                    AND scheduled_for >= now() - make_interval(mins => :catch_up_minutes)
+                ) OR (
+                    status = 'retrying' AND next_retry_at <= now()
+                ) OR (
+                    status = 'publishing' AND lease_until < now()
+                )
+                ORDER BY scheduled_for
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING pp.id, pp.post_id, pp.social_connection_id, pp.scheduled_for
+        ), claimed_posts AS (
+            UPDATE posts SET publication_status = 'publishing'
+            WHERE id IN (SELECT post_id FROM claimed) AND publication_status <> 'publishing'
+        )
+        SELECT claimed.id, c.platform
+        FROM claimed JOIN social_connections c ON c.id = claimed.social_connection_id
+        ORDER BY claimed.scheduled_for, claimed.id
+    """), {
+        "owner": WORKER_ID,
+        "lease_seconds": lease_seconds,
+        "catch_up_minutes": catch_up_minutes,
+        "limit": limit
+    }).all()
+    db.commit()
+    return [(publication_id, platform) for publication_id, platform in rows]
+
+
+def claim_stageable_publications(db: Session, limit: int, lead_seconds: int, retry_seconds: int, lease_seconds: int) -> List[Tuple[int, str]]:
+    """
+    Reclama fino a limit pubblicazioni "scheduled" non ancora preparate che scadono entro
+    lead_seconds (un tentativo fallito si ripete dopo retry_seconds). Il lease evita che due
+    scheduler facciano lo staging della stessa pubblicazione. Restituisce (id, piattaforma).
+    """
+    rows = db.execute(text("""
+        WITH claimed AS (
+            UPDATE post_publications pp
+            SET staged_at = now(),
+                lease_owner = :owner,
+                lease_until = now() + make_interval(secs => :lease_seconds)
+            WHERE pp.id IN (
+                SELECT id FROM post_publications
+                WHERE status = 'scheduled'
+                  AND staged_media IS NULL
+                  AND scheduled_for > now()
+                  AND scheduled_for <= now() + make_interval(secs => :lead_seconds)
+                  AND (staged_at IS NULL OR staged_at < now() - make_interval(secs => :retry_seconds))
+                  AND (lease_until IS NULL OR lease_until < now())
+                ORDER BY scheduled_for
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING pp.id, pp.social_connection_id, pp.scheduled_for
+        )
+        SELECT claimed.id, c.platform
+        FROM claimed JOIN social_connections c ON c.id = claimed.social_connection_id
+        ORDER BY claimed.scheduled_for, claimed.id
+    """), {
+        "owner": WORKER_ID,
+        "lead_seconds": lead_seconds,
+        "retry_seconds": retry_seconds,
+        "lease_seconds": lease_seconds,
+        "limit": limit
+    }).all()
+    db.commit()
+    return [(publication_id, platform) for publication_id, platform in rows]
+
+
+def mark_missed(db: Session, catch_up_minutes: int) -> int:
+    """
+    Pubblicazioni e post programmati scaduti da più della finestra di catch-up: non vengono
+    più pubblicati in automatico. Le bozze senza pubblicazioni restano bozze.
+    """
+    post_ids = db.execute(text("""
+        UPDATE post_publications
+        SET status = 'missed', lease_owner = NULL, lease_until = NULL, updated_at = now()
+        WHERE (
+            status IN ('scheduled', 'pending')
+            AND scheduled_for < now() - make_interval(mins => :catch_up_minutes)
+        ) OR (
+            -- primo tentativo rimasto a metà; i retry restano reclamabili
+            status = 'publishing'
+            AND lease_until < now()
+            AND COALESCE(retry_count, 0) = 0
+            AND scheduled_for < now() - make_interval(mins => :catch_up_minutes)
+        )
+        RETURNING post_id
+    """), {"catch_up_minutes": catch_up_minutes}).scalars().all()
+
+    missed_posts = db.execute(text("""
+        UPDATE posts p SET publication_status = 'missed'
+        WHERE p.scheduled_at < now() - make_interval(mins => :catch_up_minutes)
+          AND p.publication_status IN ('scheduled', 'pending')
+          AND NOT EXISTS (SELECT 1 FROM post_publications pp WHERE pp.post_id = p.id)
+    """), {"catch_up_minutes": catch_up_minutes}).rowcount
+
+    for post_id in set(post_ids):
+        refresh_post_status(db, post_id)
+    db.commit()
+    return len(post_ids) + missed_posts
+
+
+def refresh_post_status(db: Session, post_id: int):
+    """Ricalcola posts.publication_status come riepilogo delle sue pubblicazioni (senza commit)"""
+    # Il lock sul post serializza le pubblicazioni parallele dello stesso post che terminano insieme
+    db.execute(text("SELECT id FROM posts WHERE id = :post_id FOR UPDATE"), {"post_id": post_id})
+    db.execute(text("""
+        UPDATE posts p SET publication_status = CASE
+            WHEN s.publishing > 0 THEN 'publishing'
+            WHEN s.waiting > 0 THEN 'scheduled'
+            WHEN s.published = s.total THEN 'published'
+            WHEN s.published > 0 THEN 'partial'
+            WHEN s.missed = s.total THEN 'missed'
+            ELSE 'failed'
+        END
+        FROM (
+            SELECT
+                count(*) AS total,
+                count(*) FILTER (WHERE status = 'publishing') AS publishing,
+                count(*) FILTER (WHERE status IN ('pending', 'scheduled', 'retrying')) AS waiting,
+                count(*) FILTER (WHERE status = 'published') AS published,
+                count(*) FILTER (WHERE status = 'missed') AS missed
+            FROM post_publications WHERE post_id = :post_id
+        ) s
+        WHERE p.id = :post_id AND s.total > 0
+    """), {"post_id": post_id})
+
+
+def seconds_until_next_due(db: Session) -> Optional[float]:
+    next_due = db.execute(text("""
+        SELECT least(
+            (SELECT min(scheduled_for) FROM post_publications
+             WHERE status = 'scheduled' AND scheduled_for > now()),
+            (SELECT min(next_retry_at) FROM post_publications
+             WHERE status = 'retrying' AND next_retry_at > now()),
+            (SELECT min(scheduled_at) FROM posts
+             WHERE scheduled_at > now() AND publication_status IN ('scheduled', 'pending', 'draft'))
+        )
+    """)).scalar()
+    if next_due is None:
+        return None
+    return max(0.0, (next_due - datetime.now(timezone.utc)).total_seconds())
+
+
+# === LEASE ===
+
+def renew_lease(db: Session, publication_id: int, until: datetime, lease_seconds: int) -> Optional[datetime]:
+    """Proroga il lease se è ancora nostro e invariato; None se è stato perso (reclamato o rimosso)"""
+    renewed = db.execute(text("""
+        UPDATE post_publications
+        SET lease_until = now() + make_interval(secs => :lease_seconds)
+        WHERE id = :id AND lease_owner = :owner AND lease_until = :until
+        RETURNING lease_until
+    """), {"id": publication_id, "owner": WORKER_ID, "until": until, "lease_seconds": lease_seconds}).scalar()
+    db.commit()
+    return renewed
+
+
+class LeaseHeartbeat:
+    """
+    Rinnova il lease di una pubblicazione ogni terzo della sua durata finché il lavoro è in corso
+    (upload video, attesa del processing Instagram): senza rinnovo un altro giro la reclamerebbe
+    e la pubblicherebbe due volte. until è l'ultima scadenza scritta, da usare come condizione
+    nella scrittura dell'esito.
+    """
+
+    def __init__(self, publication_id: int, until: Optional[datetime], lease_seconds: int):
+        self.publication_id = publication_id
+        self.until = until
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _beat(self):
+        while not self.lost:
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.lease_seconds / 3)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                until = await run_with_session(renew_lease, self.publication_id, self.until, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Lease renewal failed for publication {self.publication_id}: {e}")
+                continue
+            if until is None:
+                self.lost = True
+                logger.warning(f"Publication {self.publication_id}: lease lost while in progress")
+            else:
+                self.until = until
+
+    async def __aenter__(self) -> "LeaseHeartbeat":
+        self._task = asyncio.create_task(self._beat())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Niente cancel: un rinnovo già partito deve finire, altrimenti until resterebbe indietro
+        self._stop.set()
+        await self._task
+
+
+def lock_leased_publication(db: Session, publication_id: int, status: str, lease_until: Optional[datetime]) -> Optional[PostPublication]:
+    """Pubblicazione bloccata per scriverne l'esito, solo se il lease è ancora quello di questo worker"""
+    return db.query(PostPublication).filter(
+        PostPublication.id == publication_id,
+        PostPublication.status == status,
+        PostPublication.lease_owner == WORKER_ID,
+        PostPublication.lease_until == lease_until
+    ).with_for_update().populate_existing().first()
+
+
+# === PUBBLICAZIONE ===
+
+async def publish_publication(
+    db: Session,
+    publication: PostPublication,
+    max_retries: int = 5,
+    retry_base_seconds: float = 30,
+    retry_max_seconds: float = 3600,
+    lease_seconds: int = 600
+):
+    """
+    Pubblica il post sulla connessione della pubblicazione e ne registra l'esito (senza commit).
+    Il lease viene rinnovato durante la pubblicazione; se nel frattempo è stato perso l'esito
+    viene scartato.
+    """
+    post = db.query(Post).filter(Post.id == publication.post_id).first()
+    connection = db.query(SocialConnection).filter(SocialConnection.id == publication.social_connection_id).first()
+    platform = connection.platform if connection else None
+    publication_id = publication.id
+    lease_until = publication.lease_until
+
+    if not connection or not connection.is_active:
+        result = {"success": False, "error": "Connessione social non attiva"}
+    elif connection.needs_reauth:
+        # Il refresher non è riuscito a rinnovare il token: inutile chiamare la piattaforma
+        result = {"success": False, "error": f"Token non rinnovabile, ricollega l'account ({connection.refresh_error})"}
+    elif connection.token_expires_at and connection.token_expires_at <= datetime.now(timezone.utc):
+        result = {
+            "success": False,
+            "error": "Token scaduto, in attesa del rinnovo",
+            "token_refresh_pending": True,
+            "retry_after": settings.TOKEN_REFRESH_POLL_SECONDS
+        }
+    else:
+        logger.info(f"Publishing post {post.id} to {platform} (publication {publication.id})")
+        async with LeaseHeartbeat(publication_id, lease_until, lease_seconds) as lease:
+            try:
+                result = await publisher_service.publish_post(post, connection, publication.staged_media)
+            except httpx.TransportError as e:
+                result = {"success": False, "error": f"Errore di rete: {e!r}", "network_error": True}
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+        lease_until = lease.until
+        connection.last_used_at = datetime.now(timezone.utc)
+
+    publication = lock_leased_publication(db, publication_id, "publishing", lease_until)
+    if not publication:
+        logger.warning(f"Publication {publication_id} lease lost during publishing: result discarded")
+        return
+
+    publication.lease_owner = None
+    publication.lease_until = None
+
+    if result["success"]:
+        publication.status = "published"
+        publication.published_at = datetime.now(timezone.utc)
+        publication.external_post_id = result.get("external_post_id")
+        publication.external_post_url = result.get("external_post_url")
+        publication.error_message = None
+        publication.next_retry_at = None
+        logger.info(f"Post {post.id} published on {platform}: {result.get('external_post_url')}")
+        return
+
+    publication.error_message = result.get("error", "Unknown error")
+    retryable, retry_after = classify_failure(platform, result)
+    attempt = (publication.retry_count or 0) + 1
+
+    if not retryable:
+        publication.status = "failed"
+        publication.next_retry_at = None
+        logger.error(f"Post {post.id} publication {publication.id} failed: {publication.error_message}")
+    elif attempt > max_retries:
+        publication.status = "dead_letter"
+        publication.next_retry_at = None
+        logger.error(
+            f"Post {post.id} publication {publication.id} dead-lettered after {max_retries} retries: "
+            f"{publication.error_message}"
+        )
+    else:
+        delay = next_retry_delay(attempt, retry_base_seconds, retry_max_seconds, retry_after)
+        publication.status = "retrying"
+        publication.retry_count = attempt
+        publication.last_retry_at = datetime.now(timezone.utc)
+        publication.next_retry_at = publication.last_retry_at + timedelta(seconds=delay)
+        logger.warning(
+            f"Post {post.id} publication {publication.id} transient failure "
+            f"(HTTP {result.get('status_code')}), retry {attempt}/{max_retries} in {delay:.0f}s"
+        )
+
+
+async def stage_publication(db: Session, publication: PostPublication, lease_seconds: int = 600):
+    """
+    Staging di una pubblicazione reclamata: salva gli id dei media preparati, o l'errore (che
+    così emerge prima dell'orario). Se nel frattempo la pubblicazione è partita o il lease è
+    stato perso non scrive nulla.
+    """
+    post = db.query(Post).filter(Post.id == publication.post_id).first()
+    connection = db.query(SocialConnection).filter(SocialConnection.id == publication.social_connection_id).first()
+    publication_id = publication.id
+    lease_until = publication.lease_until
+
+    if not post or not connection or not connection.is_active:
+        result = {"success": False, "error": "Connessione social non attiva"}
+    else:
+        async with LeaseHeartbeat(publication_id, lease_until, lease_seconds) as lease:
+            try:
+                result = await publisher_service.stage_post(post, connection)
+            except httpx.TransportError as e:
+                result = {"success": False, "error": f"Errore di rete: {e!r}"}
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+        lease_until = lease.until
+
+    publication = lock_leased_publication(db, publication_id, "scheduled", lease_until)
+    if not publication:
+        logger.info(f"Publication {publication_id} left the queue during staging: result discarded")
+        return
+
+    publication.lease_owner = None
+    publication.lease_until = None
+    if result["success"]:
+        publication.staged_media = result["staged"]
+        publication.staging_error = None
+        logger.info(f"Publication {publication_id} staged: {sorted(result['staged'])}")
+    else:
+        publication.staging_error = result.get("error", "Unknown error")
+        logger.warning(f"Publication {publication_id} staging failed: {publication.staging_error}")
+
+
+class PublicationScheduler:
+    def __init__(
+        self,
+        poll_seconds: int = 15,
+        catch_up_minutes: int = 30,
+        lease_seconds: int = 600,
+        max_in_flight: int = 20,
+        platform_limits: Optional[Dict[str, int]] = None,
+        max_retries: int = 5,
+        retry_base_seconds: float = 30,
+        retry_max_seconds: float = 3600,
+        staging_lead_seconds: int = 0,
+        staging_retry_seconds: int = 120
+    ):
+        self.poll_seconds = poll_seconds
+        self.catch_up_minutes = catch_up_minutes
+        self.lease_seconds = lease_seconds
+        self.max_in_flight = max_in_flight
+        self.platform_limits = platform_limits or {}
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.staging_lead_seconds = staging_lead_seconds
+        self.staging_retry_seconds = staging_retry_seconds
+        self._platform_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Set[asyncio.Task] = set()
+        self._stop: Optional[asyncio.Event] = None
+        # Svegliato quando una coda satura libera abbastanza slot (o allo stop)
+        self._wake: Optional[asyncio.Event] = None
+        self._saturated = False
+
+    def _platform_semaphore(self, platform: str) -> asyncio.Semaphore:
+        if platform not in self._platform_semaphores:
+            self._platform_semaphores[platform] = asyncio.Semaphore(self.platform_limits.get(platform, 4))
+        return self._platform_semaphores[platform]
+
+    # === TICK ===
+
+    async def tick(self) -> int:
+        """Reclama le pubblicazioni scadute e le avvia in background; restituisce quante ne ha reclamate"""
+        capacity = self.max_in_flight - len(self._in_flight)
+        if capacity <= 0:
+            return 0
+
+        db = SessionLocal()
+        try:
+            missed = mark_missed(db, self.catch_up_minutes)
+            if missed:
+                logger.warning(f"Scheduler: {missed} publications missed the catch-up window")
+            materialize_due_posts(db, self.catch_up_minutes, self.staging_lead_seconds)
+            claimed = claim_due_publications(db, capacity, self.lease_seconds, self.catch_up_minutes)
+            # Lo staging usa solo la capacità lasciata libera dalle pubblicazioni in scadenza
+            staging = []
+            if self.staging_lead_seconds and capacity > len(claimed):
+                staging = claim_stageable_publications(
+                    db,
+                    capacity - len(claimed),
+                    self.staging_lead_seconds,
+                    self.staging_retry_seconds,
+                    self.lease_seconds
+                )
+        except Exception as e:
+            logger.error(f"Scheduler error: {e}")
+            db.rollback()
+            return 0
+        finally:
+            db.close()
+
+        if claimed:
+            logger.info(f"Scheduler: claimed {len(claimed)} publications")
+        for publication_id, platform in claimed:
+            self._start(self.publish_claimed(publication_id, platform))
+        for publication_id, platform in staging:
+            self._start(self.stage_claimed(publication_id, platform))
+        return len(claimed)
+
+    def _start(self, coro):
+        task = asyncio.create_task(coro)
+        self._in_flight.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        # Arretrato già scaduto: si reclama il prossimo lotto appena c'è un quarto di capacità libera,
+        # senza aspettare il poll (seconds_until_next_due vede solo le scadenze future)
+        free = self.max_in_flight - len(self._in_flight)
+        if self._saturated and self._wake is not None and free >= max(1, self.max_in_flight // 4):
+            self._wake.set()
+
+    async def stage_claimed(self, publication_id: int, platform: str):
+        async with self._platform_semaphore(platform):
+            db = SessionLocal()
+            try:
+                publication = db.query(PostPublication).filter(
+                    PostPublication.id == publication_id,
+                    PostPublication.status == "scheduled",
+                    PostPublication.lease_owner == WORKER_ID
+                ).first()
+                if publication:
+                    await stage_publication(db, publication, lease_seconds=self.lease_seconds)
+                    db.commit()
+            except Exception as e:
+                logger.error(f"Scheduler: staging error on publication {publication_id}: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    async def publish_claimed(self, publication_id: int, platform: str):
+        """
+        Pubblica una pubblicazione reclamata nel limite della sua piattaforma. La sessione si
+        apre solo dopo aver ottenuto lo slot: i task in attesa non occupano connessioni del pool.
+        """
+        async with self._platform_semaphore(platform):
+            db = SessionLocal()
+            try:
+                publication = db.query(PostPublication).filter(
+                    PostPublication.id == publication_id,
+                    PostPublication.status == "publishing",
+                    PostPublication.lease_owner == WORKER_ID
+                ).first()
+                if not publication:
+                    return
+
+                await publish_publication(
+                    db,
+                    publication,
+                    max_retries=self.max_retries,
+                    retry_base_seconds=self.retry_base_seconds,
+                    retry_max_seconds=self.retry_max_seconds,
+                    lease_seconds=self.lease_seconds
+                )
+                db.commit()
+                refresh_post_status(db, publication.post_id)
+                db.commit()
+            except Exception as e:
+                logger.error(f"Scheduler: error on publication {publication_id}: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    async def next_sleep(self) -> float:
+        """Dorme fino alla prossima scadenza, al più poll_seconds"""
+        db = SessionLocal()
+        try:
+            wait = seconds_until_next_due(db)
+        except Exception:
+            wait = None
+        finally:
+            db.close()
+        return self.poll_seconds if wait is None else min(self.poll_seconds, max(wait, 0.5))
+
+    def stop(self):
+        """Chiede l'uscita dal loop: le pubblicazioni in corso vengono completate"""
+        if self._stop is not None:
+            self._stop.set()
+            self._wake.set()
+
+    async def run(self):
+        logger.info(f"Scheduler started ({WORKER_ID})")
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+        try:
+            while not self._stop.is_set():
+                claimed = await self.tick()
+                # Coda piena: reclama subito il prossimo lotto se c'è capacità
+                if claimed and len(self._in_flight) < self.max_in_flight:
+                    continue
+                self._saturated = len(self._in_flight) >= self.max_in_flight
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=await self.next_sleep())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+            logger.info(f"Scheduler stopped ({WORKER_ID})")
+
+
+def max_in_flight_for_pool() -> int:
+    """
+    Le pubblicazioni in corso tengono una sessione sincrona ciascuna: oltre la capacità del pool
+    (meno tick e refresher dei token) il checkout bloccherebbe l'event loop fino al timeout
+    """
+    capacity = settings.DATABASE_POOL_SIZE + settings.DATABASE_MAX_OVERFLOW
+    available = max(1, capacity - settings.TOKEN_REFRESH_CONCURRENCY - 2)
+    if settings.SCHEDULER_MAX_IN_FLIGHT > available:
+        logger.warning(
+            f"SCHEDULER_MAX_IN_FLIGHT={settings.SCHEDULER_MAX_IN_FLIGHT} exceeds the DB pool "
+            f"({capacity} connections): limited to {available}"
+        )
+    return min(settings.SCHEDULER_MAX_IN_FLIGHT, available)
+
+
+def build_scheduler() -> PublicationScheduler:
+    return PublicationScheduler(
+        poll_seconds=settings.SCHEDULER_POLL_SECONDS,
+        catch_up_minutes=settings.SCHEDULER_CATCH_UP_MINUTES,
+        lease_seconds=settings.SCHEDULER_LEASE_SECONDS,
+        max_in_flight=max_in_flight_for_pool(),
+        platform_limits=settings.scheduler_platform_limits,
+        max_retries=settings.PUBLISH_MAX_RETRIES,
+        retry_base_seconds=settings.PUBLISH_RETRY_BASE_SECONDS,
+        retry_max_seconds=settings.PUBLISH_RETRY_MAX_SECONDS,
+        staging_lead_seconds=settings.PUBLISH_STAGING_LEAD_MINUTES * 60,
+        staging_retry_seconds=settings.PUBLISH_STAGING_RETRY_SECONDS
+    )
+
+
 async def check_and_publish_posts():
-    """Controlla e pubblica i post programmati per ora"""
-    db = SessionLocal()
+    """Un singolo giro dello scheduler: reclama le pubblicazioni scadute e attende che terminino"""
+    scheduler = build_scheduler()
     try:
-        now = datetime.now()
-        current_date = now.date()
-        current_time = now.strftime("%H:%M")
-        
-        logger.info(f"Scheduler check: {current_date} {current_time}")
-        
-        # Trova post da pubblicare
-        posts = db.query(Post).filter(
-            Post.scheduled_date == current_date,
-            Post.scheduled_time.like(current_time + '%'),
-            Post.publication_status.in_(["scheduled", "pending", "draft"])
-        ).all()
-        
-        logger.info(f"Found {len(posts)} posts to publish")
-        
-        for post in posts:
-            await publish_single_post(db, post)
-        
-        db.commit()
-        
-    except Exception as e:
-        logger.error(f"Scheduler error: {e}")
-        db.rollback()
+        await scheduler.tick()
+        if scheduler._in_flight:
+            await asyncio.gather(*scheduler._in_flight, return_exceptions=True)
     finally:
-        db.close()
+        await publisher_service.aclose()
 
-async def publish_single_post(db: Session, post: Post):
-    """Pubblica un singolo post su tutte le piattaforme configurate"""
-    try:
-        # Trova il brand tramite il project
-        project = db.query(Project).filter(Project.id == post.project_id).first()
-        if not project:
-            logger.error(f"Project not found for post {post.id}")
-            return
-        
-        # Trova connessione social per la piattaforma del post
-        connection = db.query(SocialConnection).filter(
-            SocialConnection.brand_id == project.brand_id,
-            SocialConnection.platform == post.platform,
-            SocialConnection.is_active == True
-        ).first()
-        
-        if not connection:
-            logger.warning(f"No active connection for {post.platform} on brand {project.brand_id}")
-            post.publication_status = "failed"
-            return
-        
-        # Pubblica
-        logger.info(f"Publishing post {post.id} to {post.platform}")
-        result = await publisher_service.publish_post(post, connection)
-        
-        # Aggiorna stato
-        if result["success"]:
-            post.publication_status = "published"
-            
-            # Crea record pubblicazione
-            publication = PostPublication(
-                post_id=post.id,
-                social_connection_id=connection.id,
-                status="published",
-                published_at=datetime.now(timezone.utc).replace(tzinfo=None),
-                external_post_id=result.get("external_post_id"),
-                external_post_url=result.get("external_post_url")
-            )
-            db.merge(publication)
-            logger.info(f"Post {post.id} published successfully: {result.get('external_post_url')}")
-        else:
-            post.publication_status = "failed"
-            
-            publication = PostPublication(
-                post_id=post.id,
-                social_connection_id=connection.id,
-                status="failed",
-                error_message=result.get("error", "Unknown error")
-            )
-            db.merge(publication)
-            logger.error(f"Post {post.id} failed: {result.get('error')}")
-        
-        connection.last_used_at = datetime.now(timezone.utc).replace(tzinfo=None)
-        
-    except Exception as e:
-        logger.error(f"Error publishing post {post.id}: {e}")
-        post.publication_status = "failed"
 
 async def run_scheduler():
-    """Loop principale dello scheduler"""
-    logger.info("Scheduler started")
-    while True:
-        await check_and_publish_posts()
-        await asyncio.sleep(60)  # Controlla ogni minuto
+    """
+    Loop principale dello scheduler, con accanto il refresher dei token OAuth;
+    SIGTERM/SIGINT li fermano entrambi dopo le pubblicazioni in corso
+    """
+    scheduler = build_scheduler()
+    refresher = build_token_refresher()
+
+    def stop():
+        scheduler.stop()
+        refresher.stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # es. Windows o thread non principale
+    try:
+        await asyncio.gather(scheduler.run(), refresher.run())
+    finally:
+        await publisher_service.aclose()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
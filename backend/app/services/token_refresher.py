@@ -0,0 +1,290 @@
+"""
+Refresh proattivo dei token OAuth delle connessioni social.
+
+Il refresher gira accanto allo scheduler: reclama a lotti le connessioni attive il cui token
+scade entro l'anticipo della piattaforma (indice su token_expires_at, FOR UPDATE SKIP LOCKED)
+e le rinnova in parallelo prima della scadenza, così la pubblicazione non deve mai fare un
+refresh. Le connessioni che non si possono rinnovare (refresh token assente, revocato o
+scaduto) vengono marcate needs_reauth; gli errori transitori si ritentano più tardi.
+
+- LinkedIn: grant refresh_token (solo app con refresh programmatico, altrimenti ricollegare)
+- Google Business: grant refresh_token (access token di un'ora)
+- Meta (Facebook/Instagram): scambio fb_exchange_token per un nuovo token long-lived
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_with_session
+from app.models.social_connection import SocialConnection
+from app.services.publisher_service import publisher_service, response_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEAD_MINUTES = 1440
+
+
+# === CODA ===
+
+def claim_expiring_connections(
+    db: Session,
+    limit: int,
+    leads: Dict[str, int],
+    retry_seconds: int
+) -> List[Tuple[int, int, str]]:
+    """
+    Reclama fino a limit connessioni il cui token scade entro l'anticipo della loro piattaforma
+    e fa commit subito (refresh_attempted_at fa da lease). Restituisce (id, brand_id, piattaforma).
+    """
+    rows = db.execute(text("""
+        UPDATE social_connections SET refresh_attempted_at = now()
+        WHERE id IN (
+            SELECT id FROM social_connections
+            WHERE is_active
+              AND NOT needs_reauth
+              AND token_expires_at <= now() + make_interval(mins => :max_lead)
+              AND token_expires_at <= now() + make_interval(
+                  mins => COALESCE((CAST(:leads AS jsonb) ->> platform)::int, :default_lead)
+              )
+              AND (refresh_attempted_at IS NULL OR refresh_attempted_at < now() - make_interval(secs => :retry_seconds))
+            ORDER BY token_expires_at
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, brand_id, platform
+    """), {
+        "leads": json.dumps(leads),
+        "max_lead": max([DEFAULT_LEAD_MINUTES] + list(leads.values())),
+        "default_lead": DEFAULT_LEAD_MINUTES,
+        "retry_seconds": retry_seconds,
+        "limit": limit
+    }).all()
+    db.commit()
+    return [(connection_id, brand_id, platform) for connection_id, brand_id, platform in rows]
+
+
+def expires_at(seconds: Optional[int]) -> Optional[datetime]:
+    return datetime.now(timezone.utc) + timedelta(seconds=int(seconds)) if seconds else None
+
+
+def load_connection(db: Session, connection_id: int) -> Optional[SocialConnection]:
+    """Connessione attiva da rinnovare, staccata dalla sessione (nessuna transazione durante l'HTTP)"""
+    connection = db.query(SocialConnection).filter(SocialConnection.id == connection_id).first()
+    if not connection or not connection.is_active:
+        return None
+    db.expunge(connection)
+    return connection
+
+
+def save_refresh(
+    db: Session,
+    brand_id: int,
+    platform: str,
+    connection_ids: List[int],
+    old_token: str,
+    result: dict
+) -> int:
+    """
+    Salva l'esito del refresh sulle connessioni reclamate e su quelle dello stesso brand e
+    piattaforma che usano ancora il vecchio token. Restituisce quante ne ha aggiornate.
+    """
+    siblings = db.query(SocialConnection).filter(
+        SocialConnection.brand_id == brand_id,
+        SocialConnection.platform == platform,
+        SocialConnection.is_active == True
+    ).with_for_update().all()
+    targets = [c for c in siblings if c.id in connection_ids or c.access_token == old_token]
+
+    now = datetime.now(timezone.utc)
+    for target in targets:
+        if result["success"]:
+            target.access_token = result["access_token"]
+            # Meta: senza expires_in il token long-lived non scade
+            target.token_expires_at = expires_at(result.get("expires_in"))
+            if result.get("refresh_token"):
+                target.refresh_token = result["refresh_token"]
+                target.refresh_token_expires_at = expires_at(result.get("refresh_token_expires_in"))
+            target.token_refreshed_at = now
+            target.refresh_error = None
+        else:
+            target.refresh_error = result["error"]
+            target.needs_reauth = bool(result.get("reauth"))
+    db.commit()
+    return len(targets)
+
+
+# === REFRESH ===
+
+class TokenRefresher:
+    def __init__(
+        self,
+        poll_seconds: int = 300,
+        batch_size: int = 50,
+        concurrency: int = 8,
+        retry_seconds: int = 900,
+        leads: Optional[Dict[str, int]] = None,
+        linkedin_token_url: str = "https://www.linkedin.com/oauth/v2/accessToken",
+        google_token_url: str = "https://oauth2.googleapis.com/token",
+        graph_api_base: str = "https://graph.facebook.com/v18.0"
+    ):
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retry_seconds = retry_seconds
+        self.leads = leads or {}
+        self.linkedin_token_url = linkedin_token_url
+        self.google_token_url = google_token_url
+        self.graph_api_base = graph_api_base.rstrip("/")
+        self._stop: Optional[asyncio.Event] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Pool condiviso con il publisher (chiuso con lui allo shutdown)
+        return publisher_service.client("oauth")
+
+    async def request_refresh(self, connection: SocialConnection) -> dict:
+        """
+        Nuovo token per la connessione: {"success", "access_token", "expires_in", ...} oppure
+        {"success": False, "reauth": bool, "error"} (reauth = serve ricollegare l'account).
+        """
+        platform = connection.platform
+        if platform in ("linkedin", "google_business"):
+            if not connection.refresh_token:
+                return {"success": False, "reauth": True, "error": "Nessun refresh token: ricollega l'account"}
+            if platform == "linkedin":
+                url, client_id, client_secret = self.linkedin_token_url, settings.LINKEDIN_CLIENT_ID, settings.LINKEDIN_CLIENT_SECRET
+            else:
+                url, client_id, client_secret = self.google_token_url, settings.GOOGLE_CLIENT_ID, settings.GOOGLE_CLIENT_SECRET
+            response = await self.client.post(url, data={
+                "grant_type": "refresh_token",
+                "refresh_token": connection.refresh_token,
+                "client_id": client_id,
+                "client_secret": client_secret
+            })
+        elif platform in ("facebook", "instagram"):
+            response = await self.client.get(f"{self.graph_api_base}/oauth/access_token", params={
+                "grant_type": "fb_exchange_token",
+                "client_id": settings.META_APP_ID,
+                "client_secret": settings.META_APP_SECRET,
+                "fb_exchange_token": connection.access_token
+            })
+        else:
+            return {"success": False, "reauth": False, "error": f"Refresh non supportato per {platform}"}
+
+        result = response_json(response)
+        if response.status_code == 200 and result.get("access_token"):
+            return {"success": True, **result}
+
+        error = result.get("error")
+        if isinstance(error, dict):
+            # Graph API: 190 = token non valido/scaduto
+            reauth = error.get("code") == 190
+            message = error.get("message") or "Refresh fallito"
+        else:
+            # OAuth 2.0: invalid_grant = refresh token revocato o scaduto
+            reauth = error in ("invalid_grant", "unauthorized_client")
+            message = result.get("error_description") or error or f"HTTP {response.status_code}"
+        return {"success": False, "reauth": reauth and response.status_code < 500, "error": message}
+
+    async def refresh_group(self, connection_ids: List[int], semaphore: asyncio.Semaphore):
+        """
+        Rinnova una volta il token condiviso dalle connessioni dello stesso brand e piattaforma
+        (es. profilo e pagine LinkedIn) e lo salva su tutte quelle che usano ancora il vecchio.
+        """
+        async with semaphore:
+            try:
+                # Lettura e scrittura in sessioni brevi su un thread: nessuna connessione o
+                # lock tenuti durante la chiamata al provider
+                connection = await run_with_session(load_connection, connection_ids[0])
+                if not connection:
+                    return
+                old_token = connection.access_token
+                try:
+                    result = await self.request_refresh(connection)
+                except httpx.TransportError as e:
+                    result = {"success": False, "reauth": False, "error": f"Errore di rete: {e!r}"}
+
+                updated = await run_with_session(
+                    save_refresh, connection.brand_id, connection.platform, connection_ids, old_token, result
+                )
+
+                label = f"{connection.platform} brand {connection.brand_id} ({updated} connections)"
+                if result["success"]:
+                    logger.info(f"[TOKENS] Refreshed {label}")
+                elif result.get("reauth"):
+                    logger.warning(f"[TOKENS] {label} needs re-auth: {result['error']}")
+                else:
+                    logger.warning(f"[TOKENS] Refresh failed for {label}, retry later: {result['error']}")
+            except Exception as e:
+                logger.error(f"[TOKENS] Refresh error on connections {connection_ids}: {e}")
+
+    # === LOOP ===
+
+    async def tick(self) -> int:
+        """Reclama un lotto di connessioni in scadenza e le rinnova in parallelo"""
+        try:
+            claimed = await run_with_session(
+                claim_expiring_connections, self.batch_size, self.leads, self.retry_seconds
+            )
+        except Exception as e:
+            logger.error(f"[TOKENS] Claim error: {e}")
+            return 0
+
+        groups: Dict[Tuple[int, str], List[int]] = defaultdict(list)
+        for connection_id, brand_id, platform in claimed:
+            groups[(brand_id, platform)].append(connection_id)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self.refresh_group(ids, semaphore) for ids in groups.values()))
+        return len(claimed)
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self):
+        logger.info("[TOKENS] Token refresher started")
+        self._stop = asyncio.Event()
+        while not self._stop.is_set():
+            claimed = await self.tick()
+            if claimed >= self.batch_size:
+                continue  # altro lotto in scadenza
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+        logger.info("[TOKENS] Token refresher stopped")
+
+
+async def exchange_meta_token(client: httpx.AsyncClient, access_token: str) -> dict:
+    """Token utente Meta a breve durata -> long-lived (i token pagina derivati non scadono)"""
+    response = await client.get(
+        f"{settings.GRAPH_API_BASE.rstrip('/')}/oauth/access_token",
+        params={
+            "grant_type": "fb_exchange_token",
+            "client_id": settings.META_APP_ID,
+            "client_secret": settings.META_APP_SECRET,
+            "fb_exchange_token": access_token
+        }
+    )
+    return response_json(response)
+
+
+def build_token_refresher() -> TokenRefresher:
+    return TokenRefresher(
+        poll_seconds=settings.TOKEN_REFRESH_POLL_SECONDS,
+        batch_size=settings.TOKEN_REFRESH_BATCH_SIZE,
+        concurrency=settings.TOKEN_REFRESH_CONCURRENCY,
+        retry_seconds=settings.TOKEN_REFRESH_RETRY_SECONDS,
+        leads=settings.token_refresh_leads,
+        linkedin_token_url=settings.LINKEDIN_TOKEN_URL,
+        google_token_url=settings.GOOGLE_TOKEN_URL,
+        graph_api_base=settings.GRAPH_API_BASE
+    )
@@ -0,0 +1,214 @@
+"""
+Benchmark di concorrenza delle route async: Session sincrona vs AsyncSession (asyncpg).
+
+Avvia l'API con uvicorn in un processo separato (un worker) e vi aggiunge due route di prova
+con la stessa lettura delle route documenti (verifica del brand + prima pagina della knowledge
+base), una con il pattern precedente (route async + Session di get_db, che blocca l'event
+loop durante ogni query) e una con get_async_db. Per ciascuna manda --concurrency richieste
+in parallelo per --duration secondi e riporta richieste al secondo e latenza p50/p95/p99.
+
+--db-latency aggiunge a ogni richiesta un pg_sleep (ms) per simulare il round trip verso un
+database remoto: in locale una query costa pochi decimi di millisecondo e il blocco del loop
+si vede poco. Con --email si misura anche una route reale già migrata (lista documenti).
+
+Il pool del server è più grande della concorrenza: con la Session sincrona una richiesta che
+non trova connessioni libere blocca il loop sul checkout, e le connessioni tornano al pool solo
+nella chiusura di get_db, che a loop fermo non arriva più (stallo fino a pool_timeout).
+
+Usa il database di DATABASE_URL senza scrivere nulla.
+
+Uso:
+    python scripts/benchmark_async_db.py --concurrency 50 --duration 10 --db-latency 5
+    python scripts/benchmark_async_db.py --db-latency 0 --email admin@example.com
+"""
+import argparse
+import asyncio
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+# === SERVER ===
+
+def serve(args):
+    """Processo server: l'app reale più le due route di confronto"""
+    import uvicorn
+    from fastapi import Depends, HTTPException
+    from sqlalchemy import select, text
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import Session
+
+    from app.core.database import get_async_db, get_db
+    from app.main import app
+    from app.models.brand import Brand
+    from app.models.brand_document import BrandDocument
+
+    delay = args.db_latency / 1000
+
+    def documents_page(brand_id: int):
+        return select(BrandDocument).where(BrandDocument.brand_id == brand_id).order_by(
+            BrandDocument.uploaded_at.desc(), BrandDocument.id.desc()
+        ).limit(50)
+
+    @app.get("/_bench/sync/{brand_id}")
+    async def bench_sync(brand_id: int, db: Session = Depends(get_db)):
+        if delay:
+            db.execute(text("SELECT pg_sleep(:s)"), {"s": delay})
+        if not db.get(Brand, brand_id):
+            raise HTTPException(status_code=404, detail="Brand non trovato")
+        return {"documents": len(db.scalars(documents_page(brand_id)).all())}
+
+    @app.get("/_bench/async/{brand_id}")
+    async def bench_async(brand_id: int, db: AsyncSession = Depends(get_async_db)):
+        if delay:
+            await db.execute(text("SELECT pg_sleep(:s)"), {"s": delay})
+        if not await db.get(Brand, brand_id):
+            raise HTTPException(status_code=404, detail="Brand non trovato")
+        return {"documents": len((await db.scalars(documents_page(brand_id))).all())}
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+# === CLIENT ===
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{url}/api/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Il server non risponde su {url}")
+
+
+async def load(url: str, concurrency: int, duration: float, headers: Optional[dict] = None) -> dict:
+    """concurrency client in loop per duration secondi: richieste riuscite, errori e latenze"""
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, headers=headers, timeout=30) as client:
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    response = await client.get(url)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.monotonic() - started)
+                else:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return {"requests": len(latencies), "errors": errors, "elapsed": elapsed, "latencies": latencies}
+
+
+def report(label: str, result: dict) -> float:
+    rps = result["requests"] / result["elapsed"]
+    latencies = [value * 1000 for value in result["latencies"]]
+    print(
+        f"{label:>14}: {rps:8.1f} req/s  p50 {percentile(latencies, 50):7.1f}ms  "
+        f"p95 {percentile(latencies, 95):7.1f}ms  p99 {percentile(latencies, 99):7.1f}ms  "
+        f"({result['requests']} ok, {result['errors']} errors)"
+    )
+    return rps
+
+
+def first_brand_id() -> int:
+    from sqlalchemy import text
+    from app.core.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        brand_id = db.execute(text("SELECT min(id) FROM brands")).scalar()
+    finally:
+        db.close()
+    if brand_id is None:
+        raise SystemExit("Nessun brand nel database: serve almeno un brand")
+    return brand_id
+
+
+async def main(args):
+    brand_id = args.brand_id or first_brand_id()
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ)
+    # Pool uguale per le due sessioni e più grande della concorrenza (vedi sopra)
+    env["DATABASE_POOL_SIZE"] = env["DATABASE_ASYNC_POOL_SIZE"] = str(args.pool_size or args.concurrency + 10)
+    env["DATABASE_MAX_OVERFLOW"] = env["DATABASE_ASYNC_MAX_OVERFLOW"] = "0"
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", "--port", str(args.port), "--db-latency", str(args.db_latency)],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+    try:
+        await wait_ready(url)
+        print(
+            f"Brand {brand_id}, {args.concurrency} concurrent clients, {args.duration:g}s per run, "
+            f"db latency {args.db_latency:g}ms, pool {env['DATABASE_POOL_SIZE']}"
+        )
+        # Riscaldamento: connessioni del pool e client aperti
+        for variant in ("sync", "async"):
+            await load(f"{url}/_bench/{variant}/{brand_id}", args.concurrency, 1)
+
+        before = report("sync Session", await load(f"{url}/_bench/sync/{brand_id}", args.concurrency, args.duration))
+        after = report("AsyncSession", await load(f"{url}/_bench/async/{brand_id}", args.concurrency, args.duration))
+        if before:
+            print(f"{'speedup':>14}: {after / before:.2f}x")
+
+        if args.email:
+            from app.core.security import create_access_token
+
+            headers = {"Authorization": f"Bearer {create_access_token({'sub': args.email})}"}
+            report(
+                "documents/list",
+                await load(f"{url}/api/documents/list/{brand_id}", args.concurrency, args.duration, headers)
+            )
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10, help="Secondi per ciascuna variante")
+    parser.add_argument("--db-latency", type=float, default=5, help="Round trip simulato verso il database (ms)")
+    parser.add_argument("--pool-size", type=int, help="Pool sync e async del server (default: concorrenza + 10)")
+    parser.add_argument("--brand-id", type=int, help="Brand da leggere (default: il primo)")
+    parser.add_argument("--email", help="Utente per misurare anche la route reale /api/documents/list")
+    parser.add_argument("--port", type=int, default=18200)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        asyncio.run(main(args))
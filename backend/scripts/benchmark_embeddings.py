@@ -0,0 +1,81 @@
+"""
+Benchmark throughput del batcher di embedding con il provider fake locale.
+
+Confronta l'ingestion concorrente di N documenti tramite il batcher globale
+con il vecchio schema (slice fisse da 100 testi per documento, una richiesta alla volta).
+
+Uso:
+    python scripts/benchmark_embeddings.py --documents 20 --chunks 150 --rps 20
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.embedding_batcher import EmbeddingBatcher, EmbeddingRateLimitError, FakeEmbeddingProvider
+
+
+def make_documents(documents: int, chunks: int):
+    return [
+        [f"documento {d} chunk {c} " + "lorem ipsum " * 40 for c in range(chunks)]
+        for d in range(documents)
+    ]
+
+
+async def sequential_slices(provider, docs):
+    requests = 0
+    failed = 0
+
+    async def ingest(texts):
+        nonlocal requests, failed
+        for i in range(0, len(texts), 100):
+            requests += 1
+            try:
+                await provider.embed(texts[i:i + 100])
+            except EmbeddingRateLimitError:
+                # Il vecchio codice non ritenta: il documento finisce in "failed"
+                failed += len(texts)
+                return
+
+    await asyncio.gather(*(ingest(texts) for texts in docs))
+    return requests, failed
+
+
+async def batched(batcher, docs):
+    results = await asyncio.gather(*(batcher.embed(texts, [120] * len(texts)) for texts in docs))
+    assert all(len(r) == len(t) for r, t in zip(results, docs))
+    return batcher.stats["requests"]
+
+
+async def main(args):
+    docs = make_documents(args.documents, args.chunks)
+    total = args.documents * args.chunks
+
+    provider = FakeEmbeddingProvider(latency_ms=args.latency, requests_per_second=args.rps)
+    start = time.perf_counter()
+    requests, failed = await sequential_slices(provider, docs)
+    elapsed = time.perf_counter() - start
+    print(f"per-document slices: {requests:4d} requests  {elapsed:6.2f}s  {(total - failed) / elapsed:8.0f} chunks/s"
+          f"  (failed chunks: {failed})")
+
+    provider = FakeEmbeddingProvider(latency_ms=args.latency, requests_per_second=args.rps)
+    batcher = EmbeddingBatcher(provider=provider, max_in_flight=args.in_flight, max_inputs=args.max_inputs)
+    start = time.perf_counter()
+    requests = await batched(batcher, docs)
+    elapsed = time.perf_counter() - start
+    print(f"global batcher:      {requests:4d} requests  {elapsed:6.2f}s  {total / elapsed:8.0f} chunks/s"
+          f"  (retries: {batcher.stats['retries']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=150)
+    parser.add_argument("--latency", type=float, default=150, help="latenza simulata per richiesta (ms)")
+    parser.add_argument("--rps", type=float, default=None, help="rate limit simulato (richieste/s)")
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--max-inputs", type=int, default=None, help="input massimi per richiesta (default: limite provider)")
+    asyncio.run(main(parser.parse_args()))
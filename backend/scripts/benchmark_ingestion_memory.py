@@ -0,0 +1,80 @@
+"""
+Benchmark memoria dell'ingestion documenti: pipeline a finestre vs testo completo in memoria.
+
+Genera (se non esiste) un file TXT sintetico della dimensione richiesta ed esegue ciascuna
+modalità in un sottoprocesso separato, riportando il picco di RSS. Gli embedding usano
+il provider fake locale, quindi nessuna chiamata di rete e nessuna scrittura su DB.
+
+Uso:
+    python scripts/benchmark_ingestion_memory.py --size-mb 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ["EMBEDDING_PROVIDER"] = "fake"
+
+WORDS = "il la di che e un una per con non sono come più anche questo brand cliente prodotto servizio qualità".split()
+
+
+def make_file(path: Path, size_mb: int):
+    if path.exists() and path.stat().st_size >= size_mb * 1024 * 1024:
+        return
+    rng = random.Random(0)
+    with open(path, "w", encoding="utf-8") as f:
+        written = 0
+        while written < size_mb * 1024 * 1024:
+            para = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 200))) + ".\n\n"
+            f.write(para)
+            written += len(para)
+
+
+async def run_legacy(file_path: str):
+    """Schema precedente: testo completo, tutti i chunk e tutti gli embedding in memoria"""
+    from app.services.rag_service import rag_service
+    from app.services.embedding_batcher import embedding_batcher
+
+    text = rag_service.extract_text(file_path, "txt")
+    chunks = rag_service.chunk_text(text)
+    embeddings = await embedding_batcher.embed([c["content"] for c in chunks], [c["token_count"] for c in chunks])
+    return len(list(zip(chunks, embeddings)))
+
+
+async def run_streaming(file_path: str):
+    from app.services.rag_service import rag_service
+
+    count = 0
+    async for window in rag_service.iter_embedded_chunks(file_path, "txt", {}):
+        count += len(window)
+    return count
+
+
+def child(mode: str, file_path: str):
+    start = time.perf_counter()
+    runner = run_legacy if mode == "legacy" else run_streaming
+    chunks = asyncio.run(runner(file_path))
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:9s} chunks={chunks:6d}  time={elapsed:6.1f}s  peak RSS={peak_mb:8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--file", default="/tmp/noscite_ingestion_benchmark.txt")
+    parser.add_argument("--mode", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        child(args.mode, args.file)
+    else:
+        make_file(Path(args.file), args.size_mb)
+        for mode in ("streaming", "legacy"):
+            subprocess.run([sys.executable, __file__, "--mode", mode, "--file", args.file], check=True)
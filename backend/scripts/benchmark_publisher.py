@@ -0,0 +1,146 @@
+"""
+Benchmark throughput del PublisherService contro un server Graph/LinkedIn finto locale.
+
+Confronta i client HTTP condivisi e a lunga vita con il vecchio schema (un AsyncClient
+nuovo per ogni pubblicazione) pubblicando N post in concorrenza su LinkedIn, Facebook e
+Instagram, e conta le connessioni TCP aperte sul server.
+
+Uso:
+    python scripts/benchmark_publisher.py --publications 600 --concurrency 30 --latency 20
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.publisher_service import PublisherService
+
+PLATFORMS = ["linkedin", "facebook", "instagram"]
+
+
+# === SERVER FINTO ===
+
+def make_mock_app(latency_ms: float, connections: set) -> web.Application:
+    counter = {"id": 0}
+
+    async def respond(request: web.Request) -> web.Response:
+        connections.add(id(request.transport))
+        await request.read()
+        await asyncio.sleep(latency_ms / 1000)
+        counter["id"] += 1
+        return web.json_response({"id": str(counter["id"])}, status=201)
+
+    app = web.Application()
+    app.router.add_post("/v2/ugcPosts", respond)
+    app.router.add_post("/{account_id}/feed", respond)
+    app.router.add_post("/{account_id}/photos", respond)
+    app.router.add_post("/{account_id}/media", respond)
+    app.router.add_post("/{account_id}/media_publish", respond)
+    return app
+
+
+# === CLIENT ===
+
+class PerCallPublisherService(PublisherService):
+    """Vecchio schema: un client (e quindi connessioni nuove) per ogni pubblicazione"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._opened = []
+
+    def client(self, api: str) -> httpx.AsyncClient:
+        client = httpx.AsyncClient(timeout=self.timeout)
+        self._opened.append(client)
+        return client
+
+    async def aclose(self):
+        await asyncio.gather(*(client.aclose() for client in self._opened))
+        self._opened = []
+
+
+def make_publications(count: int):
+    publications = []
+    for i in range(count):
+        platform = PLATFORMS[i % len(PLATFORMS)]
+        post = SimpleNamespace(
+            id=i + 1,
+            content=f"Post di benchmark {i}",
+            hashtags=["benchmark"],
+            image_url="https://cdn.example.com/image.jpg" if platform == "instagram" else None,
+            media_type="image",
+            is_carousel=False,
+            carousel_images=None,
+            media_derivatives=None,
+            image_format=None
+        )
+        connection = SimpleNamespace(
+            platform=platform,
+            account_type="organization",
+            external_account_id=f"{platform}-account",
+            access_token="token"
+        )
+        publications.append((post, connection))
+    return publications
+
+
+async def run(service: PublisherService, publications, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def publish(post, connection):
+        nonlocal failures
+        async with semaphore:
+            result = await service.publish_post(post, connection)
+            if not result.get("success"):
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(publish(post, connection) for post, connection in publications))
+    elapsed = time.perf_counter() - start
+    await service.aclose()
+    return elapsed, failures
+
+
+async def main(args):
+    connections: set = set()
+    runner = web.AppRunner(make_mock_app(args.latency, connections))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    base = f"http://127.0.0.1:{args.port}"
+    publications = make_publications(args.publications)
+
+    try:
+        results = {}
+        for name, cls in (("per-call", PerCallPublisherService), ("pooled", PublisherService)):
+            connections.clear()
+            service = cls(
+                linkedin_api_base=base,
+                graph_api_base=base,
+                max_connections=args.concurrency
+            )
+            elapsed, failures = await run(service, publications, args.concurrency)
+            results[name] = elapsed
+            print(
+                f"{name:>9}: {args.publications} publications in {elapsed:.2f}s "
+                f"({args.publications / elapsed:.0f} pub/s), {len(connections)} connections, {failures} failures"
+            )
+        print(f"Speedup: {results['per-call'] / results['pooled']:.2f}x")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--publications", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=20, help="Latenza simulata per richiesta (ms)")
+    parser.add_argument("--port", type=int, default=18080)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,56 @@
+"""
+Benchmark latenza ricerca documenti: full-text vs vettoriale vs ibrida.
+
+Uso:
+    python scripts/benchmark_search.py --brand-id 9 --runs 20 "formazione" "come usiamo l'AI in aula?"
+
+La prima query vettoriale/ibrida paga l'embedding OpenAI; le successive usano la cache LRU,
+per questo vengono riportati separatamente il primo run (cold) e i successivi (warm).
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.database import SessionLocal
+from app.services.rag_service import rag_service
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(brand_id: int, queries: list, runs: int, limit: int):
+    db = SessionLocal()
+    try:
+        for mode in ("lexical", "vector", "hybrid", "auto"):
+            rag_service.embedding_cache.clear()
+            cold = []
+            warm = []
+            for query in queries:
+                for i in range(runs):
+                    start = time.perf_counter()
+                    rag_service.search(db, brand_id, query, limit, mode)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    (cold if i == 0 else warm).append(elapsed)
+            line = f"{mode:8s} cold p50={statistics.median(cold):8.1f}ms"
+            if warm:
+                line += f"  warm p50={statistics.median(warm):7.1f}ms p95={percentile(warm, 95):7.1f}ms"
+            print(line)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--brand-id", type=int, required=True)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("queries", nargs="+")
+    args = parser.parse_args()
+    run(args.brand_id, args.queries, args.runs, args.limit)
@@ -0,0 +1,347 @@
+"""
+Load test dello scheduler delle pubblicazioni contro il server finto delle piattaforme.
+
+Crea in un'organizzazione di test migliaia di pubblicazioni distribuite su una finestra di
+tempo (LinkedIn, Facebook, Instagram, con una quota di post con immagine), punta
+PublisherService a scripts/mock_social_server.py tramite LINKEDIN_API_BASE/GRAPH_API_BASE/...,
+fa girare lo scheduler (nel processo, o N processi scheduler_service in parallelo) finché
+tutte le pubblicazioni sono concluse e riporta:
+
+- percentuale in orario (pubblicate entro --on-time secondi da scheduled_for)
+- throughput (pubblicazioni al secondo, dal primo orario all'ultima pubblicazione)
+- ritardo p50/p95/p99/max, esiti, retry, staging e contatori del server finto
+
+Usa il database di DATABASE_URL; i dati di test vengono rimossi alla fine (--keep per tenerli).
+
+Uso:
+    python scripts/load_test_scheduler.py --publications 3000 --window 60 --latency 80 --error-rate 0.01
+    python scripts/load_test_scheduler.py --publications 5000 --window 0 --workers 4 --max-in-flight 50
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = SCRIPTS_DIR.parent
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from mock_social_server import add_mock_arguments, platform_bases
+
+TERMINAL_STATUSES = ("published", "failed", "dead_letter", "missed")
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def scheduler_environment(args, mock_url: str) -> Dict[str, str]:
+    """Configurazione di publisher e scheduler (variabili d'ambiente lette da Settings)"""
+    env = platform_bases(mock_url)
+    env.update({
+        "SCHEDULER_MAX_IN_FLIGHT": str(args.max_in_flight),
+        "SCHEDULER_PLATFORM_CONCURRENCY": args.platform_concurrency,
+        "SCHEDULER_POLL_SECONDS": str(args.poll),
+        "PUBLISH_RETRY_BASE_SECONDS": str(args.retry_base),
+        "PUBLISH_RETRY_MAX_SECONDS": str(args.retry_base * 8),
+        "PUBLISH_STAGING_LEAD_MINUTES": str(args.staging_lead),
+        "PUBLISHER_MAX_CONNECTIONS": str(args.max_in_flight),
+        # Una sessione per pubblicazione in corso, più tick, refresher e il polling del test
+        "DATABASE_POOL_SIZE": str(args.max_in_flight + 12),
+        "DATABASE_MAX_OVERFLOW": "5"
+    })
+    return env
+
+
+# === DATI DI TEST ===
+
+def write_test_image() -> str:
+    from app.services.media_store import media_store
+
+    data = os.urandom(64 * 1024)
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = media_store.blob_path(sha256, "jpg")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return media_store.url_for(sha256, "jpg")
+
+
+def seed(args, image_url: str) -> dict:
+    """Organizzazione, brand, progetto, connessioni (--accounts per piattaforma), post e pubblicazioni"""
+    from sqlalchemy import insert
+    from app.core.database import SessionLocal
+    from app.models import Brand, Post, PostPublication, Project, SocialConnection
+    from app.models.user import Organization
+
+    platforms = args.platforms.split(",")
+    db = SessionLocal()
+    try:
+        organization = Organization(name=f"Load test {datetime.now().isoformat(timespec='seconds')}")
+        db.add(organization)
+        db.flush()
+        brand = Brand(organization_id=organization.id, name="Load test")
+        db.add(brand)
+        db.flush()
+        project = Project(brand_id=brand.id, name="Load test", start_date=date.today(), end_date=date.today())
+        db.add(project)
+        db.flush()
+
+        connections = {platform: [] for platform in platforms}
+        for platform in platforms:
+            for i in range(args.accounts):
+                connection = SocialConnection(
+                    brand_id=brand.id,
+                    platform=platform,
+                    access_token=f"loadtest-{platform}-{i}",
+                    external_account_id=f"loadtest-{platform}-{i}",
+                    external_account_name=f"Load test {platform} {i}",
+                    account_type="organization" if platform == "linkedin" else "page",
+                    is_active=True
+                )
+                db.add(connection)
+                connections[platform].append(connection)
+        db.flush()
+
+        rng = random.Random(args.seed)
+        posts = []
+        for i in range(args.publications):
+            platform = platforms[i % len(platforms)]
+            with_image = platform == "instagram" or rng.random() < args.image_ratio
+            posts.append({
+                "project_id": project.id,
+                "platform": platform,
+                "title": f"Load test {i}",
+                "content": f"Post di load test {i}",
+                "hashtags": ["loadtest"],
+                "image_url": image_url if with_image else None,
+                "media_type": "image",
+                "media_derivatives": {},
+                "publication_status": "scheduled"
+            })
+        post_ids = db.execute(
+            insert(Post.__table__).returning(Post.__table__.c.id, sort_by_parameter_order=True),
+            posts
+        ).scalars().all()
+
+        start = datetime.now(timezone.utc) + timedelta(seconds=args.start_delay)
+        publications = []
+        for i, (post_id, post) in enumerate(zip(post_ids, posts)):
+            accounts = connections[post["platform"]]
+            offset = args.window * i / args.publications if args.window else 0
+            publications.append({
+                "post_id": post_id,
+                "social_connection_id": accounts[i // len(platforms) % len(accounts)].id,
+                "status": "scheduled",
+                "scheduled_for": start + timedelta(seconds=offset),
+                "retry_count": 0
+            })
+        db.execute(insert(PostPublication.__table__), publications)
+        db.commit()
+        return {"organization_id": organization.id, "brand_id": brand.id, "project_id": project.id, "start": start}
+    finally:
+        db.close()
+
+
+def collect(fixtures: dict) -> List[tuple]:
+    from sqlalchemy import text
+    from app.core.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return db.execute(text("""
+            SELECT pp.status, pp.scheduled_for, pp.published_at, pp.retry_count, pp.staged_at IS NOT NULL, c.platform
+            FROM post_publications pp
+            JOIN social_connections c ON c.id = pp.social_connection_id
+            WHERE c.brand_id = :brand_id
+        """), {"brand_id": fixtures["brand_id"]}).all()
+    finally:
+        db.close()
+
+
+def cleanup(fixtures: dict, image_url: str):
+    from sqlalchemy import text
+    from app.core.database import SessionLocal
+    from app.services.media_store import media_store
+
+    db = SessionLocal()
+    try:
+        params = {"brand_id": fixtures["brand_id"], "project_id": fixtures["project_id"]}
+        db.execute(text("DELETE FROM posts WHERE project_id = :project_id"), params)
+        db.execute(text("DELETE FROM post_tombstones WHERE project_id = :project_id"), params)
+        db.execute(text("DELETE FROM social_connections WHERE brand_id = :brand_id"), params)
+        db.execute(text("DELETE FROM projects WHERE id = :project_id"), params)
+        db.execute(text("DELETE FROM brands WHERE id = :brand_id"), params)
+        db.execute(text("DELETE FROM organizations WHERE id = :id"), {"id": fixtures["organization_id"]})
+        db.commit()
+    finally:
+        db.close()
+    path = Path(media_store.local_path(image_url))
+    if path.exists():
+        path.unlink()
+
+
+# === ESECUZIONE ===
+
+def start_process(command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env={**os.environ, **env})
+
+
+async def wait_for_mock(url: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(f"{url}/_stats")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def wait_until_done(fixtures: dict, total: int, deadline: float) -> bool:
+    while time.monotonic() < deadline:
+        rows = await asyncio.to_thread(collect, fixtures)
+        done = sum(1 for row in rows if row[0] in TERMINAL_STATUSES)
+        print(f"\r  {done}/{total} concluded", end="", flush=True)
+        if done >= total:
+            print()
+            return True
+        await asyncio.sleep(1)
+    print()
+    return False
+
+
+async def run_in_process(fixtures: dict, total: int, deadline: float) -> bool:
+    from app.services.publisher_service import publisher_service
+    from app.services.scheduler_service import build_scheduler
+
+    scheduler = build_scheduler()
+    task = asyncio.create_task(scheduler.run())
+    try:
+        return await wait_until_done(fixtures, total, deadline)
+    finally:
+        scheduler.stop()
+        await task
+        await publisher_service.aclose()
+
+
+def report(args, rows: List[tuple], elapsed: float, mock_stats: Optional[dict]):
+    statuses: Dict[str, int] = {}
+    for row in rows:
+        statuses[row[0]] = statuses.get(row[0], 0) + 1
+    published = [row for row in rows if row[0] == "published"]
+    lateness = [(row[2] - row[1]).total_seconds() for row in published]
+    on_time = sum(1 for value in lateness if value <= args.on_time)
+    span = (max(row[2] for row in published) - min(row[1] for row in published)).total_seconds() if published else 0
+
+    print(f"\nPublications: {len(rows)} in {elapsed:.1f}s")
+    print("Outcome: " + ", ".join(f"{status}={count}" for status, count in sorted(statuses.items())))
+    print(f"On time (<= {args.on_time:g}s): {on_time / len(rows) * 100:.1f}% ({on_time}/{len(rows)})")
+    print(f"Throughput: {len(published) / span:.1f} pub/s" if span > 0 else "Throughput: n/a")
+    print(
+        f"Lateness: p50 {percentile(lateness, 50):.2f}s, p95 {percentile(lateness, 95):.2f}s, "
+        f"p99 {percentile(lateness, 99):.2f}s, max {max(lateness, default=0):.2f}s"
+    )
+    print(f"Retried: {sum(1 for row in rows if row[3])}, staged ahead: {sum(1 for row in rows if row[4])}")
+    for platform in args.platforms.split(","):
+        values = [(row[2] - row[1]).total_seconds() for row in published if row[5] == platform]
+        print(f"  {platform:>10}: {len(values)} published, p99 {percentile(values, 99):.2f}s")
+    if mock_stats:
+        print("Mock server: " + ", ".join(
+            f"{key}={value}" for key, value in sorted(mock_stats.items()) if not key.startswith("requests")
+        ))
+
+
+async def main(args):
+    processes = []
+    mock_url = args.mock_url
+    if not mock_url:
+        mock_url = f"http://127.0.0.1:{args.port}"
+        processes.append(start_process([
+            sys.executable, str(SCRIPTS_DIR / "mock_social_server.py"),
+            "--port", str(args.port),
+            "--latency", str(args.latency),
+            "--jitter", str(args.jitter),
+            "--rate-limit", str(args.rate_limit),
+            "--error-rate", str(args.error_rate),
+            "--fatal-rate", str(args.fatal_rate),
+            "--ig-processing", str(args.ig_processing)
+        ], {}))
+    await wait_for_mock(mock_url)
+
+    # Prima di importare l'app: Settings legge le base URL e i limiti dall'ambiente
+    env = scheduler_environment(args, mock_url)
+    os.environ.update(env)
+
+    image_url = write_test_image()
+    fixtures = seed(args, image_url)
+    print(f"Seeded {args.publications} publications from {fixtures['start']:%H:%M:%S} over {args.window:g}s")
+    deadline = time.monotonic() + args.start_delay + args.window + args.timeout
+    started = time.monotonic()
+    try:
+        if args.workers > 1:
+            workers = [
+                start_process([sys.executable, "-m", "app.services.scheduler_service"], env)
+                for _ in range(args.workers)
+            ]
+            processes.extend(workers)
+            completed = await wait_until_done(fixtures, args.publications, deadline)
+        else:
+            completed = await run_in_process(fixtures, args.publications, deadline)
+        elapsed = time.monotonic() - started
+        if not completed:
+            print(f"Timeout: not all publications concluded within {args.timeout:g}s of the window")
+
+        async with httpx.AsyncClient() as client:
+            mock_stats = (await client.get(f"{mock_url}/_stats")).json()
+        report(args, collect(fixtures), elapsed, mock_stats)
+    finally:
+        for process in reversed(processes):
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not args.keep:
+            cleanup(fixtures, image_url)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--publications", type=int, default=2000)
+    parser.add_argument("--window", type=float, default=30, help="Secondi su cui distribuire gli orari (0 = tutte insieme)")
+    parser.add_argument("--start-delay", type=float, default=10, help="Secondi prima del primo orario")
+    parser.add_argument("--platforms", default="linkedin,facebook,instagram")
+    parser.add_argument("--accounts", type=int, default=5, help="Connessioni per piattaforma")
+    parser.add_argument("--image-ratio", type=float, default=0.3, help="Quota di post LinkedIn/Facebook con immagine")
+    parser.add_argument("--on-time", type=float, default=5, help="Ritardo massimo per considerare una pubblicazione in orario (s)")
+    parser.add_argument("--timeout", type=float, default=300, help="Attesa massima dopo la fine della finestra (s)")
+    parser.add_argument("--workers", type=int, default=1, help="Processi scheduler (1 = nel processo del test)")
+    parser.add_argument("--max-in-flight", type=int, default=50)
+    parser.add_argument("--platform-concurrency", default="linkedin=16,facebook=16,instagram=16")
+    parser.add_argument("--poll", type=int, default=5, help="SCHEDULER_POLL_SECONDS")
+    parser.add_argument("--retry-base", type=int, default=2, help="PUBLISH_RETRY_BASE_SECONDS")
+    parser.add_argument("--staging-lead", type=int, default=0, help="PUBLISH_STAGING_LEAD_MINUTES (0 = niente staging)")
+    parser.add_argument("--mock-url", help="Server finto già avviato (altrimenti ne parte uno locale)")
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Non rimuovere i dati di test")
+    add_mock_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,46 @@
+"""
+Garbage collection del media store (mark-and-sweep).
+
+Chiude gli upload a blocchi scaduti, riallinea media_references dai campi media dei post,
+poi elimina i blob non referenziati e non riscritti nelle ultime --grace-hours ore, i file
+su disco senza riga e i temporanei abbandonati. Pensato per girare da cron, ad es. una volta al giorno.
+
+Uso:
+    python scripts/media_gc.py --dry-run
+    python scripts/media_gc.py --grace-hours 48
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.services.media_store import media_store
+from app.services.chunked_upload import chunked_upload_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GC del media store")
+    parser.add_argument("--grace-hours", type=int, default=settings.MEDIA_GC_GRACE_HOURS)
+    parser.add_argument("--dry-run", action="store_true", help="Mostra cosa verrebbe eliminato senza eliminare")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        expired = 0 if args.dry_run else chunked_upload_service.expire_uploads(db)
+        stats = media_store.collect_garbage(db, grace_hours=args.grace_hours, dry_run=args.dry_run)
+    finally:
+        db.close()
+
+    prefix = "[DRY RUN] " if args.dry_run else ""
+    print(f"{prefix}Upload scaduti: {expired}")
+    print(f"{prefix}Post analizzati: {stats['posts_scanned']}")
+    print(f"{prefix}Blob eliminati: {stats['blobs_deleted']}")
+    print(f"{prefix}File orfani eliminati: {stats['orphan_files_deleted']}")
+    print(f"{prefix}Spazio liberato: {stats['bytes_freed'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Server finto di LinkedIn e Graph API (Facebook/Instagram) per load test e sviluppo locale.
+
+Implementa gli endpoint chiamati da PublisherService e dal refresher dei token, ognuno sotto
+un prefisso da usare come base URL:
+
+    LINKEDIN_API_BASE=http://127.0.0.1:18100/linkedin
+    GRAPH_API_BASE=http://127.0.0.1:18100/graph
+    INSTAGRAM_UPLOAD_BASE=http://127.0.0.1:18100/rupload
+    LINKEDIN_TOKEN_URL=http://127.0.0.1:18100/oauth/linkedin
+    GOOGLE_TOKEN_URL=http://127.0.0.1:18100/oauth/google
+
+Simula latenza (media + jitter), rate limit per account (429 con Retry-After su LinkedIn,
+errore Graph 32 su Facebook/Instagram), errori transitori e definitivi iniettati con una
+probabilità, ed elaborazione asincrona dei container Instagram (9007 se pubblicati prima
+che siano pronti). GET /_stats restituisce i contatori, POST /_stats/reset li azzera.
+
+Uso:
+    python scripts/mock_social_server.py --port 18100 --latency 80 --jitter 40 --rate-limit 5 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional
+
+from aiohttp import web
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 50
+    jitter_ms: float = 20
+    rate_limit: float = 0  # richieste al secondo per account (0 = nessun limite)
+    rate_limit_retry_after: float = 1
+    error_rate: float = 0  # probabilità di errore transitorio (5xx / Graph 2)
+    fatal_rate: float = 0  # probabilità di errore definitivo (4xx / Graph 100)
+    ig_processing_ms: float = 0  # tempo di elaborazione dei container Instagram
+    stats: Counter = field(default_factory=Counter)
+    windows: Dict[str, Deque[float]] = field(default_factory=lambda: defaultdict(deque))
+    containers: Dict[str, float] = field(default_factory=dict)
+    ids: itertools.count = field(default_factory=lambda: itertools.count(1))
+
+
+# === SIMULAZIONE ===
+
+def rate_limited(config: MockConfig, account: str) -> bool:
+    """Finestra scorrevole di un secondo per account"""
+    if not config.rate_limit:
+        return False
+    now = time.monotonic()
+    window = config.windows[account]
+    while window and window[0] <= now - 1:
+        window.popleft()
+    if len(window) >= config.rate_limit:
+        return True
+    window.append(now)
+    return False
+
+
+def graph_error(status: int, code: int, message: str, transient: bool = False) -> web.Response:
+    return web.json_response(
+        {"error": {"message": message, "type": "OAuthException", "code": code, "is_transient": transient}},
+        status=status
+    )
+
+
+def simulate(api: str, account_from=None):
+    """
+    Decoratore degli handler: latenza, rate limit e iniezione errori prima della risposta.
+    account_from estrae dalla richiesta la chiave del rate limit (default: l'account nel path).
+    """
+    def decorator(handler):
+        async def wrapper(request: web.Request) -> web.Response:
+            config: MockConfig = request.app["config"]
+            endpoint = f"{request.method} {request.match_info.route.resource.canonical}"
+            config.stats[f"requests {endpoint}"] += 1
+            delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+            await asyncio.sleep(max(delay, 0) / 1000)
+
+            account = account_from(request) if account_from else request.match_info.get("account", "-")
+            if rate_limited(config, f"{api}:{account}"):
+                config.stats["rate_limited"] += 1
+                if api.startswith("linkedin"):
+                    return web.json_response(
+                        {"status": 429, "message": "Resource level throttle limit reached"},
+                        status=429,
+                        headers={"Retry-After": str(config.rate_limit_retry_after)}
+                    )
+                return graph_error(400, 32, "Page request limit reached")
+
+            roll = random.random()
+            if roll < config.error_rate:
+                config.stats["transient_errors"] += 1
+                if api.startswith("linkedin"):
+                    return web.json_response({"status": 503, "message": "Service unavailable"}, status=503)
+                return graph_error(500, 2, "Service temporarily unavailable", transient=True)
+            if roll < config.error_rate + config.fatal_rate:
+                config.stats["fatal_errors"] += 1
+                if api.startswith("linkedin"):
+                    return web.json_response({"status": 422, "message": "Content is a duplicate", "code": "DUPLICATE_POST"}, status=422)
+                return graph_error(400, 100, "Invalid parameter")
+
+            response = await handler(request)
+            config.stats[f"status {response.status}"] += 1
+            return response
+        return wrapper
+    return decorator
+
+
+def next_id(request: web.Request) -> str:
+    return str(next(request.app["config"].ids))
+
+
+def linkedin_account(request: web.Request) -> str:
+    return request.headers.get("Authorization", "-")
+
+
+# === LINKEDIN ===
+
+@simulate("linkedin", linkedin_account)
+async def linkedin_register_upload(request: web.Request) -> web.Response:
+    asset_id = next_id(request)
+    base = f"{request.scheme}://{request.host}/linkedin"
+    return web.json_response({"value": {
+        "asset": f"urn:li:digitalmediaAsset:{asset_id}",
+        "uploadMechanism": {"com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest": {
+            "uploadUrl": f"{base}/upload/{asset_id}"
+        }}
+    }})
+
+
+@simulate("linkedin-upload", linkedin_account)
+async def linkedin_upload(request: web.Request) -> web.Response:
+    await request.read()
+    return web.Response(status=201, headers={"ETag": f"etag-{request.match_info['asset']}"})
+
+
+@simulate("linkedin", linkedin_account)
+async def linkedin_ugc_post(request: web.Request) -> web.Response:
+    return web.json_response({"id": f"urn:li:share:{next_id(request)}"}, status=201)
+
+
+@simulate("linkedin", linkedin_account)
+async def linkedin_videos(request: web.Request) -> web.Response:
+    if request.query.get("action") == "finalizeUpload":
+        return web.Response(status=200)
+    body = await request.json()
+    size = body["initializeUploadRequest"]["fileSizeBytes"]
+    video_id = next_id(request)
+    part = 4 * 1024 * 1024
+    base = f"{request.scheme}://{request.host}/linkedin"
+    return web.json_response({"value": {
+        "video": f"urn:li:video:{video_id}",
+        "uploadToken": "",
+        "uploadInstructions": [
+            {"uploadUrl": f"{base}/upload/{video_id}-{i}", "firstByte": start, "lastByte": min(start + part, size) - 1}
+            for i, start in enumerate(range(0, size, part))
+        ]
+    }})
+
+
+@simulate("linkedin", linkedin_account)
+async def linkedin_rest_post(request: web.Request) -> web.Response:
+    return web.Response(status=201, headers={"x-restli-id": f"urn:li:share:{next_id(request)}"})
+
+
+# === GRAPH ===
+
+@simulate("graph")
+async def graph_node(request: web.Request) -> web.Response:
+    return web.json_response({"id": request.match_info["account"]})
+
+
+@simulate("graph")
+async def graph_container_status(request: web.Request) -> web.Response:
+    config: MockConfig = request.app["config"]
+    now = time.monotonic()
+    return web.json_response({
+        container_id: {
+            "id": container_id,
+            "status_code": "FINISHED" if config.containers.get(container_id, 0) <= now else "IN_PROGRESS"
+        }
+        for container_id in request.query.get("ids", "").split(",") if container_id
+    })
+
+
+@simulate("graph")
+async def graph_create(request: web.Request) -> web.Response:
+    """POST /photos, /feed: un nuovo oggetto con id"""
+    await request.post()
+    return web.json_response({"id": f"{request.match_info['account']}_{next_id(request)}"})
+
+
+@simulate("graph")
+async def graph_videos(request: web.Request) -> web.Response:
+    form = await request.post()
+    phase = form.get("upload_phase")
+    if phase == "start":
+        size = int(form.get("file_size", 0))
+        return web.json_response({
+            "video_id": next_id(request),
+            "upload_session_id": next_id(request),
+            "start_offset": "0",
+            "end_offset": str(min(size, 4 * 1024 * 1024))
+        })
+    if phase == "transfer":
+        chunk = form.get("video_file_chunk")
+        end = int(form.get("start_offset", 0)) + (len(chunk.file.read()) if chunk is not None else 0)
+        return web.json_response({"start_offset": str(end), "end_offset": str(end)})
+    return web.json_response({"success": True})
+
+
+@simulate("graph")
+async def graph_media(request: web.Request) -> web.Response:
+    config: MockConfig = request.app["config"]
+    container_id = next_id(request)
+    config.containers[container_id] = time.monotonic() + config.ig_processing_ms / 1000
+    return web.json_response({"id": container_id})
+
+
+@simulate("graph")
+async def graph_media_publish(request: web.Request) -> web.Response:
+    config: MockConfig = request.app["config"]
+    form = await request.post()
+    ready_at = config.containers.get(form.get("creation_id"))
+    if ready_at is None:
+        return graph_error(400, 100, "Invalid creation_id")
+    if ready_at > time.monotonic():
+        return graph_error(400, 9007, "Media ID is not available")
+    config.containers.pop(form.get("creation_id"), None)
+    return web.json_response({"id": next_id(request)})
+
+
+@simulate("rupload")
+async def instagram_rupload(request: web.Request) -> web.Response:
+    await request.read()
+    return web.json_response({"success": True, "message": "Upload successful."})
+
+
+# === OAUTH ===
+
+@simulate("oauth")
+async def oauth_refresh(request: web.Request) -> web.Response:
+    return web.json_response({
+        "access_token": f"mock-token-{next_id(request)}",
+        "expires_in": 3600 if request.match_info["provider"] == "google" else 5184000
+    })
+
+
+@simulate("oauth")
+async def graph_exchange_token(request: web.Request) -> web.Response:
+    return web.json_response({"access_token": f"mock-long-lived-{next_id(request)}", "token_type": "bearer", "expires_in": 5183944})
+
+
+# === STATISTICHE ===
+
+async def get_stats(request: web.Request) -> web.Response:
+    return web.json_response(dict(request.app["config"].stats))
+
+
+async def reset_stats(request: web.Request) -> web.Response:
+    request.app["config"].stats.clear()
+    return web.json_response({"success": True})
+
+
+def make_mock_app(config: Optional[MockConfig] = None) -> web.Application:
+    app = web.Application(client_max_size=1024 ** 3)
+    app["config"] = config or MockConfig()
+    app.router.add_post("/linkedin/v2/assets", linkedin_register_upload)
+    app.router.add_put("/linkedin/upload/{asset}", linkedin_upload)
+    app.router.add_post("/linkedin/v2/ugcPosts", linkedin_ugc_post)
+    app.router.add_post("/linkedin/rest/videos", linkedin_videos)
+    app.router.add_post("/linkedin/rest/posts", linkedin_rest_post)
+    app.router.add_get("/graph/", graph_container_status)
+    app.router.add_get("/graph/oauth/access_token", graph_exchange_token)
+    app.router.add_get("/graph/{account}", graph_node)
+    app.router.add_post("/graph/{account}/photos", graph_create)
+    app.router.add_post("/graph/{account}/feed", graph_create)
+    app.router.add_post("/graph/{account}/videos", graph_videos)
+    app.router.add_post("/graph/{account}/media", graph_media)
+    app.router.add_post("/graph/{account}/media_publish", graph_media_publish)
+    app.router.add_post("/rupload/{container_id}", instagram_rupload)
+    app.router.add_post("/oauth/{provider}", oauth_refresh)
+    app.router.add_get("/_stats", get_stats)
+    app.router.add_post("/_stats/reset", reset_stats)
+    return app
+
+
+def platform_bases(base_url: str) -> Dict[str, str]:
+    """Variabili d'ambiente che puntano PublisherService e il refresher al server finto"""
+    base_url = base_url.rstrip("/")
+    return {
+        "LINKEDIN_API_BASE": f"{base_url}/linkedin",
+        "GRAPH_API_BASE": f"{base_url}/graph",
+        "INSTAGRAM_UPLOAD_BASE": f"{base_url}/rupload",
+        "LINKEDIN_TOKEN_URL": f"{base_url}/oauth/linkedin",
+        "GOOGLE_TOKEN_URL": f"{base_url}/oauth/google"
+    }
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=50, help="Latenza media per richiesta (ms)")
+    parser.add_argument("--jitter", type=float, default=20, help="Variazione casuale della latenza (ms)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Richieste al secondo per account (0 = illimitate)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Probabilità di errore transitorio")
+    parser.add_argument("--fatal-rate", type=float, default=0, help="Probabilità di errore definitivo")
+    parser.add_argument("--ig-processing", type=float, default=0, help="Elaborazione dei container Instagram (ms)")
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+        rate_limit=args.rate_limit,
+        error_rate=args.error_rate,
+        fatal_rate=args.fatal_rate,
+        ig_processing_ms=args.ig_processing
+    )
+
+
+async def main(args):
+    runner = web.AppRunner(make_mock_app(config_from_args(args)), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Mock social server on http://{args.host}:{args.port}")
+    for name, value in platform_bases(f"http://{args.host}:{args.port}").items():
+        print(f"  {name}={value}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(dict(runner.app["config"].stats), indent=2))
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18100)
+    add_mock_arguments(parser)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
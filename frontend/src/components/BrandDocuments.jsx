@@ -284,7 +284,9 @@ export default function BrandDocuments({ brandId }) {
                   <div className="flex justify-between items-start mb-1">
                     <span className="font-medium text-gray-700">{result.filename}</span>
                     <span className="text-xs text-green-600 bg-green-50 px-2 py-0.5 rounded">
-                      {(result.similarity * 100).toFixed(0)}% match
+                      {result.similarity != null
+                        ? `${(result.similarity * 100).toFixed(0)}% match`
+                        : 'parola chiave'}
                     </span>
                   </div>
                   <p className="text-gray-600 line-clamp-3">{result.content}</p>
@@ -145,6 +145,22 @@ export default function PostEditModal({ post, isOpen, onClose, onSave }) {
     }
   };
 
+  const waitForImageJob = async (postId, jobId) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 2000));
+      const response = await fetch(`${API_URL}/api/posts/${postId}/image-jobs/${jobId}`, {
+        headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` }
+      });
+      if (!response.ok) {
+        throw new Error('Errore nel recupero dello stato della generazione');
+      }
+      const job = await response.json();
+      if (['completed', 'partial', 'failed'].includes(job.status)) {
+        return job;
+      }
+    }
+  };
+
   const handleGenerateImage = async () => {
     setIsGeneratingImage(true);
     setMessage(null);
@@ -168,7 +184,11 @@ export default function PostEditModal({ post, isOpen, onClose, onSave }) {
         throw new Error(err.detail || 'Errore nella generazione immagine');
       }
       
-      const result = await response.json();
+      // La generazione gira in background: attende la fine del job
+      const result = await waitForImageJob(editedPost.id, (await response.json()).id);
+      if (result.status === 'failed') {
+        throw new Error(result.errors?.[0]?.error || 'Errore nella generazione immagine');
+      }
       // Aggiorna stato con le immagini generate
       const mainImage = result.images?.[0] || result.image_url;
       setEditedPost(prev => ({ 
@@ -179,7 +199,10 @@ export default function PostEditModal({ post, isOpen, onClose, onSave }) {
         is_carousel: result.is_carousel || false
       }));
       // Aggiorna stato carosello locale
-      if (result.images && result.images.length > 1) {
+      if (result.status === 'partial') {
+        setCarouselImages(result.images);
+        setMessage({ type: 'error', text: `⚠️ Carosello parziale: ${result.images.length} immagini su ${result.num_slides}` });
+      } else if (result.images && result.images.length > 1) {
         setCarouselImages(result.images);
         setMessage({ type: 'success', text: `🎠 Carosello generato: ${result.images.length} immagini!` });
       } else {
@@ -226,12 +249,94 @@ export default function PostEditModal({ post, isOpen, onClose, onSave }) {
     e.target.value = ''; // Reset input
   };
 
+  const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+
+  // Upload a blocchi riprendibile: se la connessione cade riprende dall'ultimo offset confermato
+  const uploadInChunks = async (file, onProgress) => {
+    const token = localStorage.getItem('token');
+    const authHeaders = { 'Authorization': `Bearer ${token}` };
+    const base = `${API_URL}/api/posts/${editedPost.id}/uploads`;
+    const resumeKey = `upload:${editedPost.id}:${file.name}:${file.size}:${file.lastModified}`;
+
+    let uploadId = localStorage.getItem(resumeKey);
+    let offset = 0;
+    if (uploadId) {
+      const status = await fetch(`${base}/${uploadId}`, { headers: authHeaders });
+      const upload = status.ok ? await status.json() : null;
+      if (upload && upload.status === 'uploading') {
+        offset = upload.offset;
+      } else {
+        uploadId = null;
+      }
+    }
+    if (!uploadId) {
+      const response = await fetch(base, {
+        method: 'POST',
+        headers: { ...authHeaders, 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, content_type: file.type, size: file.size })
+      });
+      if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.detail || 'Errore upload');
+      }
+      uploadId = (await response.json()).id;
+      localStorage.setItem(resumeKey, uploadId);
+    }
+
+    let retries = 0;
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + UPLOAD_CHUNK_SIZE);
+      try {
+        const response = await fetch(`${base}/${uploadId}`, {
+          method: 'PATCH',
+          headers: {
+            ...authHeaders,
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': String(offset)
+          },
+          body: chunk
+        });
+        if (response.status === 409 && response.headers.get('Upload-Offset')) {
+          offset = Number(response.headers.get('Upload-Offset'));
+          continue;
+        }
+        if (!response.ok) {
+          const error = await response.json();
+          if (response.status < 500 && response.status !== 423) {
+            localStorage.removeItem(resumeKey);
+            throw new Error(error.detail || 'Errore upload');
+          }
+          throw new Error(error.detail || `HTTP ${response.status}`);
+        }
+        offset = Number(response.headers.get('Upload-Offset'));
+        retries = 0;
+        onProgress(Math.round((offset / file.size) * 100));
+      } catch (error) {
+        if (retries >= 5 || !uploadId || !localStorage.getItem(resumeKey)) throw error;
+        retries += 1;
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** retries));
+        const status = await fetch(`${base}/${uploadId}`, { headers: authHeaders }).catch(() => null);
+        if (status && status.ok) {
+          offset = (await status.json()).offset;
+        }
+      }
+    }
+
+    const response = await fetch(`${base}/${uploadId}/finalize`, { method: 'POST', headers: authHeaders });
+    localStorage.removeItem(resumeKey);
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.detail || 'Errore upload');
+    }
+    return response.json();
+  };
+
   const handleVideoUpload = async (e) => {
     const file = e.target.files[0];
     if (!file) return;
     
-    if (file.size > 100 * 1024 * 1024) {
-      setMessage({ type: 'error', text: '❌ Video troppo grande. Max 100MB.' });
+    if (file.size > 2 * 1024 * 1024 * 1024) {
+      setMessage({ type: 'error', text: '❌ Video troppo grande. Max 2GB.' });
       return;
     }
     
@@ -239,24 +344,9 @@ export default function PostEditModal({ post, isOpen, onClose, onSave }) {
     setMessage({ type: 'info', text: '📤 Caricamento video in corso...' });
     
     try {
-      const token = localStorage.getItem('token');
-      const formData = new FormData();
-      formData.append('file', file);
-      
-      const response = await fetch(`${API_URL}/api/posts/${editedPost.id}/upload-media`, {
-        method: 'POST',
-        headers: {
-          'Authorization': `Bearer ${token}`
-        },
-        body: formData
+      const result = await uploadInChunks(file, (percent) => {
+        setMessage({ type: 'info', text: `📤 Caricamento video in corso... ${percent}%` });
       });
-      
-      if (!response.ok) {
-        const error = await response.json();
-        throw new Error(error.detail || 'Errore upload');
-      }
-      
-      const result = await response.json();
       setEditedPost(prev => ({ 
         ...prev, 
         image_url: result.media_url,